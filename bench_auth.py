@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import os
+import time
+from unittest.mock import patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+from bench_pipeline import percentile
+from services import auth
+
+# Per-request cost of authenticating an /api call (services/auth.authenticate),
+# by credential type. Firebase keys come from a local FakeFirebase JWKS and
+# tenants from FakeSupabase with the tenant cache warm, so the numbers are the
+# CPU cost of each path; the one-off key fetch is excluded.
+#
+#   phone_header      legacy X-Phone-Number (tenant cache hit)
+#   firebase_fresh    a token never seen before: RS256 signature + claim checks
+#   firebase_cached   the same token again: memoized claims + tenant cache
+#   session           Authorization: Session <token>: one HMAC, no lookups
+
+CALLS = int(os.getenv("BENCH_AUTH_CALLS", "2000"))
+
+
+async def measure(fn) -> list:
+    latencies = []
+    for i in range(CALLS):
+        start = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+async def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    firebase = fakes.start_fake_firebase()
+    verifier = auth.FirebaseVerifier(firebase.project_id, auth.FirebaseKeys(firebase.keys_url))
+    with fakes.installed() as env, patch.object(auth, "firebase_verifier", verifier):
+        tenant = env.db.add_tenant("+923001234567")
+        phone = tenant["phone_number"]
+        # Signing is the client's cost, not ours: mint the fresh tokens up front
+        fresh = [firebase.token(phone, sub=f"uid-{i}") for i in range(CALLS)]
+        cached = f"Bearer {fresh[0]}"
+        _, session = await auth.authenticate(cached)
+
+        async def phone_header(i):
+            await auth.authenticate(None, phone)
+
+        async def firebase_fresh(i):
+            await auth.authenticate(f"Bearer {fresh[i]}")
+
+        async def firebase_cached(i):
+            await auth.authenticate(cached)
+
+        async def session_token(i):
+            await auth.authenticate(f"Session {session}")
+
+        print(f"calls={CALLS} key_fetches={firebase.fetches} session_token={len(session)} chars")
+        print(f"{'credential':<16} {'p50 (us)':>9} {'p99 (us)':>9} {'mean (us)':>9} {'db calls':>9}")
+        for fn in (phone_header, firebase_fresh, firebase_cached, session_token):
+            before = env.db.total_calls()
+            latencies = await measure(fn)
+            print(f"{fn.__name__:<16} {percentile(latencies, 50) * 1e6:>9.1f} {percentile(latencies, 99) * 1e6:>9.1f} "
+                  f"{sum(latencies) / len(latencies) * 1e6:>9.1f} {env.db.total_calls() - before:>9}")
+    firebase.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
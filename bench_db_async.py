@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Compares concurrent-request throughput of the old blocking supabase-py calls
+# (made from inside async handlers) with the pooled async data layer.
+# A local stand-in for PostgREST adds a fixed latency to every query, so the
+# numbers reflect how well each approach overlaps network round trips.
+
+LATENCY = float(os.getenv("BENCH_DB_LATENCY", "0.05"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "50"))
+
+
+class FakePostgrestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        body = json.dumps([{"id": "tenant-1", "phone_number": "+923001234567", "business_name": "Bench Shop"}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops SYNs under a burst of new connections
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_server():
+    server = BenchServer(("127.0.0.1", 0), FakePostgrestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def bench_blocking(supabase_url: str):
+    from supabase import create_client
+
+    client = create_client(supabase_url, "bench-key")
+
+    async def handler():
+        # What every endpoint did before: a synchronous call inside `async def`
+        client.table("tenants").select("*").eq("phone_number", "+923001234567").execute()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handler() for _ in range(CONCURRENCY)))
+    return time.perf_counter() - start
+
+
+async def bench_async():
+    import services.db as db
+
+    start = time.perf_counter()
+    await asyncio.gather(*(db.get_tenant_by_phone("+923001234567") for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    await db.close_db()
+    return elapsed
+
+
+if __name__ == "__main__":
+    server = start_server()
+    supabase_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["SUPABASE_URL"] = supabase_url
+    os.environ["SUPABASE_KEY"] = "bench-key"
+
+    print(f"--- {CONCURRENCY} concurrent tenant lookups, {LATENCY * 1000:.0f} ms simulated DB latency ---")
+    before = asyncio.run(bench_blocking(supabase_url))
+    print(f"Blocking supabase-py: {before:.3f}s  ({CONCURRENCY / before:.1f} req/s)")
+    after = asyncio.run(bench_async())
+    print(f"Async pooled client:  {after:.3f}s  ({CONCURRENCY / after:.1f} req/s)")
+    print(f"Speedup: {before / after:.1f}x")
+    server.shutdown()
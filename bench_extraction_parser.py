@@ -0,0 +1,48 @@
+import json
+import time
+
+from services.extraction_parser import parse_extraction
+from test_extraction_parser import CORPUS
+
+# Parser benchmark over the malformed-output corpus: per-call cost of the new
+# parser vs the old strip-fences/slice/json.loads approach, and how many
+# entries each one can handle without asking Gemini again.
+
+ROUNDS = 2000
+
+
+def old_parse(text: str) -> dict:
+    text = text.replace("```json", "").replace("```", "")
+    if "{" in text and "}" in text:
+        text = text[text.find("{"):text.rfind("}") + 1]
+    return json.loads(text)
+
+
+def bench(name, fn):
+    ok = 0
+    for raw, _ in CORPUS:
+        try:
+            fn(raw)
+            ok += 1
+        except Exception:
+            pass
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for raw, _ in CORPUS:
+            try:
+                fn(raw)
+            except Exception:
+                pass
+    per_call = (time.perf_counter() - start) / (ROUNDS * len(CORPUS)) * 1e6
+    print(f"{name:<28} parsed {ok:>2}/{len(CORPUS)}   {per_call:6.1f} us/call")
+
+
+if __name__ == "__main__":
+    print(f"--- {len(CORPUS)} corpus entries x {ROUNDS} rounds ---")
+    bench("old (slice + json.loads)", old_parse)
+    bench("new (validate + repair)", parse_extraction)
+    clean = CORPUS[0][0]
+    start = time.perf_counter()
+    for _ in range(ROUNDS * 10):
+        parse_extraction(clean)
+    print(f"{'new, clean JSON-mode output':<28} {(time.perf_counter() - start) / (ROUNDS * 10) * 1e6:6.1f} us/call")
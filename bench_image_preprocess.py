@@ -0,0 +1,88 @@
+import asyncio
+import glob
+import os
+import statistics
+import time
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+from services.media_preprocess import preprocess_image, IMAGE_MAX_SIDE, IMAGE_GRAYSCALE, IMAGE_JPEG_QUALITY
+
+# Receipt-photo preprocessing (services/media_preprocess.py): bytes sent to
+# Gemini and CPU per image for a few settings, on BENCH_IMAGES_DIR (*.jpg,
+# *.jpeg, *.png: real phone photos) or, by default, synthetic 12 MP receipt
+# photos from fakes.receipt_photo().
+# The Gemini side: offline, the time to push the bytes through a
+# BENCH_UPLINK_MBPS uplink (the part of a call's latency the image size
+# drives). With GEMINI_API_KEY set and BENCH_GEMINI=1 it also times real
+# generate_content calls and reports the prompt tokens Gemini counted.
+
+IMAGES_DIR = os.getenv("BENCH_IMAGES_DIR")
+SYNTHETIC = int(os.getenv("BENCH_IMAGES", "5"))
+UPLINK_MBPS = float(os.getenv("BENCH_UPLINK_MBPS", "20"))
+REAL_GEMINI = os.getenv("BENCH_GEMINI") == "1" and bool(os.getenv("GEMINI_API_KEY"))
+
+# name: preprocess_image() settings (None = send the original)
+VARIANTS = {
+    "original": None,
+    "configured": dict(max_side=IMAGE_MAX_SIDE, grayscale=IMAGE_GRAYSCALE, quality=IMAGE_JPEG_QUALITY),
+    "2048 rgb q85": dict(max_side=2048, grayscale=False, quality=85),
+    "1600 gray q80": dict(max_side=1600, grayscale=True, quality=80),
+    "1280 gray q75": dict(max_side=1280, grayscale=True, quality=75),
+}
+
+
+def samples() -> list:
+    if IMAGES_DIR:
+        paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(IMAGES_DIR, f"*.{ext}")))
+        return [(open(p, "rb").read(), "image/png" if p.endswith(".png") else "image/jpeg") for p in paths]
+    sizes = [(4000, 3000), (3264, 2448), (4032, 3024)]
+    return [(fakes.receipt_photo(*sizes[i % len(sizes)], orientation=(1, 6, 8)[i % 3], seed=i), "image/jpeg")
+            for i in range(SYNTHETIC)]
+
+
+def run_variant(images: list, settings: dict) -> list:
+    """[(bytes out, cpu seconds, (data, mime_type))] per image."""
+    results = []
+    for data, mime_type in images:
+        if settings is None:
+            results.append((len(data), 0.0, (data, mime_type)))
+            continue
+        start = time.process_time()
+        out = preprocess_image(data, mime_type, **settings)
+        results.append((len(out[0]), time.process_time() - start, out))
+    return results
+
+
+async def gemini_call(data: bytes, mime_type: str):
+    from services.gemini_voice import get_model
+
+    start = time.perf_counter()
+    response = await asyncio.to_thread(get_model().generate_content, [{"mime_type": mime_type, "data": data}])
+    return time.perf_counter() - start, response.usage_metadata.prompt_token_count
+
+
+async def main():
+    images = samples()
+    print(f"images={len(images)} source={IMAGES_DIR or 'synthetic'} uplink={UPLINK_MBPS:g} Mbit/s")
+    header = f"{'variant':<15} {'KB/image':>9} {'ratio':>6} {'cpu ms p50':>10} {'cpu ms max':>10} {'upload ms':>10}"
+    print(header + (f" {'gemini s':>9} {'tokens':>7}" if REAL_GEMINI else ""))
+    original = None
+    for name, settings in VARIANTS.items():
+        results = run_variant(images, settings)
+        sizes = [r[0] for r in results]
+        cpu = [r[1] * 1000 for r in results]
+        mean_bytes = statistics.mean(sizes)
+        original = original or mean_bytes
+        line = (f"{name:<15} {mean_bytes / 1024:>9.0f} {original / mean_bytes:>5.1f}x {statistics.median(cpu):>10.1f} "
+                f"{max(cpu):>10.1f} {mean_bytes * 8 / (UPLINK_MBPS * 1e6) * 1000:>10.0f}")
+        if REAL_GEMINI:
+            calls = [await gemini_call(*r[2]) for r in results]
+            line += f" {statistics.median(c[0] for c in calls):>9.2f} {statistics.median(c[1] for c in calls):>7.0f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,176 @@
+import asyncio
+import contextlib
+import io
+import itertools
+import logging
+import os
+import time
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import httpx
+
+import fakes
+from main import app
+from services.agent_manager import agent_router
+
+# Offline throughput / latency benchmark of the request paths, against the
+# in-memory fakes in fakes.py (Supabase, Gemini, Twilio media). Each scenario
+# runs BENCH_REQUESTS requests through BENCH_CONCURRENCY concurrent clients and
+# reports throughput and p50/p95/p99 latency. The fakes' latencies stand in for
+# the network: FAKE_DB_LATENCY per PostgREST call, FAKE_GEMINI_LATENCY per
+# generate_content (blocking, like the real SDK), FAKE_MEDIA_LATENCY per download.
+# FAKE_GEMINI_LIMIT makes the Gemini fake answer 429 above that many concurrent
+# calls (0 = unlimited), to exercise services/gemini_admission.py.
+#
+#   agent_router    extraction -> DB writes/reads, no HTTP
+#   webhook_text    POST /whatsapp/webhook with text commands (local parser path)
+#   webhook_voice   POST /whatsapp/webhook with a voice note (download + Gemini)
+#   dashboard       GET /api/dashboard, a few writes mixed in to invalidate the cache
+
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "400"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "20"))
+TENANTS = int(os.getenv("BENCH_TENANTS", "10"))
+DB_LATENCY = float(os.getenv("FAKE_DB_LATENCY", "0.005"))
+GEMINI_LATENCY = float(os.getenv("FAKE_GEMINI_LATENCY", "0.2"))
+MEDIA_LATENCY = float(os.getenv("FAKE_MEDIA_LATENCY", "0.005"))
+GEMINI_LIMIT = int(os.getenv("FAKE_GEMINI_LIMIT", "0")) or None
+SCENARIOS = os.getenv("BENCH_SCENARIOS", "agent_router,webhook_text,webhook_voice,dashboard").split(",")
+
+COMMANDS = [
+    "10 bori aloo becha Rashid Bhai ko 2000 rupay",
+    "20 kg pyaz aya",
+    "aloo kitna hai",
+    "5 bori tamatar becha Imam ko udhaar 1500",
+    "tamatar kitne hain",
+]
+EXTRACTIONS = [
+    {"intent": "SALE", "item_name": "Potato", "quantity": 10, "unit": "Bori", "rate": 2000, "buyer_name": "Rashid Bhai"},
+    {"intent": "UPDATE", "item_name": "Onion", "quantity": 20, "unit": "kg", "action": "IN"},
+    {"intent": "QUERY", "item_name": "Potato"},
+]
+
+
+def percentile(sorted_values, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+async def run_load(request_fn, requests: int = REQUESTS, concurrency: int = CONCURRENCY) -> dict:
+    """
+    Calls `request_fn(i)` for i in range(requests) from `concurrency` workers.
+    request_fn returns True on success. Returns throughput and latency percentiles (ms).
+    """
+    counter = itertools.count()
+    latencies, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                ok = await request_fn(i)
+            except Exception as e:
+                print(f"request {i} failed: {e}")
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def seed(env) -> list:
+    tenants = []
+    for n in range(TENANTS):
+        tenant = env.db.add_tenant(f"+92300{n:07d}")
+        for item, qty in (("Potato", 500), ("Onion", 300), ("Tomato", 200)):
+            env.db.set_stock(tenant["id"], item, qty, "kg")
+        tenants.append(tenant)
+    return tenants
+
+
+def scenario_agent_router(env, client, tenants, run_id):
+    async def request(i):
+        result = await agent_router(tenants[i % len(tenants)]["id"], dict(EXTRACTIONS[i % len(EXTRACTIONS)]))
+        return result.get("status") == "success"
+    return request
+
+
+def _twiml_ok(response) -> bool:
+    # The webhook answers TwiML on success and a JSON error body otherwise
+    return response.status_code == 200 and response.headers["content-type"].startswith("application/xml")
+
+
+def scenario_webhook_text(env, client, tenants, run_id):
+    async def request(i):
+        response = await client.post("/whatsapp/webhook", data={
+            "From": f"whatsapp:{tenants[i % len(tenants)]['phone_number']}",
+            "Body": COMMANDS[i % len(COMMANDS)],
+            "MessageSid": f"SM{run_id}text{i}",
+        })
+        return _twiml_ok(response)
+    return request
+
+
+def scenario_webhook_voice(env, client, tenants, run_id):
+    # Distinct bytes per request so the extraction cache never answers for Gemini
+    async def request(i):
+        url = env.media.add(f"{run_id}-{i}", f"{COMMANDS[i % len(COMMANDS)]} #{i}".encode())
+        response = await client.post("/whatsapp/webhook", data={
+            "From": f"whatsapp:{tenants[i % len(tenants)]['phone_number']}",
+            "MediaUrl0": url, "MediaContentType0": "audio/ogg",
+            "MessageSid": f"SM{run_id}voice{i}",
+        })
+        return _twiml_ok(response)
+    return request
+
+
+def scenario_dashboard(env, client, tenants, run_id):
+    async def request(i):
+        tenant = tenants[i % len(tenants)]
+        if i % 10 == 9:
+            # Stock changed: the next dashboard read for this tenant is a miss
+            await agent_router(tenant["id"], dict(EXTRACTIONS[1]))
+        response = await client.get("/api/dashboard", headers={"X-Phone-Number": tenant["phone_number"]})
+        return response.status_code == 200
+    return request
+
+
+async def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    print(f"requests={REQUESTS} concurrency={CONCURRENCY} tenants={TENANTS} "
+          f"db={DB_LATENCY * 1000:g}ms gemini={GEMINI_LATENCY * 1000:g}ms media={MEDIA_LATENCY * 1000:g}ms")
+    print(f"{'scenario':<15} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7} {'db calls':>9}")
+    for name in SCENARIOS:
+        with fakes.installed(DB_LATENCY, GEMINI_LATENCY, MEDIA_LATENCY, gemini_limit=GEMINI_LIMIT) as env:
+            tenants = seed(env)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                request = globals()[f"scenario_{name}"](env, client, tenants, run_id=int(time.time()))
+                # Per-message log lines would only slow the run down and bury the table
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = await run_load(request)
+            print(f"{name:<15} {stats['throughput']:>9.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                  f"{stats['p99_ms']:>9.1f} {stats['errors']:>7} {env.db.total_calls():>9}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+# Cold-start cost of the app: how long `import main` takes in a fresh
+# interpreter (what uvicorn pays before it can bind the port), which modules
+# that time goes to, and what the lazily loaded SDKs would have added had they
+# still been imported eagerly. Uses `python -X importtime`, best of N runs.
+
+REPEAT = int(os.getenv("BENCH_STARTUP_REPEAT", "5"))
+TOP = int(os.getenv("BENCH_STARTUP_TOP", "12"))
+# Loaded on first use / by the background warm-up, no longer on import
+DEFERRED = ["postgrest", "google.generativeai", "jwt", "twilio.rest", "services.gemini_voice"]
+
+
+def import_times(statement: str) -> dict:
+    """{module: cumulative microseconds} for one fresh interpreter running `statement`."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, check=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def best_of(statement: str) -> dict:
+    runs = [import_times(statement) for _ in range(REPEAT)]
+    best = {}
+    for run in runs:
+        for name, us in run.items():
+            best[name] = min(best.get(name, us), us)
+    return best
+
+
+def top_level(times: dict) -> int:
+    """Total time: sum of the modules imported directly by the statement."""
+    return times.get("main", 0)
+
+
+if __name__ == "__main__":
+    print(f"--- import main (best of {REPEAT}) ---")
+    times = best_of("import main")
+    print(f"total: {top_level(times) / 1000:.1f} ms")
+    print(f"{'module':<45} {'cumulative (ms)':>15}")
+    for name, us in sorted(times.items(), key=lambda kv: kv[1], reverse=True)[:TOP]:
+        print(f"{name:<45} {us / 1000:>15.1f}")
+
+    print("\n--- deferred to first use / background warm-up ---")
+    deferred_total = 0
+    for module in DEFERRED:
+        loaded = [name for name in times if name == module]
+        cost = best_of(f"import main, {module}").get(module, 0)
+        deferred_total += cost
+        print(f"{module:<45} {cost / 1000:>15.1f}" + ("  (still imported by main!)" if loaded else ""))
+    print(f"{'eager import would add (approx.)':<45} {deferred_total / 1000:>15.1f}")
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import services.db as db
+from bench_pipeline import percentile
+from test_storage_backends import on_backend
+
+# Per-call latency of the services/db.py functions on the embedded storage
+# engine (DB_BACKEND=sqlite, a WAL file in a temp dir), next to the in-memory
+# FakeSupabase (linear scans, no indexes) for comparison. The tenant cache is
+# bypassed so every lookup reaches the store. Seeds BENCH_STORAGE_TENANTS
+# tenants with BENCH_STORAGE_TX transactions each, then times
+# BENCH_STORAGE_CALLS calls per operation.
+
+TENANTS = int(os.getenv("BENCH_STORAGE_TENANTS", "20"))
+TX_PER_TENANT = int(os.getenv("BENCH_STORAGE_TX", "2000"))
+CALLS = int(os.getenv("BENCH_STORAGE_CALLS", "2000"))
+BACKENDS = os.getenv("BENCH_STORAGE_BACKENDS", "sqlite,memory").split(",")
+ITEMS = ["Potato", "Onion", "Tomato", "Garlic", "Ginger"]
+
+
+async def seed():
+    tenants = []
+    for n in range(TENANTS):
+        tenant = await db.create_tenant(f"+92301{n:07d}")
+        lines = [{"item_name": ITEMS[i % len(ITEMS)], "quantity": 1 + i % 7, "unit": "kg",
+                  "transaction_type": "SALE" if i % 3 else "PURCHASE", "rate": 100,
+                  "buyer_name": f"Buyer {i % 25}", "is_credit": i % 4 == 0} for i in range(TX_PER_TENANT)]
+        await db.apply_stock_batch(tenant["id"], lines)
+        tenants.append(tenant)
+    return tenants
+
+
+async def measure(fn) -> list:
+    latencies = []
+    for i in range(CALLS):
+        start = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+async def run(name: str):
+    tenants = await seed()
+    page = await db.get_transactions_page(tenants[0]["id"], limit=50)
+
+    def tenant(i):
+        return tenants[i % len(tenants)]
+
+    async def tenant_lookup(i):
+        db.tenant_cache.invalidate(tenant(i)["phone_number"])
+        assert await db.get_tenant_by_phone(tenant(i)["phone_number"])
+
+    async def stock_read(i):
+        assert await db.get_inventory_item(tenant(i)["id"], ITEMS[i % len(ITEMS)])
+
+    async def inventory(i):
+        assert await db.get_inventory(tenant(i)["id"])
+
+    async def stock_write(i):
+        await db.add_inventory_log(tenant(i)["id"], ITEMS[i % len(ITEMS)], 1, "kg", "IN")
+
+    async def sale(i):
+        result = await db.record_transaction(tenant(i)["id"], ITEMS[i % len(ITEMS)], 1, "kg", "SALE", rate=90,
+                                             buyer_name="Rashid Bhai", is_credit=True)
+        assert result["status"] == "success"
+
+    async def history_page(i):
+        await db.get_transactions_page(tenants[0]["id"], limit=50, cursor=page["next_cursor"])
+
+    async def daily_totals(i):
+        await db.get_daily_totals(tenant(i)["id"])
+
+    async def buyer_balance(i):
+        await db.get_buyer_balance(tenant(i)["id"], "rashid")
+
+    for op in (tenant_lookup, stock_read, inventory, stock_write, sale, history_page, daily_totals, buyer_balance):
+        latencies = await measure(op)
+        print(f"{name:<8} {op.__name__:<14} {percentile(latencies, 50) * 1e6:>9.0f} "
+              f"{percentile(latencies, 99) * 1e6:>9.0f} {sum(latencies) / len(latencies) * 1e6:>9.0f}")
+
+
+async def main():
+    print(f"tenants={TENANTS} transactions/tenant={TX_PER_TENANT} calls/op={CALLS}")
+    print(f"{'backend':<8} {'operation':<14} {'p50 (us)':>9} {'p99 (us)':>9} {'mean (us)':>9}")
+    for name in BACKENDS:
+        with on_backend(name):
+            try:
+                await run(name)
+            finally:
+                await db.get_client().aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import services.db as db
+from test_transaction_history import generate_rows, start_fake_postgrest
+
+# Page latency vs depth for /api/transactions over a 1M-row ledger.
+# Runs against the SQLite-backed PostgREST stand-in from
+# test_transaction_history.py, with the same (tenant_id, created_at, id) index
+# as models/schema.sql. OFFSET has to walk past every skipped row; the keyset
+# cursor seeks straight to its position, so its latency stays flat.
+
+ROWS = int(os.getenv("BENCH_TX_ROWS", "1000000"))
+PAGE = int(os.getenv("BENCH_TX_PAGE", "50"))
+REPEAT = int(os.getenv("BENCH_TX_REPEAT", "5"))
+DEPTHS = [d for d in (0, 1_000, 10_000, 100_000, 500_000) if d < ROWS - PAGE] + [ROWS - PAGE]
+
+
+def cursor_at(server, position: int, item_name: str = None):
+    """Cursor for the row just before `position` (what a client paging that deep would hold)."""
+    if position == 0:
+        return None
+    conn = sqlite3.connect(server.db_path)
+    sql = "SELECT id, created_at FROM transactions WHERE tenant_id = 'tenant-1'"
+    params = []
+    if item_name:
+        sql += " AND item_name = ?"
+        params.append(item_name)
+    row = conn.execute(sql + " ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?", params + [position - 1]).fetchone()
+    conn.close()
+    return db.encode_cursor({"id": row[0], "created_at": row[1]})
+
+
+async def timed(fn):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        await fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+async def main(server):
+    db.supabase = db.create_db_client(f"http://127.0.0.1:{server.server_address[1]}", "bench-key")
+    print(f"{'depth':>9} {'offset (ms)':>12} {'keyset (ms)':>12} {'keyset+item (ms)':>17}")
+    try:
+        for depth in DEPTHS:
+            async def offset_page():
+                # The old approach: what a plain .range()/.offset() pager would send
+                base = db.supabase.table("transactions").select(db.TRANSACTION_COLUMNS).eq("tenant_id", "tenant-1")
+                await base.order("created_at", desc=True).order("id", desc=True).limit(PAGE).offset(depth).execute()
+
+            cursor = cursor_at(server, depth)
+            item_cursor = cursor_at(server, depth // 6, "Potato")
+
+            async def keyset_page():
+                page = await db.get_transactions_page("tenant-1", limit=PAGE, cursor=cursor)
+                assert len(page["transactions"]) == PAGE
+
+            async def item_page():
+                await db.get_transactions_page("tenant-1", limit=PAGE, cursor=item_cursor, item_name="Potato")
+
+            print(f"{depth:>9,} {await timed(offset_page):>12.2f} {await timed(keyset_page):>12.2f} "
+                  f"{await timed(item_page):>17.2f}")
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    print(f"--- Building {ROWS:,}-row ledger ---")
+    start = time.perf_counter()
+    server = start_fake_postgrest(generate_rows(ROWS))
+    print(f"built in {time.perf_counter() - start:.1f}s; page size {PAGE}, best of {REPEAT}")
+    asyncio.run(main(server))
+    server.shutdown()
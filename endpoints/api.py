@@ -1,53 +1,157 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+import asyncio
+from datetime import datetime, date
+from fastapi import APIRouter, HTTPException, Depends, Header, Response, Query
+from fastapi.responses import JSONResponse
 from services.db import (
-    get_tenant_by_phone, get_inventory, supabase, 
+    get_inventory, get_recent_transactions, get_transactions_page,
+    TRANSACTIONS_PAGE_SIZE, TRANSACTIONS_MAX_PAGE_SIZE,
+    get_daily_totals, get_buyer_balance, get_buyer_balances, rebuild_ledger_aggregates, ledger_today,
     update_inventory_item, delete_inventory_item, 
     update_transaction, delete_transaction
 )
+from services.item_index import item_index, resolve_item_name
+from services.dashboard_cache import dashboard_cache
+from services.auth import AuthError, authenticate
 from typing import Optional, Any
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api", tags=["api"])
 
-# Dependency to get user from phone number header (Simple Auth for MVP)
-# In production, this should verify a Firebase ID Token.
-async def get_current_user(x_phone_number: Optional[str] = Header(None)):
-    if not x_phone_number:
-        raise HTTPException(status_code=401, detail="Missing X-Phone-Number header")
-    
-    tenant = get_tenant_by_phone(x_phone_number)
-    if not tenant:
-         raise HTTPException(status_code=401, detail="User not found")
+# Dependency resolving the caller's tenant (see services/auth.py): a session
+# token, a Firebase ID token, or (legacy MVP) a bare X-Phone-Number header.
+async def get_current_user(response: Response, authorization: Optional[str] = Header(None),
+                           x_phone_number: Optional[str] = Header(None)):
+    try:
+        tenant, session = await authenticate(authorization, x_phone_number)
+    except AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    if session:
+        # Send this back as `Authorization: Session <token>` to skip Firebase verification
+        response.headers["X-Session-Token"] = session
     return tenant
 
 @router.get("/dashboard")
-async def get_dashboard_data(user: dict = Depends(get_current_user)):
-    inventory = get_inventory(user['id'])
-    
-    # Fetch recent transactions
-    transactions = []
+async def get_dashboard_data(user: dict = Depends(get_current_user), if_none_match: Optional[str] = Header(None)):
+    tenant_id = user['id']
+    version = dashboard_cache.version(tenant_id)
+    etag = dashboard_cache.etag(tenant_id, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    # Nothing was written since the client's copy: no body, no DB round trip
+    if dashboard_cache.matches(if_none_match, etag):
+        dashboard_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+
+    payload = dashboard_cache.get(tenant_id)
+    if payload is not None:
+        dashboard_cache.hits += 1
+        return JSONResponse(payload, headers=headers)
+
+    dashboard_cache.misses += 1
+    # Inventory + recent transactions in parallel
+    inventory, transactions = await asyncio.gather(
+        get_inventory(tenant_id),
+        get_recent_transactions(tenant_id, limit=20)
+    )
+
+    payload = {"inventory": inventory, "transactions": transactions, "user": user}
+    dashboard_cache.put(tenant_id, version, payload)
+    return JSONResponse(payload, headers=headers)
+
+@router.get("/transactions")
+async def list_transactions(
+    user: dict = Depends(get_current_user),
+    cursor: Optional[str] = None,
+    limit: int = Query(TRANSACTIONS_PAGE_SIZE, ge=1, le=TRANSACTIONS_MAX_PAGE_SIZE),
+    item: Optional[str] = None,
+    buyer: Optional[str] = None,
+    credit_only: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Transaction history, newest first. Pass back `next_cursor` as `cursor`
+    to get the following page; it is null on the last page.
+    """
+    # "aloo" finds the tenant's "Potato" rows
+    item_name = await resolve_item_name(user['id'], item, register=False) if item else None
     try:
-        response = supabase.table("transactions").select("*").eq("tenant_id", user['id']).order("created_at", desc=True).limit(20).execute()
-        transactions = response.data
+        return await get_transactions_page(
+            user['id'], limit=limit, cursor=cursor, item_name=item_name, buyer_name=buyer,
+            credit_only=credit_only,
+            since=since.isoformat() if since else None,
+            until=until.isoformat() if until else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Error fetching transactions: {e}")
+        print(f"Error fetching transaction history: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch transactions")
 
-    return {"inventory": inventory, "transactions": transactions, "user": user}
+# --- Ledger aggregates (daily totals, khata) ---
+@router.get("/ledger/daily")
+async def daily_ledger(user: dict = Depends(get_current_user), day: Optional[date] = None):
+    """Per-item sales and purchases for one business day (default: today, PKT)."""
+    day = day.isoformat() if day else ledger_today()
+    rows = await get_daily_totals(user['id'], day)
+    totals = {"SALE": 0.0, "PURCHASE": 0.0}
+    for row in rows:
+        totals[row["transaction_type"]] = totals.get(row["transaction_type"], 0.0) + float(row["total_amount"] or 0)
+    return {
+        "day": day,
+        "items": rows,
+        "sales_total": totals["SALE"],
+        "purchases_total": totals["PURCHASE"],
+    }
+
+@router.get("/ledger/khata")
+async def khata_balances(user: dict = Depends(get_current_user)):
+    """Outstanding credit per buyer, largest first."""
+    buyers = await get_buyer_balances(user['id'])
+    return {"buyers": buyers, "total_outstanding": sum(float(b["balance"] or 0) for b in buyers)}
+
+@router.get("/ledger/khata/{buyer_name}")
+async def khata_balance(buyer_name: str, user: dict = Depends(get_current_user)):
+    khata = await get_buyer_balance(user['id'], buyer_name)
+    if not khata:
+        raise HTTPException(status_code=404, detail="No khata for this buyer")
+    return khata
+
+@router.post("/ledger/rebuild")
+async def rebuild_ledger(user: dict = Depends(get_current_user)):
+    """Recomputes this tenant's aggregates from the transactions table."""
+    try:
+        scanned = await rebuild_ledger_aggregates(user['id'])
+    except Exception as e:
+        print(f"Error rebuilding ledger aggregates: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild ledger")
+    return {"status": "success", "transactions_scanned": scanned}
 
 # --- Inventory CRUD ---
 @router.put("/inventory/{item_id}")
 async def update_inventory(item_id: int, payload: dict, user: dict = Depends(get_current_user)):
-    return update_inventory_item(item_id, payload)
+    result = await update_inventory_item(item_id, payload, tenant_id=user['id'])
+    # The item may have been renamed: rebuild this tenant's name index on next use
+    item_index.forget_tenant(user['id'])
+    dashboard_cache.bump(user['id'])
+    return result
 
 @router.delete("/inventory/{item_id}")
 async def delete_inventory(item_id: int, user: dict = Depends(get_current_user)):
-    return delete_inventory_item(item_id)
+    result = await delete_inventory_item(item_id, tenant_id=user['id'])
+    item_index.forget_tenant(user['id'])
+    dashboard_cache.bump(user['id'])
+    return result
 
 # --- Transaction CRUD ---
 @router.put("/transactions/{tx_id}")
 async def update_tx(tx_id: str, payload: dict, user: dict = Depends(get_current_user)):
-    return update_transaction(tx_id, payload)
+    result = await update_transaction(tx_id, payload)
+    dashboard_cache.bump(user['id'])
+    return result
 
 @router.delete("/transactions/{tx_id}")
 async def delete_tx(tx_id: str, user: dict = Depends(get_current_user)):
-    return delete_transaction(tx_id)
+    result = await delete_transaction(tx_id)
+    dashboard_cache.bump(user['id'])
+    return result
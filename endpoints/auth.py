@@ -1,5 +1,7 @@
-from fastapi import APIRouter, HTTPException, Body
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Body, Header
 from services.db import get_tenant_by_phone, create_tenant
+from services.auth import AuthError, SESSION_TTL, authenticate
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -14,7 +16,7 @@ class RegisterRequest(BaseModel):
 @router.post("/login")
 async def login(data: LoginRequest = Body(...)):
     # Standardize phone number format if needed (e.g. ensure + prefix)
-    tenant = get_tenant_by_phone(data.phone_number)
+    tenant = await get_tenant_by_phone(data.phone_number)
     
     if not tenant:
         # In a real app we might return 404, but for security sometimes 200 with specific status is used.
@@ -26,12 +28,26 @@ async def login(data: LoginRequest = Body(...)):
 @router.post("/register")
 async def register(data: RegisterRequest = Body(...)):
     # Check if already exists
-    existing = get_tenant_by_phone(data.phone_number)
+    existing = await get_tenant_by_phone(data.phone_number)
     if existing:
          return {"status": "success", "user": existing, "message": "User already exists"}
 
-    new_tenant = create_tenant(data.phone_number, data.business_name)
+    new_tenant = await create_tenant(data.phone_number, data.business_name)
     if not new_tenant:
         raise HTTPException(status_code=500, detail="Failed to create user")
         
     return {"status": "success", "user": new_tenant}
+
+@router.post("/session")
+async def session(authorization: Optional[str] = Header(None)):
+    """
+    Exchanges a Firebase ID token (`Authorization: Bearer <token>`) for a session
+    token; use `Authorization: Session <token>` on /api/* until it expires.
+    """
+    if not (authorization or "").lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Expected a Firebase ID token")
+    try:
+        tenant, token = await authenticate(authorization)
+    except AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return {"status": "success", "user": tenant, "session_token": token, "expires_in": SESSION_TTL}
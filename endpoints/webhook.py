@@ -1,11 +1,19 @@
 from fastapi import APIRouter, Request, Form
 from typing import Optional
+from services.metrics import span, new_trace, log
 
 router = APIRouter()
 
 @router.post("/whatsapp/webhook")
 async def whatsapp_webhook(request: Request):
+    # Everything from form parsing to the TwiML reply
+    with span("webhook"):
+        return await handle_webhook(request)
+
+async def handle_webhook(request: Request):
     form_data = await request.form()
+    # Tag this message's log lines (and its metrics) with its Twilio MessageSid
+    new_trace(form_data.get("MessageSid"))
     # Basic Twilio webhook structure
     sender = form_data.get("From") # e.g., whatsapp:+923001234567
     media_url = form_data.get("MediaUrl0") # Twilio sends media URLs like this
@@ -19,74 +27,31 @@ async def whatsapp_webhook(request: Request):
     # if not validator.validate(url, dict(form_data), twilio_signature):
     #    return {"status": "error", "message": "Invalid signature"}
 
-    print(f"Received message from {sender}, Media: {media_url}, Type: {media_type}")
+    log(f"Received message from {sender}, Media: {media_url}, Type: {media_type}")
 
-    if not media_url:
-        # Check if it's a text message that we can also process? 
-        # For now, MVP focuses on Voice/Image.
-        if form_data.get("Body"):
-             print("Received text message, ignoring for Voice/Image First MVP")
-             return {"status": "ignored", "reason": "text_only"}
+    body = form_data.get("Body")
+    if not media_url and not body:
         return {"status": "ignored", "reason": "no_media"}
         
-    # Process Voice Note or Image
-    try:
-        from services.gemini_voice import process_media_url
-        from services.db import get_tenant_by_phone, add_inventory_log
-        import json
-        
-        # 1. Identify Tenant
-        # Remove 'whatsapp:' prefix
-        clean_phone = sender.replace("whatsapp:", "")
-        # For MVP/Sandboxes, sometimes phone format varies. Robustify?
-        tenant = get_tenant_by_phone(clean_phone)
-        
-        if not tenant:
-            print(f"Refused: User {clean_phone} not registered in tenants table.")
-            # Optional: Send a "Please Signup" message back
-            from twilio.twiml.messaging_response import MessagingResponse
-            resp = MessagingResponse()
-            resp.message(f"Salaam! Aap registered nahi hain. Please admin se contact karein. ID: {clean_phone}")
-            from fastapi.responses import Response
-            return Response(content=str(resp), media_type="application/xml")
+    # Queue mode: persist and acknowledge right away so we never hit Twilio's 15s timeout.
+    # The reply is sent later through the Twilio REST API by the job queue workers.
+    from services.job_queue import WEBHOOK_MODE, get_job_queue
+    if WEBHOOK_MODE == "queue":
+        get_job_queue().enqueue(dict(form_data), message_sid=form_data.get("MessageSid"))
+        from fastapi.responses import Response
+        return Response(content="<Response></Response>", media_type="application/xml")
 
-        # 2. Process Media with Gemini
-        extraction_json_str = await process_media_url(media_url, media_type or "")
-        
-        # Clean up code blocks if Gemini returns them
-        extraction_json_str = extraction_json_str.replace("```json", "").replace("```", "")
-        # Handle cases where Gemini adds text before/after JSON
-        if "{" in extraction_json_str and "}" in extraction_json_str:
-            start = extraction_json_str.find("{")
-            end = extraction_json_str.rfind("}") + 1
-            extraction_json_str = extraction_json_str[start:end]
-            
-        data = json.loads(extraction_json_str)
-        
-        # 3. Agentic Routing (Database Update)
-        from services.agent_manager import agent_router
-        
-        # Add tenant_id context
-        extraction_data = data
-        
-        # Execute DB Action
-        db_result = await agent_router(tenant['id'], extraction_data)
-        
-        # 4. Construct Response (The Trust Loop)
-        # Use the Roman Urdu summary from Gemini if available
-        summary = data.get("summary_for_user")
-        
-        if not summary:
-            # Fallback if Gemini failed to generate summary
-            intent = data.get("intent", "UNKNOWN")
-            if intent == "UPDATE":
-                summary = f"Done: {data.get('item_name')} {data.get('quantity')} {data.get('unit')} {data.get('action')}"
-            else:
-                summary = "Maaf kijiye, samajh nahi aaya. Dobara boliye."
+    # Process Voice Note, Image or Text command
+    try:
+        from services.whatsapp_pipeline import build_reply
+        from services.idempotency import idempotency_store
 
-        # If DB error, append warning
-        if isinstance(db_result, dict) and db_result.get("status") == "error":
-             summary += f" (Note: System Error - {db_result.get('message')})"
+        # A Twilio retry of the same MessageSid gets the first run's reply
+        # instead of updating stock (and calling Gemini) a second time
+        summary = await idempotency_store.run(
+            form_data.get("MessageSid"),
+            lambda: build_reply(sender, media_url, media_type, body)
+        )
 
         # Send Reply
         from twilio.twiml.messaging_response import MessagingResponse
@@ -98,7 +63,7 @@ async def whatsapp_webhook(request: Request):
         return Response(content=str(resp), media_type="application/xml")
 
     except Exception as e:
-        print(f"Error processing webhook: {e}")
+        log(f"Error processing webhook: {e}")
         # In prod, logging.exception(e)
         return {"status": "error", "message": str(e)}
 
@@ -0,0 +1,812 @@
+import asyncio
+import io
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# In-memory stand-ins for the app's external services, for tests and offline
+# benchmarks (see bench_pipeline.py):
+#   FakeSupabase     the table()/rpc() query-builder surface services/db.py uses,
+#                    with the schema.sql RPCs and ledger trigger reimplemented
+#   FakeGeminiModel  generate_content() with configurable latency; "transcribes"
+#                    a voice note by decoding its bytes and parses the text locally
+#   FakeMediaServer  a local HTTP server playing Twilio's MediaUrl
+#   FakeTwilioClient records REST replies instead of sending them
+#   FakeFirebase     signs Firebase-style ID tokens and serves their JWKS
+# installed() wires all of them into the app at once. The Supabase, Gemini,
+# media and Twilio fakes each have `faults` (see Faults) to script outages.
+
+# Business day of the ledger; same as ledger_day() in schema.sql
+PKT = timezone(timedelta(hours=5))
+
+
+class Faults:
+    """
+    Scripted failures for a fake: faults.add(3, error=ConnectionError("down"))
+    makes its next 3 calls raise, faults.add(1, hang=5) stalls the next one for
+    5s first. For FakeMediaServer `error` is the HTTP status to answer with.
+    """
+
+    def __init__(self):
+        self._plan = []
+        self._lock = threading.Lock()
+        self.injected = 0
+
+    def add(self, times: int = 1, error=None, hang: float = 0.0):
+        with self._lock:
+            self._plan.extend([(error, hang)] * times)
+
+    def clear(self):
+        with self._lock:
+            self._plan.clear()
+
+    def take(self):
+        """(error, hang) for this call, or None to behave normally."""
+        with self._lock:
+            if not self._plan:
+                return None
+            self.injected += 1
+            return self._plan.pop(0)
+
+    async def hit(self):
+        fault = self.take()
+        if fault:
+            error, hang = fault
+            if hang:
+                await asyncio.sleep(hang)
+            if error is not None:
+                raise error
+
+    def hit_sync(self):
+        fault = self.take()
+        if fault:
+            error, hang = fault
+            if hang:
+                time.sleep(hang)
+            if error is not None:
+                raise error
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _coerce(current, value):
+    """A filter value (often a string, as PostgREST receives it) in the column's type."""
+    if isinstance(current, bool):
+        return value if isinstance(value, bool) else str(value).lower() == "true"
+    if isinstance(current, (int, float)) and not isinstance(value, (int, float)):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    if isinstance(current, str) and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+def _like(pattern: str, case_sensitive: bool):
+    """SQL LIKE (with backslash escapes) -> compiled regex."""
+    out, escaped = [], False
+    for ch in pattern:
+        if escaped:
+            out.append(re.escape(ch))
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == "%":
+            out.append(".*")
+        elif ch == "_":
+            out.append(".")
+        else:
+            out.append(re.escape(ch))
+    return re.compile("^" + "".join(out) + "$", 0 if case_sensitive else re.IGNORECASE | re.DOTALL)
+
+
+def _compare(op: str, current, value) -> bool:
+    if op in ("like", "ilike"):
+        return current is not None and bool(_like(value, op == "like").match(str(current)))
+    if current is None:
+        return op == "neq" and value is not None
+    value = _coerce(current, value)
+    try:
+        return {
+            "eq": current == value, "neq": current != value,
+            "gt": current > value, "gte": current >= value,
+            "lt": current < value, "lte": current <= value,
+        }[op]
+    except TypeError:
+        return False
+
+
+def parse_logic_tree(text: str):
+    """
+    PostgREST `or=(...)` syntax -> predicate. Handles nested and()/or() and
+    double-quoted values, e.g. created_at.lt."X",and(created_at.eq."X",id.lt."Y").
+    """
+    pos = 0
+
+    def parse_list(closing):
+        nonlocal pos
+        items = []
+        while True:
+            items.append(parse_item())
+            if pos < len(text) and text[pos] == ",":
+                pos += 1
+                continue
+            if closing:
+                assert text[pos] == ")", text
+                pos += 1
+            return items
+
+    def parse_value():
+        nonlocal pos
+        if text[pos] == '"':
+            pos += 1
+            out = []
+            while text[pos] != '"':
+                if text[pos] == "\\":
+                    pos += 1
+                out.append(text[pos])
+                pos += 1
+            pos += 1
+            return "".join(out)
+        start = pos
+        while pos < len(text) and text[pos] not in ",)":
+            pos += 1
+        return text[start:pos]
+
+    def parse_item():
+        nonlocal pos
+        for group in ("and(", "or("):
+            if text.startswith(group, pos):
+                pos += len(group)
+                children = parse_list(closing=True)
+                combine = all if group == "and(" else any
+                return lambda row, c=children, f=combine: f(p(row) for p in c)
+        column, op = re.match(r"([a-z_]+)\.([a-z]+)\.", text[pos:]).groups()
+        pos += len(column) + len(op) + 2
+        value = parse_value()
+        return lambda row: _compare(op, row.get(column), value)
+
+    if text.startswith("(") and text.endswith(")"):
+        text = text[1:-1]
+    predicates = parse_list(closing=False)
+    return lambda row: any(p(row) for p in predicates)
+
+
+class FakeQuery:
+    """One table()... chain; filters and modifiers accumulate until execute()."""
+
+    def __init__(self, db, table: str):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = 0
+
+    # --- actions ---
+    def select(self, columns: str = "*", **kwargs):
+        self.columns = columns
+        return self
+
+    def insert(self, data, **kwargs):
+        self.action, self.payload = "insert", data
+        return self
+
+    def update(self, data, **kwargs):
+        self.action, self.payload = "update", data
+        return self
+
+    def delete(self, **kwargs):
+        self.action = "delete"
+        return self
+
+    # --- filters ---
+    def _filter(self, op, column, value):
+        self.filters.append(lambda row: _compare(op, row.get(column), value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def like(self, column, pattern):
+        return self._filter("like", column, pattern)
+
+    def ilike(self, column, pattern):
+        return self._filter("ilike", column, pattern)
+
+    def or_(self, filters: str, **kwargs):
+        self.filters.append(parse_logic_tree(filters))
+        return self
+
+    # --- modifiers ---
+    def order(self, column, desc: bool = False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int, **kwargs):
+        self.limit_n = n
+        return self
+
+    def offset(self, n: int, **kwargs):
+        self.offset_n = n
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self.offset_n, self.limit_n = start, end - start + 1
+        return self
+
+    def _project(self, row):
+        if self.columns == "*":
+            return dict(row)
+        return {c: row.get(c) for c in self.columns.split(",")}
+
+    def run(self):
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.action == "insert":
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            return [dict(self.db.insert(self.table, dict(r))) for r in payload]
+
+        matched = [r for r in rows if all(f(r) for f in self.filters)]
+        if self.action == "update":
+            for row in matched:
+                self.db.update(self.table, row, self.payload)
+            return [dict(r) for r in matched]
+        if self.action == "delete":
+            for row in matched:
+                self.db.delete(self.table, row)
+            return [dict(r) for r in matched]
+
+        for column, desc in reversed(self.orders):
+            # NULLs last ascending / first descending, as in Postgres
+            matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        end = None if self.limit_n is None else self.offset_n + self.limit_n
+        return [self._project(r) for r in matched[self.offset_n:end]]
+
+    async def execute(self):
+        await self.db.round_trip(("table", self.table, self.action))
+        return SimpleNamespace(data=self.run())
+
+
+class FakeRPC:
+    def __init__(self, db, name: str, params: dict):
+        self.db, self.name, self.params = db, name, params
+
+    async def execute(self):
+        await self.db.round_trip(("rpc", self.name))
+        fn = getattr(self.db, f"rpc_{self.name}", None)
+        if fn is None:
+            raise Exception(f"Could not find the function public.{self.name}")
+        return SimpleNamespace(data=fn(**self.params))
+
+
+class FakeSupabase:
+    """
+    In-memory PostgREST. Each execute() sleeps `latency` seconds (the network
+    round trip) and then runs to completion without yielding, so every call is
+    atomic, like a single statement / RPC transaction on the real database.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {name: [] for name in (
+            "tenants", "inventory", "transactions", "daily_item_totals", "buyer_balances", "applied_stock_batches"
+        )}
+        self.calls = {}
+        self._ids = itertools.count(1)
+        self.faults = Faults()
+
+    async def round_trip(self, key):
+        self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await self.faults.hit()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict = None) -> FakeRPC:
+        return FakeRPC(self, name, params or {})
+
+    async def aclose(self):
+        pass
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    # --- row writes (with the defaults and trigger from schema.sql) ---
+    def insert(self, table: str, row: dict) -> dict:
+        if table == "tenants":
+            if self._find("tenants", phone_number=row["phone_number"]):
+                raise Exception('duplicate key value violates unique constraint "tenants_phone_number_key"')
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", _now())
+        elif table == "inventory":
+            row.setdefault("id", next(self._ids))
+            row.setdefault("quantity", 0)
+            row.setdefault("unit", "kg")
+            row.setdefault("last_updated", _now())
+        elif table == "transactions":
+            if row.get("transaction_type") not in ("SALE", "PURCHASE", "ADJUSTMENT"):
+                raise Exception('new row violates check constraint "transactions_transaction_type_check"')
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("is_credit", False)
+            row.setdefault("created_at", _now())
+            for column in ("unit", "rate", "total_amount", "buyer_name"):
+                row.setdefault(column, None)
+            self._ledger(row, 1)
+        self.tables[table].append(row)
+        return row
+
+    def update(self, table: str, row: dict, data: dict):
+        if table == "transactions":
+            self._ledger(row, -1)
+        row.update(data)
+        if table == "transactions":
+            self._ledger(row, 1)
+
+    def delete(self, table: str, row: dict):
+        if table == "transactions":
+            self._ledger(row, -1)
+        self.tables[table].remove(row)
+
+    def _find(self, table: str, **key):
+        return next((r for r in self.tables[table] if all(r.get(k) == v for k, v in key.items())), None)
+
+    def _ledger(self, r: dict, sign: int):
+        """apply_ledger_row() from schema.sql."""
+        day = datetime.fromisoformat(r["created_at"]).astimezone(PKT).date().isoformat()
+        key = dict(tenant_id=r["tenant_id"], day=day, item_name=r["item_name"], transaction_type=r["transaction_type"])
+        total = self._find("daily_item_totals", **key)
+        if total is None:
+            total = {**key, "quantity": 0, "total_amount": 0, "tx_count": 0}
+            self.tables["daily_item_totals"].append(total)
+        total["quantity"] += sign * float(r["quantity"])
+        total["total_amount"] += sign * float(r.get("total_amount") or 0)
+        total["tx_count"] += sign
+
+        buyer = (r.get("buyer_name") or "").strip()
+        if r.get("is_credit") and r["transaction_type"] == "SALE" and buyer:
+            buyer_key = re.sub(r"\s+", " ", buyer).lower()
+            balance = self._find("buyer_balances", tenant_id=r["tenant_id"], buyer_key=buyer_key)
+            if balance is None:
+                balance = {"tenant_id": r["tenant_id"], "buyer_key": buyer_key, "buyer_name": buyer,
+                           "balance": 0, "tx_count": 0, "last_credit_at": r["created_at"]}
+                self.tables["buyer_balances"].append(balance)
+            balance["balance"] += sign * float(r.get("total_amount") or 0)
+            balance["tx_count"] += sign
+            balance["last_credit_at"] = max(balance["last_credit_at"], r["created_at"])
+
+    # --- RPCs from schema.sql ---
+    def rpc_apply_stock_delta(self, p_tenant_id, p_item_name, p_delta, p_unit=None):
+        row = self._find("inventory", tenant_id=p_tenant_id, item_name=p_item_name)
+        if row is None:
+            row = self.insert("inventory", {"tenant_id": p_tenant_id, "item_name": p_item_name,
+                                            "quantity": p_delta, "unit": p_unit or "kg"})
+        else:
+            row["quantity"] += p_delta
+            row["unit"] = p_unit or row["unit"]
+            row["last_updated"] = _now()
+        return row["quantity"]
+
+    def rpc_record_stock_transaction(self, p_tenant_id, p_transaction_type, p_item_name, p_quantity, p_unit,
+                                     p_rate, p_total_amount, p_buyer_name, p_is_credit):
+        # Row first: if it is rejected, stock is untouched (the RPC is one transaction)
+        self.insert("transactions", {
+            "tenant_id": p_tenant_id, "transaction_type": p_transaction_type, "item_name": p_item_name,
+            "quantity": p_quantity, "unit": p_unit, "rate": p_rate, "total_amount": p_total_amount,
+            "buyer_name": p_buyer_name, "is_credit": bool(p_is_credit),
+        })
+        delta = p_quantity if p_transaction_type == "PURCHASE" else -p_quantity
+        return self.rpc_apply_stock_delta(p_tenant_id, p_item_name, delta, p_unit)
+
+    def rpc_apply_stock_batch(self, p_tenant_id, p_lines):
+        for line in p_lines:
+            if line.get("transaction_type"):
+                self.insert("transactions", {
+                    "tenant_id": p_tenant_id, "is_credit": bool(line.get("is_credit")),
+                    **{k: line.get(k) for k in ("transaction_type", "item_name", "quantity", "unit", "rate",
+                                                "total_amount", "buyer_name")},
+                })
+        deltas = {}
+        for line in p_lines:
+            delta, unit = deltas.get(line["item_name"], (0, None))
+            deltas[line["item_name"]] = (delta + line["delta"], max(filter(None, (unit, line.get("unit"))), default=None))
+        return [{"item": item, "new_qty": self.rpc_apply_stock_delta(p_tenant_id, item, delta, unit)}
+                for item, (delta, unit) in sorted(deltas.items())]
+
+    def rpc_apply_stock_batch_once(self, p_batch_id, p_tenant_id, p_lines):
+        if self._find("applied_stock_batches", batch_id=p_batch_id):
+            names = {line["item_name"] for line in p_lines}
+            return [{"item": r["item_name"], "new_qty": r["quantity"]} for r in self.tables["inventory"]
+                    if r["tenant_id"] == p_tenant_id and r["item_name"] in names]
+        self.tables["applied_stock_batches"].append({"batch_id": p_batch_id, "applied_at": _now()})
+        return self.rpc_apply_stock_batch(p_tenant_id, p_lines)
+
+    def rpc_rebuild_ledger_aggregates(self, p_tenant_id=None):
+        def mine(r):
+            return p_tenant_id is None or r["tenant_id"] == p_tenant_id
+        for table in ("daily_item_totals", "buyer_balances"):
+            self.tables[table] = [r for r in self.tables[table] if not mine(r)]
+        scanned = [r for r in self.tables["transactions"] if mine(r)]
+        for row in scanned:
+            self._ledger(row, 1)
+        return len(scanned)
+
+    # --- seeding helpers ---
+    def add_tenant(self, phone_number: str, business_name: str = "Test Mandi") -> dict:
+        return self.insert("tenants", {"phone_number": phone_number, "business_name": business_name})
+
+    def set_stock(self, tenant_id: str, item_name: str, quantity: float, unit: str = "kg") -> dict:
+        row = self._find("inventory", tenant_id=tenant_id, item_name=item_name)
+        if row is None:
+            return self.insert("inventory", {"tenant_id": tenant_id, "item_name": item_name,
+                                             "quantity": quantity, "unit": unit})
+        row.update(quantity=quantity, unit=unit)
+        return row
+
+
+class FakeRateLimit(Exception):
+    """What google.api_core raises for HTTP 429 (ResourceExhausted), minus the dependency."""
+    code = 429
+
+
+class FakeNotFound(Exception):
+    """google.api_core's NotFound (HTTP 404), e.g. for an expired cached content."""
+    code = 404
+
+
+class FakeGeminiModel:
+    """
+    Stand-in for genai.GenerativeModel. generate_content() blocks for `latency`
+    seconds like the real (synchronous) SDK, then answers with the extraction
+    the local text parser gives for the message: a text prompt is parsed as is,
+    and media bytes are treated as the voice note's UTF-8 transcript.
+    With `max_concurrent`, calls beyond that many at once fail with a 429.
+    The model carries either a `system_instruction`, sent with every request,
+    or a `cached_content` (see FakeCaching), only named; `payloads` records
+    each request's size in bytes, so the saving can be measured offline.
+    """
+
+    def __init__(self, latency: float = 0.0, prompt_tokens: int = 1500, max_concurrent: int = None,
+                 system_instruction: str = None, cached_content=None):
+        self.latency = latency
+        self.prompt_tokens = prompt_tokens
+        self.max_concurrent = max_concurrent
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+        self.payloads = []
+        self.calls = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.media = []   # (mime_type, bytes) of each media part received
+        self.faults = Faults()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def transcript(parts) -> str:
+        for part in parts:
+            if isinstance(part, dict) and "data" in part:
+                return bytes(part["data"]).decode("utf-8", "replace")
+            if isinstance(part, str):
+                return part.split("**Text message from the user:**", 1)[-1].strip()
+        return ""
+
+    def generate_content(self, parts, **kwargs):
+        from services.text_commands import parse_text_command
+
+        if self.cached_content is not None and self.cached_content.expired():
+            raise FakeNotFound(f"404 CachedContent not found: {self.cached_content.name}")
+        with self._lock:
+            self.calls += 1
+            self.payloads.append(self.payload_bytes(parts))
+            self.media += [(p["mime_type"], len(p["data"])) for p in parts if isinstance(p, dict) and "data" in p]
+            if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+                self.rate_limited += 1
+                raise FakeRateLimit("429 Resource has been exhausted (e.g. check quota).")
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            self.faults.hit_sync()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        text = self.transcript(parts)
+        extraction, _ = parse_text_command(text)
+        data = extraction.model_dump() if extraction else {"intent": "UNKNOWN", "original_text": text}
+        body = json.dumps(data)
+        cached = len(self.cached_content.system_instruction) // 4 if self.cached_content is not None else 0
+        usage = SimpleNamespace(prompt_token_count=self.prompt_tokens, candidates_token_count=len(body) // 4,
+                                cached_content_token_count=cached)
+        return SimpleNamespace(text=body, usage_metadata=usage)
+
+    def payload_bytes(self, parts) -> int:
+        """Approximate request size: instruction or cache name, plus the contents."""
+        size = len((self.system_instruction or "").encode())
+        if self.cached_content is not None:
+            size += len(self.cached_content.name)
+        for part in parts:
+            size += len(part["data"]) if isinstance(part, dict) else len(str(part).encode())
+        return size
+
+
+class FakeCachedContent:
+    def __init__(self, caching, name: str, model: str, display_name: str, system_instruction: str, ttl: timedelta):
+        self.caching = caching
+        self.name, self.model, self.display_name = name, model, display_name
+        self.system_instruction = system_instruction
+        self.expire_time = datetime.now(timezone.utc) + ttl
+
+    def expired(self) -> bool:
+        return self.name not in self.caching.caches or datetime.now(timezone.utc) >= self.expire_time
+
+    def update(self, ttl: timedelta = None, **kwargs):
+        self.caching.faults.hit_sync()
+        self.caching.updates += 1
+        if self.expired():
+            raise FakeNotFound(f"404 CachedContent not found: {self.name}")
+        self.expire_time = datetime.now(timezone.utc) + ttl
+
+    def delete(self):
+        self.caching.caches.pop(self.name, None)
+
+
+class FakeCaching:
+    """
+    Stand-in for google.generativeai.caching: CachedContent.create()/list()
+    keep caches in memory (shared by every ContextCache using this instance,
+    like several workers on one API key) and count the API calls.
+    """
+
+    def __init__(self):
+        self.CachedContent = self
+        self.caches = {}
+        self.creates = self.lists = self.updates = 0
+        self.faults = Faults()
+
+    def create(self, model: str, display_name: str = None, system_instruction: str = None,
+               ttl: timedelta = None, **kwargs) -> FakeCachedContent:
+        self.faults.hit_sync()
+        self.creates += 1
+        name = f"cachedContents/fake-{self.creates}"
+        # Like the real API, the cache reports the fully qualified model name
+        model = model if model.startswith("models/") else f"models/{model}"
+        self.caches[name] = FakeCachedContent(self, name, model, display_name, system_instruction, ttl)
+        return self.caches[name]
+
+    def list(self):
+        self.lists += 1
+        return [c for c in self.caches.values() if not c.expired()]
+
+
+def receipt_photo(width: int = 4000, height: int = 3000, orientation: int = 1, quality: int = 92,
+                  lines: int = 12, seed: int = 0) -> bytes:
+    """
+    A phone-camera-like JPEG of a handwritten receipt: sensor noise and uneven
+    light on the paper, dark ink lines, stored with an EXIF `orientation` the
+    way phones save sideways shots. 4000x3000 at quality 92 is ~3-5 MB.
+    """
+    import random
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    paper = Image.linear_gradient("L").resize((width, height)).point(lambda v: 170 + v // 4)
+    noise = Image.effect_noise((width, height), 48).filter(ImageFilter.GaussianBlur(0.5))
+    image = Image.merge("RGB", (Image.blend(paper, noise, 0.35),) * 2 + (Image.blend(paper, noise, 0.4),))
+    draw = ImageDraw.Draw(image)
+    stroke = max(2, height // 400)
+    for row in range(lines):
+        y = int(height * (row + 1.5) / (lines + 2))
+        x = width // 12
+        for _ in range(rng.randint(4, 9)):
+            # One "word": a scribble of connected strokes
+            w = rng.randint(width // 40, width // 12)
+            points = [(x + i * w // 8, y + rng.randint(-height // 60, height // 60)) for i in range(9)]
+            draw.line(points, fill=(30, 30, 60), width=stroke, joint="curve")
+            x += w + width // 50
+    draw.rectangle((0, 0, width // 10, height // 10), fill=(0, 0, 0))  # marks the stored top-left
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality, exif=exif)
+    return out.getvalue()
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        fault = self.server.faults.take()
+        if fault and fault[1]:
+            time.sleep(fault[1])
+        media = self.server.media.get(self.path.rsplit("/", 1)[-1])
+        if media is None or (fault and fault[0]):
+            self.send_response(fault[0] if fault and fault[0] else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body, content_type = media
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMediaServer(ThreadingHTTPServer):
+    """Serves registered blobs at /Media/<name>, like Twilio's MediaUrl0."""
+    request_queue_size = 128
+    daemon_threads = True
+
+    def add(self, name: str, body: bytes, content_type: str = "audio/ogg") -> str:
+        self.media[name] = (body, content_type)
+        return f"http://127.0.0.1:{self.server_address[1]}/Media/{name}"
+
+
+def start_fake_media_server(latency: float = 0.0) -> FakeMediaServer:
+    server = FakeMediaServer(("127.0.0.1", 0), FakeMediaHandler)
+    server.media = {}
+    server.latency = latency
+    server.faults = Faults()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeTwilioClient:
+    """twilio.rest.Client stand-in: messages.create() just records the reply."""
+
+    def __init__(self):
+        self.sent = []
+        self.messages = self
+        self.faults = Faults()
+
+    def create(self, to: str, from_: str, body: str):
+        self.faults.hit_sync()
+        self.sent.append({"to": to, "from_": from_, "body": body})
+        return SimpleNamespace(sid=f"SMfake{len(self.sent)}")
+
+
+class FakeFirebaseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.fetches += 1
+        body = json.dumps({"keys": self.server.jwks}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Cache-Control", f"public, max-age={self.server.max_age}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeFirebase(ThreadingHTTPServer):
+    """
+    Firebase Auth stand-in: signs ID tokens with its own RSA keys and serves
+    their JWKS (point services.auth.FirebaseKeys at `keys_url`).
+    """
+    daemon_threads = True
+
+    def add_key(self, kid: str):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from jwt.algorithms import RSAAlgorithm
+
+        private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_keys[kid] = private
+        self.jwks.append({**json.loads(RSAAlgorithm.to_jwk(private.public_key())), "kid": kid, "alg": "RS256"})
+
+    @property
+    def keys_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/jwk"
+
+    def token(self, phone_number: str, kid: str = "key-1", project_id: str = None, **claims) -> str:
+        import jwt
+
+        project_id = project_id or self.project_id
+        now = int(time.time())
+        payload = {
+            "iss": f"https://securetoken.google.com/{project_id}", "aud": project_id,
+            "sub": f"uid-{phone_number}", "auth_time": now, "iat": now, "exp": now + 3600,
+            "phone_number": phone_number, **claims,
+        }
+        return jwt.encode(payload, self.private_keys[kid], algorithm="RS256", headers={"kid": kid})
+
+
+def start_fake_firebase(project_id: str = "mandi-test", max_age: int = 3600) -> FakeFirebase:
+    server = FakeFirebase(("127.0.0.1", 0), FakeFirebaseHandler)
+    server.project_id = project_id
+    server.max_age = max_age
+    server.private_keys, server.jwks, server.fetches = {}, [], 0
+    server.add_key("key-1")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def installed(db_latency: float = 0.0, gemini_latency: float = 0.0, media_latency: float = 0.0, db_client=None,
+              gemini_limit: int = None, admission=None):
+    """
+    Points the app at fresh fakes for the duration of the block and yields them
+    (env.db, env.gemini, env.media, env.twilio, env.admission). Caches keyed on
+    tenant data, the media connection pool, the Gemini admission controller and
+    the circuit breakers are reset so nothing leaks in from a previous run (or
+    event loop). Pass `db_client` to run on a real storage client
+    (e.g. a SQLiteClient) instead of FakeSupabase, `gemini_limit` to have the
+    Gemini fake answer 429 above that many concurrent calls, and `admission`
+    for a GeminiAdmission with non-default limits.
+    """
+    import services.db as db
+    import services.gemini_voice as gv
+    from services import clients
+    from services.dashboard_cache import DashboardCache
+    from services.extraction_cache import ExtractionCache
+    from services.tenant_cache import TenantCache
+    from services.item_index import item_index
+    from services.gemini_admission import GeminiAdmission
+    import services.media_fetch as media_fetch
+    from services import resilience
+
+    env = SimpleNamespace(
+        db=db_client if db_client is not None else FakeSupabase(db_latency),
+        gemini=FakeGeminiModel(gemini_latency, max_concurrent=gemini_limit, system_instruction=gv.MUNSHI_PROMPT),
+        media=start_fake_media_server(media_latency), twilio=FakeTwilioClient(),
+        admission=admission or GeminiAdmission(),
+    )
+    dashboard_cache = DashboardCache()
+    with patch.object(db, "supabase", env.db), patch.object(gv, "model", env.gemini), \
+         patch.dict(clients._instances, {"twilio": env.twilio}), \
+         patch.object(db, "tenant_cache", TenantCache()), \
+         patch.object(db, "dashboard_cache", dashboard_cache), \
+         patch("endpoints.api.dashboard_cache", dashboard_cache), \
+         patch.object(gv, "extraction_cache", ExtractionCache(disk_path="")), \
+         patch.object(item_index, "_tenants", {}), patch.object(item_index, "_loaded", set()), \
+         patch.object(gv, "gemini_admission", env.admission), \
+         patch("services.gemini_admission.gemini_admission", env.admission), \
+         patch.object(media_fetch, "_fetcher", media_fetch.MediaFetcher()), \
+         patch.dict(resilience.dependencies, {name: resilience.Dependency(name, *policy)
+                                              for name, policy in resilience.POLICIES.items()}):
+        try:
+            yield env
+        finally:
+            env.media.shutdown()
@@ -1,10 +1,51 @@
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
 from dotenv import load_dotenv
 import os
+import sys
 
 load_dotenv()
 
-app = FastAPI(title="Mandi-AI Backend")
+# Modules whose clients are registered and built by the startup warm-up
+WARM_UP_MODULES = ("services.db", "services.whatsapp_pipeline")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background workers for the queued WhatsApp webhook mode (WEBHOOK_MODE=queue)
+    from services.job_queue import WEBHOOK_MODE, get_job_queue
+    queue = None
+    if WEBHOOK_MODE == "queue":
+        queue = get_job_queue()
+        queue.start()
+    # Write-behind flusher for inventory deltas (INVENTORY_WRITE_BEHIND=1)
+    from services.delta_buffer import WRITE_BEHIND, get_delta_buffer
+    delta_buffer = None
+    if WRITE_BEHIND:
+        delta_buffer = get_delta_buffer()
+        delta_buffer.start()
+    # Build the item-name index in the background so startup isn't delayed
+    from services.item_index import warm_item_index
+    warmup = asyncio.create_task(warm_item_index())
+    # SDK clients (Supabase, Gemini, Twilio) are built lazily; warm them up in the
+    # background once the port is bound instead of paying for it on import
+    from services import clients
+    app.state.client_warmup = asyncio.create_task(clients.warm_up(WARM_UP_MODULES))
+    yield
+    warmup.cancel()
+    app.state.client_warmup.cancel()
+    if queue is not None:
+        await queue.stop()
+    if delta_buffer is not None:
+        # Writes out everything still buffered before the DB pool closes
+        await delta_buffer.stop()
+    # Release the pooled Supabase / Twilio media connections
+    from services.db import close_db
+    from services.media_fetch import close_media_fetcher
+    await close_db()
+    await close_media_fetcher()
+
+app = FastAPI(title="Mandi-AI Backend", lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -24,7 +65,62 @@ app.add_middleware(
 async def root():
     return {"message": "Mandi-AI Backend is running"}
 
-# Import and include routers
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the process is up and serving (no dependency checks)."""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 503 until the startup warm-up has built the required clients."""
+    from fastapi.responses import JSONResponse
+    from services import clients
+    result = clients.readiness()
+    warmup = getattr(app.state, "client_warmup", None)
+    result["ready"] = result["ready"] and warmup is not None and warmup.done()
+    return JSONResponse(result, status_code=200 if result["ready"] else 503)
+
+def component_stats() -> dict:
+    """stats() of the in-process caches and buffers."""
+    from services.extraction_cache import extraction_cache
+    from services.idempotency import idempotency_store
+    from services.tenant_cache import tenant_cache
+    from services.dashboard_cache import dashboard_cache
+    from services.delta_buffer import WRITE_BEHIND, get_delta_buffer
+    from services.auth import firebase_verifier
+    from services.gemini_admission import gemini_admission
+    from services import resilience
+    result = {
+        "extraction_cache": extraction_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "tenant_cache": tenant_cache.stats(),
+        "dashboard_cache": dashboard_cache.stats(),
+        "firebase_auth": firebase_verifier.stats(),
+        "gemini_admission": gemini_admission.stats(),
+    }
+    # Gemini is imported on first use; until then there is no context cache to report
+    gemini_voice = sys.modules.get("services.gemini_voice")
+    if gemini_voice is not None:
+        result["gemini_context_cache"] = gemini_voice.context_cache.stats()
+    # Circuit breaker state (0 closed, 1 half-open, 2 open) and retries per dependency
+    for name, circuit in resilience.stats().items():
+        result[f"circuit_{name}"] = circuit
+    if WRITE_BEHIND:
+        result["write_behind"] = get_delta_buffer().stats()
+    return result
+
+@app.get("/stats")
+async def stats():
+    """Hit rates / flush metrics of the in-process caches and buffers."""
+    return component_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: pipeline stage latencies, counters and cache stats."""
+    from fastapi.responses import PlainTextResponse
+    from services.metrics import render
+    return PlainTextResponse(render(component_stats()), media_type="text/plain; version=0.0.4")
+
 # Import and include routers
 from endpoints import webhook, auth, api
 app.include_router(webhook.router)
@@ -0,0 +1,173 @@
+from typing import List, Optional, Literal
+from pydantic import BaseModel, ConfigDict, field_validator
+
+INTENTS = ("SALE", "UPDATE", "QUERY", "UNKNOWN")
+ACTIONS = ("IN", "OUT")
+# QUERY sub-intents: item stock (the default), today's sales, a buyer's khata
+QUERY_TYPES = ("STOCK", "DAILY_SALES", "BUYER_BALANCE")
+
+
+def _coerce_action(value):
+    value = str(value or "").strip().upper()
+    return value if value in ACTIONS else None
+
+
+def _coerce_number(value):
+    if isinstance(value, str):
+        value = value.replace(",", "").strip()
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return value
+
+
+def _coerce_credit(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1", "udhaar")
+    return value
+
+
+class LineItem(BaseModel):
+    """
+    One item of a multi-item message ("50 bori aalu aur 20 gaddi pyaz", a
+    receipt line). Fields left empty fall back to the message-level values.
+    """
+    model_config = ConfigDict(extra="ignore")
+
+    item_name: Optional[str] = None
+    quantity: Optional[float] = None
+    unit: Optional[str] = None
+    action: Optional[Literal["IN", "OUT"]] = None
+    buyer_name: Optional[str] = None
+    rate: Optional[float] = None
+    is_credit: Optional[bool] = None
+
+    @field_validator("action", mode="before")
+    @classmethod
+    def _action(cls, value):
+        return _coerce_action(value)
+
+    @field_validator("quantity", "rate", mode="before")
+    @classmethod
+    def _number(cls, value):
+        return _coerce_number(value)
+
+    @field_validator("is_credit", mode="before")
+    @classmethod
+    def _credit(cls, value):
+        return _coerce_credit(value)
+
+
+class Extraction(BaseModel):
+    """
+    One parsed Gemini extraction (mirrors the prompt's Output Format).
+    Validation is lenient on purpose: numbers given as strings are coerced,
+    unknown intents become UNKNOWN and bad actions become None, so a slightly
+    off answer is still usable instead of failing the whole message.
+    """
+    model_config = ConfigDict(extra="ignore")
+
+    intent: Literal["SALE", "UPDATE", "QUERY", "UNKNOWN"] = "UNKNOWN"
+    item_name: Optional[str] = None
+    quantity: Optional[float] = None
+    unit: Optional[str] = None
+    action: Optional[Literal["IN", "OUT"]] = None
+    buyer_name: Optional[str] = None
+    rate: Optional[float] = None
+    is_credit: bool = False
+    query_type: Optional[Literal["STOCK", "DAILY_SALES", "BUYER_BALANCE"]] = None
+    items: List[LineItem] = []
+    summary_for_user: Optional[str] = None
+    original_text: Optional[str] = None
+
+    @field_validator("intent", mode="before")
+    @classmethod
+    def _intent(cls, value):
+        value = str(value or "").strip().upper()
+        return value if value in INTENTS else "UNKNOWN"
+
+    @field_validator("action", mode="before")
+    @classmethod
+    def _action(cls, value):
+        return _coerce_action(value)
+
+    @field_validator("query_type", mode="before")
+    @classmethod
+    def _query_type(cls, value):
+        value = str(value or "").strip().upper()
+        return value if value in QUERY_TYPES else None
+
+    @field_validator("quantity", "rate", mode="before")
+    @classmethod
+    def _number(cls, value):
+        return _coerce_number(value)
+
+    @field_validator("is_credit", mode="before")
+    @classmethod
+    def _credit(cls, value):
+        if value is None:
+            return False
+        return _coerce_credit(value)
+
+    @field_validator("items", mode="before")
+    @classmethod
+    def _items(cls, value):
+        # Drop lines that aren't objects rather than rejecting the whole message
+        if not isinstance(value, list):
+            return []
+        return [line for line in value if isinstance(line, (dict, LineItem))]
+
+    def line_items(self) -> List[LineItem]:
+        """Every item in the message, with message-level values filled in."""
+        lines = self.items or ([LineItem()] if self.item_name else [])
+        defaults = {
+            "item_name": self.item_name, "quantity": self.quantity, "unit": self.unit, "action": self.action,
+            "buyer_name": self.buyer_name, "rate": self.rate, "is_credit": self.is_credit,
+        }
+        return [
+            line.model_copy(update={k: v for k, v in defaults.items() if getattr(line, k) is None})
+            for line in lines
+        ]
+
+
+def _nullable(type_: str, **extra) -> dict:
+    return {"type": type_, "nullable": True, **extra}
+
+
+# Gemini response_schema for JSON mode (OpenAPI subset), same fields as Extraction
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {"type": "STRING", "format": "enum", "enum": list(INTENTS)},
+        "item_name": _nullable("STRING"),
+        "quantity": _nullable("NUMBER"),
+        "unit": _nullable("STRING"),
+        "action": _nullable("STRING", format="enum", enum=list(ACTIONS)),
+        "buyer_name": _nullable("STRING"),
+        "rate": _nullable("NUMBER"),
+        "is_credit": {"type": "BOOLEAN"},
+        "query_type": _nullable("STRING", format="enum", enum=list(QUERY_TYPES)),
+        "items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "item_name": {"type": "STRING"},
+                    "quantity": _nullable("NUMBER"),
+                    "unit": _nullable("STRING"),
+                    "action": _nullable("STRING", format="enum", enum=list(ACTIONS)),
+                    "buyer_name": _nullable("STRING"),
+                    "rate": _nullable("NUMBER"),
+                    "is_credit": _nullable("BOOLEAN"),
+                },
+                "required": ["item_name"],
+            },
+        },
+        "summary_for_user": {"type": "STRING"},
+        "original_text": {"type": "STRING"},
+    },
+    "required": ["intent", "is_credit", "summary_for_user"],
+}
@@ -28,3 +28,244 @@ CREATE TABLE transactions (
     is_credit BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
+
+-- One stock row per (tenant, item): required for the atomic upsert below.
+-- Migration for databases created before this index: the old read-modify-write
+-- updates could leave several rows for one (tenant, item), and the index can't
+-- be built over them. They are merged first into the oldest row, with the
+-- quantities summed and the latest last_updated kept; the other rows are
+-- deleted. The table is locked so no stock write lands in between. On a clean
+-- database, or once the index exists, this finds nothing to merge.
+BEGIN;
+LOCK TABLE inventory IN SHARE ROW EXCLUSIVE MODE;
+WITH duplicates AS (
+    SELECT tenant_id, item_name, MIN(id) AS keep_id,
+           SUM(COALESCE(quantity, 0)) AS total, MAX(last_updated) AS last_updated
+    FROM inventory
+    WHERE tenant_id IS NOT NULL
+    GROUP BY tenant_id, item_name
+    HAVING COUNT(*) > 1
+), merged AS (
+    UPDATE inventory i
+    SET quantity = d.total, last_updated = d.last_updated
+    FROM duplicates d
+    WHERE i.id = d.keep_id
+    RETURNING i.id, i.tenant_id, i.item_name
+)
+DELETE FROM inventory i
+USING merged m
+WHERE i.tenant_id = m.tenant_id AND i.item_name = m.item_name AND i.id <> m.id;
+CREATE UNIQUE INDEX IF NOT EXISTS inventory_tenant_item_idx ON inventory (tenant_id, item_name);
+COMMIT;
+
+-- Keyset pagination of transaction history: (created_at, id) newest first per tenant
+CREATE INDEX IF NOT EXISTS transactions_tenant_created_idx ON transactions (tenant_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS transactions_tenant_item_created_idx ON transactions (tenant_id, item_name, created_at DESC, id DESC);
+
+-- Atomic stock mutation: applies a signed delta in a single statement and
+-- returns the new quantity, so concurrent voice notes never lose an update.
+CREATE OR REPLACE FUNCTION apply_stock_delta(
+    p_tenant_id UUID,
+    p_item_name TEXT,
+    p_delta DECIMAL,
+    p_unit VARCHAR(20)
+) RETURNS DECIMAL AS $$
+    INSERT INTO inventory (tenant_id, item_name, quantity, unit)
+    VALUES (p_tenant_id, p_item_name, p_delta, COALESCE(p_unit, 'kg'))
+    ON CONFLICT (tenant_id, item_name) DO UPDATE
+        SET quantity = inventory.quantity + EXCLUDED.quantity,
+            unit = COALESCE(p_unit, inventory.unit),
+            last_updated = NOW()
+    RETURNING quantity;
+$$ LANGUAGE sql;
+
+-- Stock mutation + ledger row in one round trip (and one database transaction)
+CREATE OR REPLACE FUNCTION record_stock_transaction(
+    p_tenant_id UUID,
+    p_transaction_type VARCHAR(20),
+    p_item_name TEXT,
+    p_quantity DECIMAL,
+    p_unit VARCHAR(20),
+    p_rate DECIMAL,
+    p_total_amount DECIMAL,
+    p_buyer_name TEXT,
+    p_is_credit BOOLEAN
+) RETURNS DECIMAL AS $$
+DECLARE
+    new_qty DECIMAL;
+BEGIN
+    new_qty := apply_stock_delta(
+        p_tenant_id,
+        p_item_name,
+        CASE WHEN p_transaction_type = 'PURCHASE' THEN p_quantity ELSE -p_quantity END,
+        p_unit
+    );
+    INSERT INTO transactions (tenant_id, transaction_type, item_name, quantity, unit, rate, total_amount, buyer_name, is_credit)
+    VALUES (p_tenant_id, p_transaction_type, p_item_name, p_quantity, p_unit, p_rate, p_total_amount, p_buyer_name, COALESCE(p_is_credit, FALSE));
+    RETURN new_qty;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ledger aggregates, maintained by a trigger in the same database transaction
+-- as every INSERT / UPDATE / DELETE on transactions, so "what did I sell
+-- today?" and "how much does Rashid Bhai owe?" are single-row lookups.
+-- Days are business days in Pakistan time (PKT, no DST).
+CREATE OR REPLACE FUNCTION ledger_day(ts TIMESTAMP WITH TIME ZONE) RETURNS DATE AS $$
+    SELECT (ts AT TIME ZONE 'Asia/Karachi')::date;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- "  Rashid  Bhai " and "rashid bhai" are the same khata
+CREATE OR REPLACE FUNCTION buyer_key(p_buyer_name TEXT) RETURNS TEXT AS $$
+    SELECT lower(regexp_replace(btrim(p_buyer_name), '\s+', ' ', 'g'));
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS daily_item_totals (
+    tenant_id UUID REFERENCES tenants(id),
+    day DATE NOT NULL,
+    item_name TEXT NOT NULL,
+    transaction_type VARCHAR(20) NOT NULL,
+    quantity DECIMAL NOT NULL DEFAULT 0,
+    total_amount DECIMAL NOT NULL DEFAULT 0,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant_id, day, item_name, transaction_type)
+);
+
+-- Outstanding credit (udhaar) per buyer: the sum of their credit sales
+CREATE TABLE IF NOT EXISTS buyer_balances (
+    tenant_id UUID REFERENCES tenants(id),
+    buyer_key TEXT NOT NULL,
+    buyer_name TEXT NOT NULL,
+    balance DECIMAL NOT NULL DEFAULT 0,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    last_credit_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (tenant_id, buyer_key)
+);
+
+-- Adds (p_sign = 1) or removes (p_sign = -1) one transaction's contribution
+CREATE OR REPLACE FUNCTION apply_ledger_row(r transactions, p_sign INTEGER) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO daily_item_totals (tenant_id, day, item_name, transaction_type, quantity, total_amount, tx_count)
+    VALUES (r.tenant_id, ledger_day(r.created_at), r.item_name, r.transaction_type,
+            p_sign * r.quantity, p_sign * COALESCE(r.total_amount, 0), p_sign)
+    ON CONFLICT (tenant_id, day, item_name, transaction_type) DO UPDATE
+        SET quantity = daily_item_totals.quantity + EXCLUDED.quantity,
+            total_amount = daily_item_totals.total_amount + EXCLUDED.total_amount,
+            tx_count = daily_item_totals.tx_count + EXCLUDED.tx_count;
+
+    IF r.is_credit AND r.transaction_type = 'SALE' AND NULLIF(btrim(r.buyer_name), '') IS NOT NULL THEN
+        INSERT INTO buyer_balances (tenant_id, buyer_key, buyer_name, balance, tx_count, last_credit_at)
+        VALUES (r.tenant_id, buyer_key(r.buyer_name), btrim(r.buyer_name),
+                p_sign * COALESCE(r.total_amount, 0), p_sign, r.created_at)
+        ON CONFLICT (tenant_id, buyer_key) DO UPDATE
+            SET balance = buyer_balances.balance + EXCLUDED.balance,
+                tx_count = buyer_balances.tx_count + EXCLUDED.tx_count,
+                last_credit_at = GREATEST(buyer_balances.last_credit_at, EXCLUDED.last_credit_at);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transactions_ledger_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_ledger_row(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_ledger_row(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_ledger ON transactions;
+CREATE TRIGGER transactions_ledger
+    AFTER INSERT OR UPDATE OR DELETE ON transactions
+    FOR EACH ROW EXECUTE FUNCTION transactions_ledger_trigger();
+
+-- Backfill / repair: recomputes the aggregates from transactions for one
+-- tenant (or everyone when p_tenant_id is NULL). Returns the rows scanned.
+CREATE OR REPLACE FUNCTION rebuild_ledger_aggregates(p_tenant_id UUID DEFAULT NULL) RETURNS INTEGER AS $$
+DECLARE
+    scanned INTEGER;
+BEGIN
+    -- Hold off concurrent writes so no transaction is counted twice or missed
+    LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM daily_item_totals WHERE p_tenant_id IS NULL OR tenant_id = p_tenant_id;
+    DELETE FROM buyer_balances WHERE p_tenant_id IS NULL OR tenant_id = p_tenant_id;
+
+    INSERT INTO daily_item_totals (tenant_id, day, item_name, transaction_type, quantity, total_amount, tx_count)
+    SELECT tenant_id, ledger_day(created_at), item_name, transaction_type,
+           SUM(quantity), SUM(COALESCE(total_amount, 0)), COUNT(*)
+    FROM transactions
+    WHERE p_tenant_id IS NULL OR tenant_id = p_tenant_id
+    GROUP BY tenant_id, ledger_day(created_at), item_name, transaction_type;
+
+    INSERT INTO buyer_balances (tenant_id, buyer_key, buyer_name, balance, tx_count, last_credit_at)
+    SELECT tenant_id, buyer_key(buyer_name), MAX(btrim(buyer_name)),
+           SUM(COALESCE(total_amount, 0)), COUNT(*), MAX(created_at)
+    FROM transactions
+    WHERE is_credit AND transaction_type = 'SALE' AND NULLIF(btrim(buyer_name), '') IS NOT NULL
+      AND (p_tenant_id IS NULL OR tenant_id = p_tenant_id)
+    GROUP BY tenant_id, buyer_key(buyer_name);
+
+    SELECT COUNT(*) INTO scanned FROM transactions WHERE p_tenant_id IS NULL OR tenant_id = p_tenant_id;
+    RETURN scanned;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Multi-item messages (a receipt, "aalu aur pyaz aaye"): every line in one
+-- round trip and one database transaction. p_lines is a JSON array of
+-- {item_name, quantity, unit, delta, transaction_type, rate, total_amount,
+-- buyer_name, is_credit}; lines with a transaction_type also get a ledger row.
+-- Deltas are summed per item and applied in item_name order, so concurrent
+-- batches lock inventory rows in the same order and can't deadlock.
+CREATE OR REPLACE FUNCTION apply_stock_batch(p_tenant_id UUID, p_lines JSONB)
+RETURNS TABLE (item TEXT, new_qty DECIMAL) AS $$
+DECLARE
+    line RECORD;
+BEGIN
+    INSERT INTO transactions (tenant_id, transaction_type, item_name, quantity, unit, rate, total_amount, buyer_name, is_credit)
+    SELECT p_tenant_id, l.transaction_type, l.item_name, l.quantity, l.unit, l.rate, l.total_amount, l.buyer_name,
+           COALESCE(l.is_credit, FALSE)
+    FROM jsonb_to_recordset(p_lines) AS l(
+        transaction_type VARCHAR(20), item_name TEXT, quantity DECIMAL, unit VARCHAR(20),
+        rate DECIMAL, total_amount DECIMAL, buyer_name TEXT, is_credit BOOLEAN
+    )
+    WHERE l.transaction_type IS NOT NULL;
+
+    FOR line IN
+        SELECT l.item_name, SUM(l.delta) AS delta, MAX(l.unit) AS unit
+        FROM jsonb_to_recordset(p_lines) AS l(item_name TEXT, delta DECIMAL, unit VARCHAR(20))
+        GROUP BY l.item_name
+        ORDER BY l.item_name
+    LOOP
+        item := line.item_name;
+        new_qty := apply_stock_delta(p_tenant_id, line.item_name, line.delta, line.unit);
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- At-most-once batches for the write-behind delta buffer: a flush whose
+-- response was lost is retried with the same id and not applied twice.
+CREATE TABLE IF NOT EXISTS applied_stock_batches (
+    batch_id TEXT PRIMARY KEY,
+    applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION apply_stock_batch_once(p_batch_id TEXT, p_tenant_id UUID, p_lines JSONB)
+RETURNS TABLE (item TEXT, new_qty DECIMAL) AS $$
+BEGIN
+    INSERT INTO applied_stock_batches (batch_id) VALUES (p_batch_id) ON CONFLICT DO NOTHING;
+    IF NOT FOUND THEN
+        -- Already applied: just report the current stock
+        RETURN QUERY
+        SELECT i.item_name, i.quantity
+        FROM inventory i
+        JOIN jsonb_to_recordset(p_lines) AS l(item_name TEXT) ON l.item_name = i.item_name
+        WHERE i.tenant_id = p_tenant_id;
+        RETURN;
+    END IF;
+    RETURN QUERY SELECT b.item, b.new_qty FROM apply_stock_batch(p_tenant_id, p_lines) AS b;
+END;
+$$ LANGUAGE plpgsql;
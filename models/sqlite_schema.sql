@@ -0,0 +1,143 @@
+-- Embedded schema for DB_BACKEND=sqlite (services/sqlite_store.py).
+-- Same tables, indexes, RPC semantics and ledger trigger as schema.sql, for a
+-- single-shop deployment with the database on local disk. Timestamps are
+-- UTC ISO-8601 text with microseconds, as PostgREST returns them (they sort
+-- chronologically); ids are UUID text, like Postgres' uuid_generate_v4().
+-- now_utc() and buyer_key() are registered on the connection by
+-- sqlite_store.py. Applied on every connect, so it is idempotent.
+
+CREATE TABLE IF NOT EXISTS tenants (
+    id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' ||
+        substr(hex(randomblob(2)), 2) || '-' || substr('89ab', 1 + abs(random()) % 4, 1) ||
+        substr(hex(randomblob(2)), 2) || '-' || hex(randomblob(6)))),
+    phone_number TEXT UNIQUE NOT NULL,
+    business_name TEXT,
+    created_at TEXT NOT NULL DEFAULT (now_utc())
+);
+
+CREATE TABLE IF NOT EXISTS inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant_id TEXT REFERENCES tenants(id),
+    item_name TEXT NOT NULL,
+    quantity REAL NOT NULL DEFAULT 0,
+    unit TEXT DEFAULT 'kg',
+    last_updated TEXT DEFAULT (now_utc())
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' ||
+        substr(hex(randomblob(2)), 2) || '-' || substr('89ab', 1 + abs(random()) % 4, 1) ||
+        substr(hex(randomblob(2)), 2) || '-' || hex(randomblob(6)))),
+    tenant_id TEXT REFERENCES tenants(id),
+    transaction_type TEXT NOT NULL CHECK (transaction_type IN ('SALE', 'PURCHASE', 'ADJUSTMENT')),
+    item_name TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    unit TEXT,
+    rate REAL,
+    total_amount REAL,
+    buyer_name TEXT,
+    is_credit INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT (now_utc())
+);
+
+-- One stock row per (tenant, item): the apply_stock_delta upsert relies on it
+CREATE UNIQUE INDEX IF NOT EXISTS inventory_tenant_item_idx ON inventory (tenant_id, item_name);
+
+-- Keyset pagination of transaction history, newest first per tenant
+CREATE INDEX IF NOT EXISTS transactions_tenant_created_idx ON transactions (tenant_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS transactions_tenant_item_created_idx ON transactions (tenant_id, item_name, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS daily_item_totals (
+    tenant_id TEXT REFERENCES tenants(id),
+    day TEXT NOT NULL,
+    item_name TEXT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    quantity REAL NOT NULL DEFAULT 0,
+    total_amount REAL NOT NULL DEFAULT 0,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant_id, day, item_name, transaction_type)
+);
+
+CREATE TABLE IF NOT EXISTS buyer_balances (
+    tenant_id TEXT REFERENCES tenants(id),
+    buyer_key TEXT NOT NULL,
+    buyer_name TEXT NOT NULL,
+    balance REAL NOT NULL DEFAULT 0,
+    tx_count INTEGER NOT NULL DEFAULT 0,
+    last_credit_at TEXT,
+    PRIMARY KEY (tenant_id, buyer_key)
+);
+
+CREATE TABLE IF NOT EXISTS applied_stock_batches (
+    batch_id TEXT PRIMARY KEY,
+    applied_at TEXT DEFAULT (now_utc())
+);
+
+-- Ledger aggregates, kept in step with transactions (apply_ledger_row in schema.sql).
+-- date(created_at, '+5 hours') is ledger_day(): the date in Pakistan time (UTC+5, no DST).
+CREATE TRIGGER IF NOT EXISTS transactions_ledger_insert AFTER INSERT ON transactions
+BEGIN
+    INSERT INTO daily_item_totals (tenant_id, day, item_name, transaction_type, quantity, total_amount, tx_count)
+    VALUES (NEW.tenant_id, date(NEW.created_at, '+5 hours'), NEW.item_name, NEW.transaction_type,
+            NEW.quantity, COALESCE(NEW.total_amount, 0), 1)
+    ON CONFLICT (tenant_id, day, item_name, transaction_type) DO UPDATE
+        SET quantity = quantity + excluded.quantity,
+            total_amount = total_amount + excluded.total_amount,
+            tx_count = tx_count + excluded.tx_count;
+
+    INSERT INTO buyer_balances (tenant_id, buyer_key, buyer_name, balance, tx_count, last_credit_at)
+    SELECT NEW.tenant_id, buyer_key(NEW.buyer_name), trim(NEW.buyer_name), COALESCE(NEW.total_amount, 0), 1, NEW.created_at
+    WHERE NEW.is_credit AND NEW.transaction_type = 'SALE' AND trim(COALESCE(NEW.buyer_name, '')) <> ''
+    ON CONFLICT (tenant_id, buyer_key) DO UPDATE
+        SET balance = balance + excluded.balance,
+            tx_count = tx_count + excluded.tx_count,
+            last_credit_at = max(last_credit_at, excluded.last_credit_at);
+END;
+
+CREATE TRIGGER IF NOT EXISTS transactions_ledger_delete AFTER DELETE ON transactions
+BEGIN
+    UPDATE daily_item_totals
+        SET quantity = quantity - OLD.quantity,
+            total_amount = total_amount - COALESCE(OLD.total_amount, 0),
+            tx_count = tx_count - 1
+        WHERE tenant_id = OLD.tenant_id AND day = date(OLD.created_at, '+5 hours')
+          AND item_name = OLD.item_name AND transaction_type = OLD.transaction_type;
+
+    UPDATE buyer_balances
+        SET balance = balance - COALESCE(OLD.total_amount, 0),
+            tx_count = tx_count - 1
+        WHERE OLD.is_credit AND OLD.transaction_type = 'SALE'
+          AND tenant_id = OLD.tenant_id AND buyer_key = buyer_key(OLD.buyer_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS transactions_ledger_update AFTER UPDATE ON transactions
+BEGIN
+    UPDATE daily_item_totals
+        SET quantity = quantity - OLD.quantity,
+            total_amount = total_amount - COALESCE(OLD.total_amount, 0),
+            tx_count = tx_count - 1
+        WHERE tenant_id = OLD.tenant_id AND day = date(OLD.created_at, '+5 hours')
+          AND item_name = OLD.item_name AND transaction_type = OLD.transaction_type;
+
+    UPDATE buyer_balances
+        SET balance = balance - COALESCE(OLD.total_amount, 0),
+            tx_count = tx_count - 1
+        WHERE OLD.is_credit AND OLD.transaction_type = 'SALE'
+          AND tenant_id = OLD.tenant_id AND buyer_key = buyer_key(OLD.buyer_name);
+
+    INSERT INTO daily_item_totals (tenant_id, day, item_name, transaction_type, quantity, total_amount, tx_count)
+    VALUES (NEW.tenant_id, date(NEW.created_at, '+5 hours'), NEW.item_name, NEW.transaction_type,
+            NEW.quantity, COALESCE(NEW.total_amount, 0), 1)
+    ON CONFLICT (tenant_id, day, item_name, transaction_type) DO UPDATE
+        SET quantity = quantity + excluded.quantity,
+            total_amount = total_amount + excluded.total_amount,
+            tx_count = tx_count + excluded.tx_count;
+
+    INSERT INTO buyer_balances (tenant_id, buyer_key, buyer_name, balance, tx_count, last_credit_at)
+    SELECT NEW.tenant_id, buyer_key(NEW.buyer_name), trim(NEW.buyer_name), COALESCE(NEW.total_amount, 0), 1, NEW.created_at
+    WHERE NEW.is_credit AND NEW.transaction_type = 'SALE' AND trim(COALESCE(NEW.buyer_name, '')) <> ''
+    ON CONFLICT (tenant_id, buyer_key) DO UPDATE
+        SET balance = balance + excluded.balance,
+            tx_count = tx_count + excluded.tx_count,
+            last_credit_at = max(last_credit_at, excluded.last_credit_at);
+END;
@@ -0,0 +1,23 @@
+import asyncio
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services.db import rebuild_ledger_aggregates, close_db
+
+# Backfills / repairs the ledger aggregate tables (daily_item_totals,
+# buyer_balances) from the transactions table.
+# Usage: python rebuild_ledger.py [tenant_id]   (no tenant_id = every tenant)
+
+
+async def main(tenant_id: str = None):
+    try:
+        scanned = await rebuild_ledger_aggregates(tenant_id)
+        print(f"Ledger aggregates rebuilt for {tenant_id or 'all tenants'}: {scanned} transactions scanned.")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
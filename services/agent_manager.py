@@ -1,7 +1,13 @@
+import asyncio
 import logging
 # from google.adk.core import Agent, Model
-from services.agent_tools import update_inventory_tool, query_inventory_tool
+from services.agent_tools import (
+    update_inventory_tool, update_items_tool, query_inventory_tool, daily_sales_tool, buyer_balance_tool
+)
 from services.db import record_transaction
+from services.item_index import resolve_item_name
+from models.extraction import Extraction
+from services.metrics import timed
 
 # Setup simple logging
 logging.basicConfig(level=logging.INFO)
@@ -12,15 +18,39 @@ logging.basicConfig(level=logging.INFO)
 # However, to strictly follow the requirement of "Agentic Logic", we will create a dispatcher function 
 # that acts as the "Agent Router" based on the extracted intent.
 
+@timed()
 async def agent_router(tenant_id: str, extraction_data: dict):
     """
     Routes the extracted intent to the correct tool/action.
     This acts as the deterministic 'Router Agent'.
     """
     intent = extraction_data.get("intent")
+
+    # Several items in one voice note / receipt: one batched write, one reply
+    if intent in ("SALE", "UPDATE") and extraction_data.get("items"):
+        lines = [
+            line for line in Extraction.model_validate(extraction_data).line_items()
+            if line.item_name and line.quantity is not None
+        ]
+        if len(lines) > 1:
+            names = await asyncio.gather(*(resolve_item_name(tenant_id, line.item_name) for line in lines))
+            return await update_items_tool(
+                tenant_id, intent,
+                [{**line.model_dump(), "item_name": name} for line, name in zip(lines, names)]
+            )
+        if lines:
+            extraction_data = {**extraction_data, **lines[0].model_dump()}
+
+    # One commodity, one row: "Aloo", "potatoes" and "Potato" all resolve to
+    # the tenant's canonical name before any DB call (a question adds no item)
+    if extraction_data.get("item_name"):
+        extraction_data = dict(extraction_data)
+        extraction_data["item_name"] = await resolve_item_name(
+            tenant_id, extraction_data["item_name"], register=intent != "QUERY"
+        )
     
     if intent == "UPDATE":
-        return update_inventory_tool(
+        return await update_inventory_tool(
             tenant_id,
             extraction_data.get("item_name"),
             extraction_data.get("quantity"),
@@ -29,7 +59,7 @@ async def agent_router(tenant_id: str, extraction_data: dict):
         )
     
     elif intent == "SALE":
-        return record_transaction(
+        return await record_transaction(
             tenant_id,
             extraction_data.get("item_name"),
             extraction_data.get("quantity"),
@@ -41,7 +71,13 @@ async def agent_router(tenant_id: str, extraction_data: dict):
         )
     
     elif intent == "QUERY":
-        return query_inventory_tool(
+        # Ledger questions are answered from the pre-aggregated tables
+        query_type = extraction_data.get("query_type")
+        if query_type == "DAILY_SALES":
+            return await daily_sales_tool(tenant_id, extraction_data.get("item_name"))
+        if query_type == "BUYER_BALANCE":
+            return await buyer_balance_tool(tenant_id, extraction_data.get("buyer_name"))
+        return await query_inventory_tool(
             tenant_id,
             extraction_data.get("item_name")
         )
@@ -1,19 +1,65 @@
-from services.db import add_inventory_log, supabase
+from services.db import add_inventory_log, apply_stock_batch, get_inventory_item, get_daily_totals, get_buyer_balance
+from services.metrics import log
 
-def update_inventory_tool(tenant_id: str, item_name: str, quantity: float, unit: str, action: str):
+async def update_inventory_tool(tenant_id: str, item_name: str, quantity: float, unit: str, action: str):
     """
     Updates the inventory count for a specific item.
     """
-    new_qty = add_inventory_log(tenant_id, item_name, quantity, unit, action)
+    new_qty = await add_inventory_log(tenant_id, item_name, quantity, unit, action)
     return {"status": "success", "message": f"Updated {item_name}. New Quantity: {new_qty} {unit}"}
 
-def query_inventory_tool(tenant_id: str, item_name: str):
+async def update_items_tool(tenant_id: str, intent: str, lines: list):
+    """
+    Applies every item of a multi-item message (UPDATE or SALE) as one batched write.
+    """
+    if intent == "SALE":
+        lines = [{**line, "transaction_type": "SALE"} for line in lines]
+    try:
+        new_qty = await apply_stock_batch(tenant_id, lines)
+    except Exception as e:
+        log(f"Error applying batch of {len(lines)} items: {e}")
+        return {"status": "error", "message": str(e)}
+
+    units = {line["item_name"]: line.get("unit") or "" for line in lines}
+    stock = ", ".join(f"{name} {qty} {units.get(name, '')}".rstrip() for name, qty in new_qty.items())
+    message = f"Updated {len(new_qty)} items. New Quantities: {stock}"
+    if intent == "SALE":
+        total = sum(float(line["quantity"]) * float(line["rate"]) for line in lines if line.get("rate"))
+        message += f". Total: {total:,.0f}"
+    return {"status": "success", "message": message, "new_qty": new_qty}
+
+async def query_inventory_tool(tenant_id: str, item_name: str):
     """
     Queries the current stock of an item.
     """
-    response = supabase.table("inventory").select("*").eq("tenant_id", tenant_id).eq("item_name", item_name).execute()
-    if response.data:
-        item = response.data[0]
+    item = await get_inventory_item(tenant_id, item_name)
+    if item:
         return {"status": "success", "message": f"We have {item['quantity']} {item['unit']} of {item['item_name']}."}
     else:
         return {"status": "success", "message": f"No record found for {item_name}."}
+
+def _amount(value) -> str:
+    value = float(value or 0)
+    return f"{value:,.0f}" if value == int(value) else f"{value:,.2f}"
+
+async def daily_sales_tool(tenant_id: str, item_name: str = None):
+    """
+    Summarizes today's sales (optionally for one item) from the daily aggregates.
+    """
+    rows = [r for r in await get_daily_totals(tenant_id, item_name=item_name) if r["transaction_type"] == "SALE"]
+    if not rows:
+        return {"status": "success", "message": f"No sales recorded today{' for ' + item_name if item_name else ''}."}
+    total = sum(float(r["total_amount"] or 0) for r in rows)
+    lines = [f"{r['item_name']}: {_amount(r['quantity'])} ({_amount(r['total_amount'])})" for r in rows]
+    return {"status": "success", "message": f"Today's sales: {_amount(total)}. " + ", ".join(lines) + "."}
+
+async def buyer_balance_tool(tenant_id: str, buyer_name: str):
+    """
+    Looks up how much credit (udhaar) a buyer owes.
+    """
+    if not buyer_name:
+        return {"status": "error", "message": "Buyer name missing."}
+    khata = await get_buyer_balance(tenant_id, buyer_name)
+    if not khata or not float(khata["balance"] or 0):
+        return {"status": "success", "message": f"No udhaar outstanding for {buyer_name}."}
+    return {"status": "success", "message": f"{khata['buyer_name']} owes {_amount(khata['balance'])} (Udhaar)."}
@@ -1,31 +1,263 @@
-import firebase_admin
-from firebase_admin import credentials, auth
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
 import os
+import re
+import secrets
+import time
+import httpx
+from cachetools import TLRUCache
 from dotenv import load_dotenv
+from services.db import get_tenant_by_phone
+from services.metrics import inc, log, span
 
 load_dotenv()
 
-# Initialize Firebase Admin
-# Expects GOOGLE_APPLICATION_CREDENTIALS env var to point to the service account key
-# OR explicit path in .env
-cred_path = os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH")
-
-if not firebase_admin._apps:
-    if cred_path and os.path.exists(cred_path):
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-    else:
-        # Fallback to default search or raising error in production
-        print("Warning: Firebase Service Account not found. Auth verification will fail.")
-        # firebase_admin.initialize_app() 
-
-def verify_token(id_token: str):
+# Authentication for /api/*.
+# Firebase ID tokens are verified in-process: Google's signing keys are fetched
+# once and kept for the max-age Google sends (refetched early only for an
+# unknown key id), and each verified token is remembered until it expires.
+# A verified caller also gets a session token - the tenant row, an expiry and
+# an HMAC, no server-side state - so later requests authenticate with one
+# hash and no I/O at all. Send it as `Authorization: Session <token>`.
+
+FIREBASE_KEYS_URL = os.getenv(
+    "FIREBASE_KEYS_URL",
+    "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com",
+)
+FIREBASE_KEYS_DEFAULT_TTL = float(os.getenv("FIREBASE_KEYS_DEFAULT_TTL", "3600"))
+# An unknown key id (Google rotated) refetches the keys at most this often
+FIREBASE_KEYS_MIN_REFRESH = float(os.getenv("FIREBASE_KEYS_MIN_REFRESH", "60"))
+FIREBASE_CLOCK_SKEW = float(os.getenv("FIREBASE_CLOCK_SKEW", "60"))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+# Legacy MVP login: trust a bare X-Phone-Number header. Set to 0 once the app sends tokens.
+ALLOW_PHONE_HEADER_AUTH = os.getenv("ALLOW_PHONE_HEADER_AUTH", "1") == "1"
+
+
+def _firebase_project_id():
+    """FIREBASE_PROJECT_ID, or the project of the service account key (FIREBASE_SERVICE_ACCOUNT_PATH)."""
+    project_id = os.getenv("FIREBASE_PROJECT_ID")
+    cred_path = os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH")
+    if not project_id and cred_path and os.path.exists(cred_path):
+        with open(cred_path) as f:
+            project_id = json.load(f).get("project_id")
+    return project_id
+
+FIREBASE_PROJECT_ID = _firebase_project_id()
+
+
+class AuthError(Exception):
+    pass
+
+
+def _max_age(cache_control: str, default: float) -> float:
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return float(match.group(1)) if match else default
+
+
+class FirebaseKeys:
+    """Google's public keys for Firebase ID tokens (a JWKS), cached per Cache-Control."""
+
+    def __init__(self, url: str = FIREBASE_KEYS_URL, min_refresh: float = FIREBASE_KEYS_MIN_REFRESH):
+        self.url = url
+        self.min_refresh = min_refresh
+        self._keys = {}
+        self._expires = 0.0
+        self._fetched = float("-inf")
+        self._lock = asyncio.Lock()
+        self.fetches = 0
+        self.errors = 0
+
+    def _stale(self, kid: str) -> bool:
+        now = time.monotonic()
+        return now >= self._expires or (kid not in self._keys and now - self._fetched >= self.min_refresh)
+
+    async def get(self, kid: str):
+        """The public key for `kid`, or None if Google doesn't (or no longer) publish it."""
+        if self._stale(kid):
+            async with self._lock:
+                # Whoever held the lock may have just refreshed
+                if self._stale(kid):
+                    await self._refresh()
+        return self._keys.get(kid)
+
+    async def _refresh(self):
+        from jwt import PyJWKSet
+
+        self._fetched = time.monotonic()
+        try:
+            with span("auth.fetch_keys"):
+                async with httpx.AsyncClient(timeout=10) as client:
+                    response = await client.get(self.url)
+                response.raise_for_status()
+                keys = {key.key_id: key.key for key in PyJWKSet.from_dict(response.json()).keys}
+        except Exception as e:
+            # Keep serving the keys we have; retried after min_refresh
+            self.errors += 1
+            self._expires = self._fetched + self.min_refresh
+            log(f"Error fetching Firebase signing keys: {e}")
+            if not self._keys:
+                raise AuthError("Signing keys unavailable")
+            return
+        self.fetches += 1
+        self._keys = keys
+        self._expires = self._fetched + _max_age(response.headers.get("Cache-Control"), FIREBASE_KEYS_DEFAULT_TTL)
+
+
+class FirebaseVerifier:
+    """Verifies Firebase ID tokens like firebase_admin.auth.verify_id_token, without blocking the loop."""
+
+    def __init__(self, project_id: str = FIREBASE_PROJECT_ID, keys: FirebaseKeys = None,
+                 cache_size: int = VERIFIED_TOKEN_CACHE_SIZE):
+        self.project_id = project_id
+        self.keys = keys or FirebaseKeys()
+        # Each token is remembered until its own `exp`
+        self._verified = TLRUCache(maxsize=cache_size, ttu=lambda _token, claims, _now: claims["exp"],
+                                   timer=time.time)
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    async def verify(self, id_token: str) -> dict:
+        """Decoded claims of a valid token; raises AuthError otherwise."""
+        claims = self._verified.get(id_token)
+        if claims is not None:
+            self.hits += 1
+            return claims
+        self.misses += 1
+        try:
+            claims = await self._verify(id_token)
+        except AuthError:
+            self.failures += 1
+            raise
+        self._verified[id_token] = claims
+        return claims
+
+    async def _verify(self, id_token: str) -> dict:
+        import jwt
+
+        if not self.project_id:
+            raise AuthError("Firebase auth is not configured (FIREBASE_PROJECT_ID)")
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.PyJWTError:
+            raise AuthError("Malformed token")
+        if header.get("alg") != "RS256":
+            raise AuthError("Unexpected token algorithm")
+        key = await self.keys.get(header.get("kid"))
+        if key is None:
+            raise AuthError("Unknown token signing key")
+        try:
+            claims = jwt.decode(
+                id_token, key, algorithms=["RS256"], audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}", leeway=FIREBASE_CLOCK_SKEW,
+                options={"require": ["exp", "iat", "aud", "iss", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise AuthError(f"Invalid token: {e}")
+        if not claims["sub"] or claims.get("auth_time", 0) > time.time() + FIREBASE_CLOCK_SKEW:
+            raise AuthError("Invalid token subject or auth_time")
+        return claims
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._verified),
+            "key_fetches": self.keys.fetches,
+            "key_fetch_errors": self.keys.errors,
+        }
+
+
+firebase_verifier = FirebaseVerifier()
+
+
+# --- Session tokens: base64url(json payload) "." base64url(HMAC-SHA256) ---
+
+_session_secret = None
+
+def _secret() -> bytes:
+    global _session_secret
+    if _session_secret is None:
+        configured = os.getenv("SESSION_SECRET")
+        if configured:
+            _session_secret = configured.encode()
+        else:
+            log("Warning: SESSION_SECRET not set; sessions won't survive a restart or span several workers.")
+            _session_secret = secrets.token_bytes(32)
+    return _session_secret
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(_secret(), body.encode(), hashlib.sha256).digest())
+
+def issue_session(tenant: dict, ttl: int = SESSION_TTL) -> str:
+    """
+    A session token for `tenant`. It is valid until it expires - deleting the
+    tenant doesn't revoke it - so keep SESSION_TTL short.
+    """
+    payload = {"t": tenant["id"], "p": tenant["phone_number"], "n": tenant.get("business_name"),
+               "exp": int(time.time() + ttl)}
+    body = _b64(json.dumps(payload, separators=(",", ":")).encode())
+    return f"{body}.{_sign(body)}"
+
+def verify_session(token: str) -> dict:
+    """The tenant a session token was issued for; raises AuthError if forged or expired."""
+    body, _, signature = (token or "").partition(".")
+    if not hmac.compare_digest(signature.encode(), _sign(body).encode()):
+        raise AuthError("Invalid session token")
+    payload = json.loads(_unb64(body))
+    if payload["exp"] < time.time():
+        raise AuthError("Session expired")
+    return {"id": payload["t"], "phone_number": payload["p"], "business_name": payload["n"]}
+
+
+def _count(method: str, outcome: str):
+    inc("auth_requests_total", help="/api authentications by method and outcome", method=method, outcome=outcome)
+
+
+async def authenticate(authorization: str = None, phone_number: str = None):
     """
-    Verifies a Firebase ID token.
+    Resolves the caller of an /api request to (tenant, new session token or None).
+      Authorization: Session <token>   no I/O
+      Authorization: Bearer <Firebase ID token>   cached keys/claims + tenant cache; issues a session
+      X-Phone-Number: <phone>   only with ALLOW_PHONE_HEADER_AUTH
+    Raises AuthError.
     """
+    scheme, _, credential = (authorization or "").partition(" ")
+    scheme = scheme.lower()
+    method = scheme if scheme in ("session", "bearer") else "phone"
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        return decoded_token
-    except Exception as e:
-        print(f"Token verification failed: {e}")
-        return None
+        if scheme == "session":
+            tenant, session = verify_session(credential.strip()), None
+        elif scheme == "bearer":
+            claims = await firebase_verifier.verify(credential.strip())
+            if not claims.get("phone_number"):
+                raise AuthError("Token has no phone number")
+            tenant = await get_tenant_by_phone(claims["phone_number"])
+            if not tenant:
+                raise AuthError("User not found")
+            session = issue_session(tenant)
+        elif phone_number and ALLOW_PHONE_HEADER_AUTH:
+            tenant, session = await get_tenant_by_phone(phone_number), None
+            if not tenant:
+                raise AuthError("User not found")
+        else:
+            raise AuthError("Missing credentials")
+    except (AuthError, ValueError, KeyError) as e:
+        _count(method, "denied")
+        raise e if isinstance(e, AuthError) else AuthError("Malformed credentials")
+    _count(method, "ok")
+    return tenant, session
@@ -0,0 +1,96 @@
+import time
+import asyncio
+import importlib
+import threading
+
+# Lazy client registry.
+# Nothing expensive (SDK imports, client construction, credential loading)
+# happens at import time any more: each client is built by its factory on first
+# use, or ahead of time by warm_up() running in the background once the server
+# is accepting connections. A missing env var now fails that one client (and
+# shows up on /health/ready) instead of crashing the whole import.
+
+_factories = {}   # name -> (factory, required for readiness)
+_instances = {}
+_errors = {}
+_timings = {}
+_lock = threading.Lock()
+
+
+def register(name: str, factory, required: bool = True):
+    """`factory()` builds the client (sync; may import heavy modules)."""
+    _factories[name] = (factory, required)
+
+
+def get(name: str):
+    """The client, built on first use. Raises whatever the factory raised."""
+    client = _instances.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _instances.get(name)
+        if client is None:
+            factory, _ = _factories[name]
+            start = time.perf_counter()
+            try:
+                client = factory()
+            except Exception as e:
+                _errors[name] = f"{type(e).__name__}: {e}"
+                raise
+            _timings[name] = time.perf_counter() - start
+            _errors.pop(name, None)
+            _instances[name] = client
+    return client
+
+
+def is_ready(name: str) -> bool:
+    return name in _instances
+
+
+def reset(name: str):
+    """Forgets a client (it is rebuilt on next use)."""
+    with _lock:
+        _instances.pop(name, None)
+
+
+async def warm_up(modules=(), names=None):
+    """
+    Imports `modules` (which register their clients) and builds the clients in
+    a worker thread, so the event loop keeps serving requests meanwhile.
+    """
+    # Let the server finish binding its port first
+    await asyncio.sleep(0)
+    for module in modules:
+        try:
+            await asyncio.to_thread(importlib.import_module, module)
+        except Exception as e:
+            print(f"Client warm-up: could not import {module}: {e}")
+    for name in names or list(_factories):
+        try:
+            await asyncio.to_thread(get, name)
+        except Exception as e:
+            print(f"Client warm-up: {name} failed: {e}")
+    print("Client warm-up finished: " + ", ".join(f"{n}={s}" for n, s in status().items()))
+
+
+def status() -> dict:
+    result = {}
+    for name in _factories:
+        if name in _instances:
+            result[name] = "ready"
+        elif name in _errors:
+            result[name] = "error"
+        else:
+            result[name] = "pending"
+    return result
+
+
+def readiness() -> dict:
+    """{'ready': bool, 'clients': {...}, 'errors': {...}, 'init_ms': {...}} for /health/ready."""
+    ready = all(name in _instances for name, (_, required) in _factories.items() if required)
+    return {
+        "ready": ready,
+        "clients": status(),
+        "errors": dict(_errors),
+        "init_ms": {name: round(t * 1000, 1) for name, t in _timings.items()},
+    }
@@ -0,0 +1,59 @@
+import os
+import uuid
+from cachetools import LRUCache
+
+# Per-tenant data versions for /api/dashboard.
+# Every write path for a tenant bumps its version; the dashboard ETag is
+# derived from it, so an unchanged poll is answered with 304 Not Modified and
+# the last response is served from memory without touching Supabase.
+# Versions are per process; BOOT_ID makes ETags from a previous run stale.
+
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "1000"))
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+class DashboardCache:
+    def __init__(self, maxsize: int = DASHBOARD_CACHE_SIZE):
+        self._versions = {}
+        self._responses = LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+
+    def version(self, tenant_id: str) -> int:
+        return self._versions.get(tenant_id, 0)
+
+    def bump(self, tenant_id: str):
+        """Called by every write path that changes what the tenant's dashboard shows."""
+        if tenant_id:
+            self._versions[tenant_id] = self._versions.get(tenant_id, 0) + 1
+
+    def etag(self, tenant_id: str, version: int = None) -> str:
+        if version is None:
+            version = self.version(tenant_id)
+        return f'W/"{BOOT_ID}-{tenant_id}-{version}"'
+
+    def matches(self, if_none_match: str, etag: str) -> bool:
+        """If-None-Match check (the header may list several tags, or be '*')."""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    def get(self, tenant_id: str):
+        """The cached dashboard payload if it is still current, else None."""
+        entry = self._responses.get(tenant_id)
+        if entry is not None and entry[0] == self.version(tenant_id):
+            return entry[1]
+        return None
+
+    def put(self, tenant_id: str, version: int, payload: dict):
+        # Only store it if no write happened while we were fetching
+        if version == self.version(tenant_id):
+            self._responses[tenant_id] = (version, payload)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "not_modified": self.not_modified, "misses": self.misses}
+
+
+dashboard_cache = DashboardCache()
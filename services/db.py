@@ -1,143 +1,502 @@
 import os
-from supabase import create_client, Client
+import json
+import base64
+import re
+import httpx
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from services import clients, resilience
+from services.metrics import timed, log
+from services.tenant_cache import tenant_cache, normalize_phone, MISSING
+from services.dashboard_cache import dashboard_cache
+from services.delta_buffer import WRITE_BEHIND, get_delta_buffer
 
 load_dotenv()
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
-supabase: Client = create_client(url, key)
+# Connection pool for the PostgREST API. Every query is awaited, so a slow
+# round trip only suspends its own request instead of the whole event loop.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "10"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "5"))
 
-def get_tenant_by_phone(phone_number: str):
-    response = supabase.table("tenants").select("*").eq("phone_number", phone_number).execute()
-    if response.data:
-        return response.data[0]
-    return None
+def create_db_client(supabase_url: str, supabase_key: str) -> "AsyncPostgrestClient":
+    """
+    Builds the async PostgREST client on top of one shared, pooled HTTP/2 session.
+    """
+    from postgrest import AsyncPostgrestClient
 
-def add_inventory_log(tenant_id: str, item_name: str, quantity: float, unit: str, action: str):
-    # This is a simplified logic. In a real app we might update a current stock table
-    # and also keep a transaction log. For now, let's assume we update an inventory item.
-    
-    # First check if item exists
-    response = supabase.table("inventory").select("*").eq("tenant_id", tenant_id).eq("item_name", item_name).execute()
-    
-    current_qty = 0
-    if response.data:
-        current_qty = response.data[0]['quantity']
-        
-    new_qty = current_qty
-    if action.upper() == "IN":
-        new_qty += quantity
-    elif action.upper() == "OUT":
-        new_qty -= quantity
-        
-    data = {
-        "tenant_id": tenant_id,
-        "item_name": item_name,
-        "quantity": new_qty,
-        "unit": unit
-    }
-    
-    if response.data:
-        # Update
-        supabase.table("inventory").update(data).eq("id", response.data[0]['id']).execute()
-    else:
-        # Insert
-        supabase.table("inventory").insert(data).execute()
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=DB_POOL_SIZE, max_keepalive_connections=DB_POOL_SIZE),
+        timeout=httpx.Timeout(DB_TIMEOUT, connect=DB_CONNECT_TIMEOUT),
+    )
+    return AsyncPostgrestClient(
+        f"{supabase_url}/rest/v1",
+        headers={
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "apikey": supabase_key,
+            "Authorization": f"Bearer {supabase_key}",
+        },
+        http_client=http_client,
+    )
+
+# Storage backend: "supabase" (PostgREST over HTTPS) or "sqlite" (embedded, on
+# local disk; see services/sqlite_store.py). Both expose the same
+# table()/rpc() query-builder surface, so everything below runs on either.
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase").lower()
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "mandi.sqlite3")
+
+def create_sqlite_client(path: str = SQLITE_DB_PATH):
+    from services.sqlite_store import SQLiteClient
+    return SQLiteClient(path)
+
+def _build_client():
+    if DB_BACKEND == "sqlite":
+        return create_sqlite_client(SQLITE_DB_PATH)
+    if DB_BACKEND != "supabase":
+        raise RuntimeError(f"Unknown DB_BACKEND {DB_BACKEND!r} (expected 'supabase' or 'sqlite')")
+    if not url or not key:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set")
+    return create_db_client(url, key)
+
+clients.register("db", _build_client)
 
-    return new_qty
+# Set to override the registry client (tests and scripts assign a client or mock here)
+supabase = None
+
+def get_client():
+    """The storage client for DB_BACKEND, created on first use (or by the startup warm-up)."""
+    return supabase if supabase is not None else clients.get("db")
+
+# Columns the API actually returns (avoids select("*") on hot read paths)
+INVENTORY_COLUMNS = "id,item_name,quantity,unit,last_updated"
+TRANSACTION_COLUMNS = "id,transaction_type,item_name,quantity,unit,rate,total_amount,buyer_name,is_credit,created_at"
+
+DAILY_TOTAL_COLUMNS = "item_name,transaction_type,quantity,total_amount,tx_count"
+BUYER_BALANCE_COLUMNS = "buyer_name,balance,tx_count,last_credit_at"
+
+# Business day boundary for the ledger; must match ledger_day() in schema.sql
+LEDGER_TZ = timezone(timedelta(hours=5), "PKT")
+
+TRANSACTIONS_PAGE_SIZE = int(os.getenv("TRANSACTIONS_PAGE_SIZE", "50"))
+TRANSACTIONS_MAX_PAGE_SIZE = int(os.getenv("TRANSACTIONS_MAX_PAGE_SIZE", "200"))
+
+async def _execute(query, idempotent: bool = True):
+    """
+    Runs a query builder under the "db" deadline, retry policy and circuit
+    breaker (services/resilience.py). Reads and writes that are safe to repeat
+    are retried on transient errors; pass idempotent=False for the rest
+    (stock deltas, inserts), which a lost response may already have applied.
+    """
+    return await resilience.call("db", query.execute, idempotent=idempotent)
+
+async def close_db():
+    """Closes the pooled HTTP connections / the SQLite file (called on app shutdown)."""
+    if supabase is not None:
+        await supabase.aclose()
+    elif clients.is_ready("db"):
+        await clients.get("db").aclose()
+        clients.reset("db")
+
+@timed()
+async def get_tenant_by_phone(phone_number: str):
+    """
+    Looks up a tenant by phone number. Served from the in-process tenant
+    cache when possible (including cached 'not registered' answers).
+    """
+    phone = normalize_phone(phone_number)
+    tenant = tenant_cache.get(phone)
+    if tenant is not MISSING:
+        return tenant
 
-def record_transaction(tenant_id: str, item_name: str, quantity: float, unit: str, 
+    response = await _execute(get_client().table("tenants").select("*").eq("phone_number", phone))
+    tenant = response.data[0] if response.data else None
+    tenant_cache.put(phone, tenant)
+    return tenant
+
+def stock_delta(quantity: float, action: str) -> float:
+    """Signed stock change for an IN/OUT action (anything else leaves stock as is)."""
+    if action and action.upper() == "IN":
+        return quantity
+    elif action and action.upper() == "OUT":
+        return -quantity
+    return 0
+
+@timed()
+async def add_inventory_log(tenant_id: str, item_name: str, quantity: float, unit: str, action: str):
+    """
+    Applies an IN/OUT stock movement and returns the new quantity.
+    The increment happens inside Postgres (apply_stock_delta, an
+    INSERT ... ON CONFLICT DO UPDATE), so it is one round trip and
+    concurrent updates to the same item can't overwrite each other.
+    With INVENTORY_WRITE_BEHIND=1 the delta goes to the write-behind buffer instead.
+    """
+    if WRITE_BEHIND:
+        # Journaled + buffered; written to Postgres in coalesced batches
+        buffer = get_delta_buffer()
+        buffer.add(tenant_id, item_name, stock_delta(quantity, action), unit)
+        dashboard_cache.bump(tenant_id)
+        return await buffer.quantity(tenant_id, item_name, lambda: _fetch_inventory_item(tenant_id, item_name))
+
+    response = await _execute(get_client().rpc("apply_stock_delta", {
+        "p_tenant_id": tenant_id,
+        "p_item_name": item_name,
+        "p_delta": stock_delta(quantity, action),
+        "p_unit": unit
+    }), idempotent=False)
+    dashboard_cache.bump(tenant_id)
+    return response.data
+
+async def _direct_write_done(tenant_id: str, item_names=None):
+    """
+    A stock write that went straight to the database: the write-behind
+    buffer's cached persisted quantities for those items are stale now.
+    """
+    if WRITE_BEHIND:
+        buffer = get_delta_buffer()
+        # Under the lock, so a read that started before the write can't re-cache the old value
+        async with buffer.tenant_lock(tenant_id):
+            buffer.forget(tenant_id, item_names)
+
+@timed()
+async def record_transaction(tenant_id: str, item_name: str, quantity: float, unit: str, 
                       transaction_type: str, rate: float = None, buyer_name: str = None, 
                       is_credit: bool = False):
     """
     Records a transaction (Sale/Purchase) and updates inventory.
+    Both writes happen in one RPC (record_stock_transaction), atomically.
     """
-    # 1. Update Inventory First (Reusing existing logic or refining it)
-    action = "IN" if transaction_type == "PURCHASE" else "OUT"
-    new_qty = add_inventory_log(tenant_id, item_name, quantity, unit, action)
-    
-    # 2. Calculate Total
+    # 1. Calculate Total
     total_amount = 0
     if rate:
         total_amount = float(quantity) * float(rate)
 
-    # 3. Insert Transaction Record
+    # 2. Update Inventory + Insert Transaction Record
     try:
-        data = {
-            "tenant_id": tenant_id,
-            "transaction_type": transaction_type,
-            "item_name": item_name,
-            "quantity": quantity,
-            "unit": unit,
-            "rate": rate,
-            "total_amount": total_amount,
-            "buyer_name": buyer_name,
-            "is_credit": is_credit
-        }
-        supabase.table("transactions").insert(data).execute()
-        return {"status": "success", "new_qty": new_qty, "total_amount": total_amount}
+        response = await _execute(get_client().rpc("record_stock_transaction", {
+            "p_tenant_id": tenant_id,
+            "p_transaction_type": transaction_type,
+            "p_item_name": item_name,
+            "p_quantity": quantity,
+            "p_unit": unit,
+            "p_rate": rate,
+            "p_total_amount": total_amount,
+            "p_buyer_name": buyer_name,
+            "p_is_credit": is_credit
+        }), idempotent=False)
+        dashboard_cache.bump(tenant_id)
+        await _direct_write_done(tenant_id, [item_name])
+        return {"status": "success", "new_qty": response.data, "total_amount": total_amount}
     except Exception as e:
-        print(f"Error recording transaction: {e}")
+        log(f"Error recording transaction: {e}")
         return {"status": "error", "message": str(e)}
 
-def create_tenant(phone_number: str, business_name: str = "My Mandi Shop"):
+@timed()
+async def apply_stock_batch(tenant_id: str, lines: list, batch_id: str = None):
+    """
+    Applies several stock movements (and their ledger rows) in one RPC and one
+    database transaction. Each line: item_name, quantity, unit, action or
+    transaction_type (SALE/PURCHASE), and optionally rate, buyer_name, is_credit.
+    With a batch_id the batch is applied at most once (safe to retry).
+    Returns {item_name: new quantity}.
+    """
+    payload = []
+    for line in lines:
+        transaction_type = line.get("transaction_type")
+        rate = line.get("rate")
+        if transaction_type:
+            delta = line["quantity"] if transaction_type == "PURCHASE" else -line["quantity"]
+        else:
+            delta = stock_delta(line["quantity"], line.get("action"))
+        payload.append({
+            "item_name": line["item_name"],
+            "quantity": line["quantity"],
+            "unit": line.get("unit"),
+            "delta": delta,
+            "transaction_type": transaction_type,
+            "rate": rate,
+            "total_amount": float(line["quantity"]) * float(rate) if rate else 0,
+            "buyer_name": line.get("buyer_name"),
+            "is_credit": bool(line.get("is_credit")),
+        })
+    if batch_id:
+        response = await _execute(get_client().rpc("apply_stock_batch_once", {
+            "p_batch_id": batch_id, "p_tenant_id": tenant_id, "p_lines": payload
+        }))
+    else:
+        response = await _execute(get_client().rpc("apply_stock_batch", {"p_tenant_id": tenant_id, "p_lines": payload}),
+                                  idempotent=False)
+        # (Batches with an id are the write-behind flush itself, which updates the buffer)
+        await _direct_write_done(tenant_id, [line["item_name"] for line in payload])
+    dashboard_cache.bump(tenant_id)
+    return {row["item"]: row["new_qty"] for row in response.data}
+
+@timed()
+async def create_tenant(phone_number: str, business_name: str = "My Mandi Shop"):
     """
     Creates a new tenant in the database.
     """
+    phone = normalize_phone(phone_number)
     try:
         data = {
-            "phone_number": phone_number,
+            "phone_number": phone,
             "business_name": business_name
         }
-        response = supabase.table("tenants").insert(data).execute()
+        response = await _execute(get_client().table("tenants").insert(data), idempotent=False)
+        # Forget any cached "not registered" answer for this number
+        tenant_cache.invalidate(phone)
         if response.data:
+            tenant_cache.put(phone, response.data[0])
             return response.data[0]
         return None
     except Exception as e:
-        print(f"Error creating tenant: {e}")
+        log(f"Error creating tenant: {e}")
         return None
 
-def get_inventory(tenant_id: str):
+@timed()
+async def get_inventory(tenant_id: str):
     """
     Fetches all inventory items for a specific tenant.
     """
     try:
-        response = supabase.table("inventory").select("*").eq("tenant_id", tenant_id).execute()
+        if WRITE_BEHIND:
+            # Persisted rows + deltas still in the write-behind buffer
+            buffer = get_delta_buffer()
+            async with buffer.tenant_lock(tenant_id):
+                response = await _execute(get_client().table("inventory").select(INVENTORY_COLUMNS).eq("tenant_id", tenant_id))
+                return buffer.merge_rows(tenant_id, response.data)
+        response = await _execute(get_client().table("inventory").select(INVENTORY_COLUMNS).eq("tenant_id", tenant_id))
         return response.data
     except Exception as e:
-        print(f"Error fetching inventory: {e}")
+        log(f"Error fetching inventory: {e}")
         return []
 
-def update_inventory_item(item_id: int, data: dict):
-    """Updates an inventory item directly."""
+@timed()
+async def _fetch_inventory_item(tenant_id: str, item_name: str):
+    response = await _execute(get_client().table("inventory").select("*").eq("tenant_id", tenant_id).eq("item_name", item_name))
+    if response.data:
+        return response.data[0]
+    return None
+
+@timed()
+async def get_inventory_item(tenant_id: str, item_name: str):
+    """
+    Fetches a single inventory row by item name (None if the tenant has no such item).
+    """
+    if WRITE_BEHIND:
+        buffer = get_delta_buffer()
+        async with buffer.tenant_lock(tenant_id):
+            row = await _fetch_inventory_item(tenant_id, item_name)
+            merged = buffer.merge_rows(tenant_id, [row] if row else [])
+        return next((r for r in merged if r["item_name"] == item_name), None)
+    return await _fetch_inventory_item(tenant_id, item_name)
+
+@timed()
+async def get_item_names(tenant_id: str):
+    """
+    Fetches the item names a tenant stocks (raises on failure, unlike get_inventory).
+    """
+    response = await _execute(get_client().table("inventory").select("item_name").eq("tenant_id", tenant_id))
+    return [row["item_name"] for row in response.data]
+
+@timed()
+async def get_all_item_names(page_size: int = 1000):
+    """
+    Fetches (tenant_id, item_name) for every inventory row, page by page.
+    Used to build the item normalization index at startup.
+    """
+    rows = []
+    start = 0
+    while True:
+        response = await _execute(get_client().table("inventory").select("tenant_id,item_name").order("id").range(start, start + page_size - 1))
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            return rows
+        start += page_size
+
+@timed()
+async def get_recent_transactions(tenant_id: str, limit: int = 20):
+    """
+    Fetches the latest transactions for a tenant, newest first.
+    """
+    try:
+        response = await _execute(get_client().table("transactions").select(TRANSACTION_COLUMNS).eq("tenant_id", tenant_id).order("created_at", desc=True).limit(limit))
+        return response.data
+    except Exception as e:
+        log(f"Error fetching transactions: {e}")
+        return []
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor for the (created_at, id) position of the last row on a page."""
+    raw = json.dumps([row["created_at"], str(row["id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Returns (created_at, id); raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+def _quote(value: str) -> str:
+    # PostgREST logic-tree values with ':' / '+' / ',' must be double-quoted
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "")
+    return f"%{escaped}%"
+
+@timed()
+async def get_transactions_page(tenant_id: str, limit: int = TRANSACTIONS_PAGE_SIZE, cursor: str = None,
+                                item_name: str = None, buyer_name: str = None, credit_only: bool = False,
+                                since: str = None, until: str = None):
+    """
+    One page of a tenant's transaction history, newest first.
+    Keyset pagination on (created_at, id): every page is an index range scan on
+    transactions_tenant_created_idx, no matter how deep the client has paged.
+    `since` is inclusive, `until` exclusive. Raises on DB errors / bad cursors.
+    """
+    limit = max(1, min(limit, TRANSACTIONS_MAX_PAGE_SIZE))
+    query = get_client().table("transactions").select(TRANSACTION_COLUMNS).eq("tenant_id", tenant_id)
+    if item_name:
+        query = query.eq("item_name", item_name)
+    if buyer_name:
+        query = query.ilike("buyer_name", _like_pattern(buyer_name))
+    if credit_only:
+        query = query.eq("is_credit", "true")
+    if since:
+        query = query.gte("created_at", since)
+    if until:
+        query = query.lt("created_at", until)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # The plain upper bound is what lets Postgres start the index scan at the
+        # cursor; the `or` only breaks ties between rows with the same created_at.
+        query = query.lte("created_at", created_at).or_(
+            f"created_at.lt.{_quote(created_at)},"
+            f"and(created_at.eq.{_quote(created_at)},id.lt.{_quote(row_id)})"
+        )
+
+    # One extra row tells us whether there is a next page
+    response = await _execute(query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1))
+    rows = response.data
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"transactions": rows[:limit], "next_cursor": next_cursor}
+
+async def _edit_inventory_row(tenant_id: str, query):
+    """
+    Runs a dashboard edit of an inventory row. With the write-behind buffer,
+    deltas still pending for the tenant are flushed first: the edit replaces
+    the quantity the user saw, which already counted them, so they must not
+    land on top of it afterwards.
+    """
+    if tenant_id and WRITE_BEHIND:
+        buffer = get_delta_buffer()
+        await buffer.flush()
+        async with buffer.tenant_lock(tenant_id):
+            await _execute(query)
+            buffer.forget(tenant_id)
+        return
+    await _execute(query)
+
+@timed()
+async def update_inventory_item(item_id: int, data: dict, tenant_id: str = None):
+    """Updates an inventory item directly (e.g. sets its quantity)."""
     try:
-        supabase.table("inventory").update(data).eq("id", item_id).execute()
+        await _edit_inventory_row(tenant_id, get_client().table("inventory").update(data).eq("id", item_id))
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def delete_inventory_item(item_id: int):
+@timed()
+async def delete_inventory_item(item_id: int, tenant_id: str = None):
     """Deletes an inventory item."""
     try:
-        supabase.table("inventory").delete().eq("id", item_id).execute()
+        await _edit_inventory_row(tenant_id, get_client().table("inventory").delete().eq("id", item_id))
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def update_transaction(tx_id: str, data: dict):
-    """Updates a transaction (e.g. correcting a rate/name)."""
+@timed()
+async def update_transaction(tx_id: str, data: dict):
+    """
+    Updates a transaction (e.g. correcting a rate/name).
+    The ledger aggregates follow automatically (transactions_ledger trigger).
+    """
     try:
-        supabase.table("transactions").update(data).eq("id", tx_id).execute()
+        await _execute(get_client().table("transactions").update(data).eq("id", tx_id))
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def delete_transaction(tx_id: str):
-    """Deletes a transaction record."""
+@timed()
+async def delete_transaction(tx_id: str):
+    """Deletes a transaction record (and its share of the ledger aggregates)."""
     try:
-        supabase.table("transactions").delete().eq("id", tx_id).execute()
+        await _execute(get_client().table("transactions").delete().eq("id", tx_id))
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
+
+# --- Ledger aggregates (daily_item_totals / buyer_balances, see schema.sql) ---
+
+def ledger_today() -> str:
+    return datetime.now(LEDGER_TZ).date().isoformat()
+
+def buyer_key(buyer_name: str) -> str:
+    """Same normalization as buyer_key() in schema.sql."""
+    return re.sub(r"\s+", " ", (buyer_name or "").strip()).lower()
+
+@timed()
+async def get_daily_totals(tenant_id: str, day: str = None, item_name: str = None):
+    """
+    Per-item SALE / PURCHASE totals for one business day (default: today).
+    Reads the pre-aggregated rows, never the transactions table.
+    """
+    query = get_client().table("daily_item_totals").select(DAILY_TOTAL_COLUMNS) \
+        .eq("tenant_id", tenant_id).eq("day", day or ledger_today()).gt("tx_count", 0)
+    if item_name:
+        query = query.eq("item_name", item_name)
+    response = await _execute(query)
+    return response.data
+
+@timed()
+async def get_buyer_balance(tenant_id: str, buyer_name: str):
+    """
+    A buyer's outstanding credit (None if they have no khata).
+    Exact key first; otherwise a unique prefix match, so "rashid" finds "Rashid Bhai".
+    """
+    key = buyer_key(buyer_name)
+    if not key:
+        return None
+    response = await _execute(get_client().table("buyer_balances").select(BUYER_BALANCE_COLUMNS) \
+        .eq("tenant_id", tenant_id).eq("buyer_key", key))
+    if response.data:
+        return response.data[0]
+    pattern = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    response = await _execute(get_client().table("buyer_balances").select(BUYER_BALANCE_COLUMNS) \
+        .eq("tenant_id", tenant_id).like("buyer_key", pattern).gt("tx_count", 0).limit(2))
+    if len(response.data) == 1:
+        return response.data[0]
+    return None
+
+@timed()
+async def get_buyer_balances(tenant_id: str):
+    """Every buyer with outstanding credit, largest balance first."""
+    response = await _execute(get_client().table("buyer_balances").select(BUYER_BALANCE_COLUMNS) \
+        .eq("tenant_id", tenant_id).neq("balance", 0).order("balance", desc=True))
+    return response.data
+
+@timed()
+async def rebuild_ledger_aggregates(tenant_id: str = None):
+    """Recomputes the aggregates from transactions (backfill/repair); returns rows scanned."""
+    response = await _execute(get_client().rpc("rebuild_ledger_aggregates", {"p_tenant_id": tenant_id}))
+    return response.data
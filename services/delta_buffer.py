@@ -0,0 +1,313 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from collections import deque
+from cachetools import TTLCache
+
+# Write-behind buffer for inventory IN/OUT deltas (INVENTORY_WRITE_BEHIND=1).
+# During the morning rush one tenant fires dozens of updates for the same few
+# items; instead of one RPC each, deltas are summed per (tenant, item) in memory
+# and flushed in bulk (one apply_stock_batch_once call per tenant) when enough
+# are pending, every FLUSH_INTERVAL seconds, and on shutdown.
+#
+# Every delta is appended to a local SQLite journal before it is acknowledged,
+# so a crash loses nothing: unflushed rows are replayed on the next start.
+# A flush first records its batch id in the journal; Postgres remembers applied
+# batch ids, so replaying a batch whose response was lost can't apply it twice.
+
+WRITE_BEHIND = os.getenv("INVENTORY_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+
+
+class DeltaBuffer:
+    def __init__(self, path: str, flush_fn, max_pending: int = 200, flush_interval: float = 1.0,
+                 baseline_ttl: float = 60.0):
+        """
+        `flush_fn(tenant_id, lines, batch_id)` is an async callable that applies
+        the coalesced lines ({item_name, quantity, unit, action}) and returns
+        {item_name: new quantity}. It must be idempotent per batch_id.
+        """
+        self.path = path
+        self.flush_fn = flush_fn
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        self._pending = {}       # (tenant_id, item_name) -> [delta, unit]
+        self._inflight = {}      # batch_id -> (tenant_id, {item_name: [delta, unit]}, (min_id, max_id])
+        self._received = 0       # deltas since the last flush started (size trigger)
+        self._baseline = TTLCache(maxsize=10000, ttl=baseline_ttl)   # persisted qty per (tenant, item)
+        self._tenant_locks = {}
+        self._flush_lock = asyncio.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+
+        self.deltas_received = 0
+        self.deltas_flushed = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self._latencies = deque(maxlen=200)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Same durability trade-off as the job queue: WAL + synchronous=NORMAL
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS deltas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id TEXT NOT NULL,
+                item_name TEXT NOT NULL,
+                delta REAL NOT NULL,
+                unit TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS flushes (
+                batch_id TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                min_id INTEGER NOT NULL,
+                max_id INTEGER NOT NULL
+            )
+        """)
+        self.recover()
+
+    def recover(self) -> int:
+        """Reloads journaled deltas that were never confirmed as flushed."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, tenant_id, item_name, delta, unit FROM deltas ORDER BY id").fetchall()
+            batches = self._conn.execute("SELECT batch_id, tenant_id, min_id, max_id FROM flushes").fetchall()
+            for batch_id, tenant_id, min_id, max_id in batches:
+                self._inflight[batch_id] = (tenant_id, {}, (min_id, max_id))
+            for row_id, tenant_id, item_name, delta, unit in rows:
+                # Rows claimed by a flush that never confirmed are retried under the same batch id
+                batch_id = next((b for b, t, lo, hi in batches if t == tenant_id and lo < row_id <= hi), None)
+                if batch_id is not None:
+                    self._merge(self._inflight[batch_id][1], item_name, delta, unit)
+                else:
+                    self._merge_pending(tenant_id, item_name, delta, unit)
+        if rows:
+            print(f"DeltaBuffer: replaying {len(rows)} unflushed delta(s) from {self.path}")
+        return len(rows)
+
+    @staticmethod
+    def _merge(items: dict, item_name: str, delta: float, unit: str):
+        entry = items.setdefault(item_name, [0.0, unit])
+        entry[0] += delta
+        entry[1] = unit or entry[1]
+
+    def _merge_pending(self, tenant_id: str, item_name: str, delta: float, unit: str):
+        entry = self._pending.setdefault((tenant_id, item_name), [0.0, unit])
+        entry[0] += delta
+        entry[1] = unit or entry[1]
+
+    def tenant_lock(self, tenant_id: str) -> asyncio.Lock:
+        """Held while a tenant's batch is being applied, so reads never count a delta twice."""
+        lock = self._tenant_locks.get(tenant_id)
+        if lock is None:
+            lock = self._tenant_locks[tenant_id] = asyncio.Lock()
+        return lock
+
+    def add(self, tenant_id: str, item_name: str, delta: float, unit: str = None):
+        """Journals and buffers one delta. Once this returns the delta is durable."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO deltas (tenant_id, item_name, delta, unit, created_at) VALUES (?, ?, ?, ?, ?)",
+                (tenant_id, item_name, delta, unit, time.time()),
+            )
+            self._merge_pending(tenant_id, item_name, delta, unit)
+            self.deltas_received += 1
+            self._received += 1
+            full = self._received >= self.max_pending
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self, tenant_id: str) -> dict:
+        """Unconfirmed deltas for a tenant: {item_name: [delta, unit]} (buffered + in-flight)."""
+        merged = {}
+        with self._lock:
+            for (tenant, item_name), (delta, unit) in self._pending.items():
+                if tenant == tenant_id:
+                    self._merge(merged, item_name, delta, unit)
+            for tenant, items, _ in self._inflight.values():
+                if tenant == tenant_id:
+                    for item_name, (delta, unit) in items.items():
+                        self._merge(merged, item_name, delta, unit)
+        return merged
+
+    def merge_rows(self, tenant_id: str, rows: list) -> list:
+        """
+        Persisted inventory rows + pending deltas (call under tenant_lock).
+        Items that only exist in the buffer so far get a row with id None.
+        """
+        pending = self.pending(tenant_id)
+        merged = []
+        for row in rows:
+            self._baseline[(tenant_id, row["item_name"])] = float(row["quantity"] or 0)
+            entry = pending.pop(row["item_name"], None)
+            if entry:
+                row = {**row, "quantity": float(row["quantity"] or 0) + entry[0]}
+            merged.append(row)
+        for item_name, (delta, unit) in pending.items():
+            merged.append({"id": None, "item_name": item_name, "quantity": delta, "unit": unit or "kg"})
+        return merged
+
+    async def quantity(self, tenant_id: str, item_name: str, read_fn):
+        """
+        Merged quantity of one item. `read_fn()` fetches the persisted row; it is
+        only called when no recent persisted value is known.
+        """
+        async with self.tenant_lock(tenant_id):
+            base = self._baseline.get((tenant_id, item_name))
+            if base is None:
+                row = await read_fn()
+                base = float(row["quantity"] or 0) if row else 0.0
+                self._baseline[(tenant_id, item_name)] = base
+            entry = self.pending(tenant_id).get(item_name)
+            return base + (entry[0] if entry else 0.0)
+
+    def forget(self, tenant_id: str, item_names=None):
+        """
+        Drops cached persisted quantities for a tenant (all, or just `item_names`).
+        Call under tenant_lock after a stock write that bypassed the buffer.
+        """
+        keys = ([(tenant_id, name) for name in item_names] if item_names is not None
+                else [key for key in list(self._baseline) if key[0] == tenant_id])
+        for key in keys:
+            self._baseline.pop(key, None)
+
+    def _take(self):
+        """Moves everything pending into new in-flight batches (one per tenant)."""
+        with self._lock:
+            self._received = 0
+            if not self._pending:
+                return
+            by_tenant = {}
+            for (tenant_id, item_name), (delta, unit) in self._pending.items():
+                by_tenant.setdefault(tenant_id, {})[item_name] = [delta, unit]
+            self._pending = {}
+            for tenant_id, items in by_tenant.items():
+                # This batch owns the tenant's journal rows after any batch still in flight
+                min_id = max([hi for t, _, (_, hi) in self._inflight.values() if t == tenant_id], default=0)
+                max_id = self._conn.execute(
+                    "SELECT MAX(id) FROM deltas WHERE tenant_id = ?", (tenant_id,)
+                ).fetchone()[0]
+                batch_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO flushes (batch_id, tenant_id, min_id, max_id) VALUES (?, ?, ?, ?)",
+                    (batch_id, tenant_id, min_id, max_id),
+                )
+                self._inflight[batch_id] = (tenant_id, items, (min_id, max_id))
+
+    async def _flush_batch(self, batch_id: str):
+        tenant_id, items, (min_id, max_id) = self._inflight[batch_id]
+        lines = [
+            {"item_name": item_name, "quantity": abs(delta), "unit": unit, "action": "IN" if delta > 0 else "OUT"}
+            for item_name, (delta, unit) in items.items() if delta
+        ]
+        async with self.tenant_lock(tenant_id):
+            new_qty = await self.flush_fn(tenant_id, lines, batch_id) if lines else {}
+            with self._lock:
+                self._conn.execute("BEGIN")
+                journaled = self._conn.execute(
+                    "DELETE FROM deltas WHERE tenant_id = ? AND id > ? AND id <= ?", (tenant_id, min_id, max_id)
+                ).rowcount
+                self._conn.execute("DELETE FROM flushes WHERE batch_id = ?", (batch_id,))
+                self._conn.execute("COMMIT")
+                del self._inflight[batch_id]
+                for item_name, qty in new_qty.items():
+                    self._baseline[(tenant_id, item_name)] = float(qty)
+                self.deltas_flushed += journaled
+                self.rows_written += len(lines)
+
+    async def flush(self) -> int:
+        """Writes everything buffered (and retries failed batches). Returns batches applied."""
+        # One flush at a time (the flusher, shutdown, a dashboard edit): two would
+        # both pick up the same in-flight batches. A caller that waited still gets
+        # everything added before it called written by the time this returns.
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        self._take()
+        batch_ids = list(self._inflight)
+        if not batch_ids:
+            return 0
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._flush_batch(b) for b in batch_ids), return_exceptions=True)
+        self._latencies.append(time.perf_counter() - start)
+        self.flushes += 1
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            # The batches stay in flight and are retried, with the same id, next time
+            self.flush_errors += len(failed)
+            print(f"DeltaBuffer: {len(failed)} of {len(batch_ids)} batch(es) failed: {failed[0]}")
+        return len(batch_ids) - len(failed)
+
+    async def _flusher(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"DeltaBuffer: flush failed: {e}")
+
+    def start(self):
+        """Starts the background flusher on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        """Stops the flusher and writes out whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        with self._lock:
+            pending = len(self._pending) + sum(len(items) for _, items, _ in self._inflight.values())
+        return {
+            "deltas_received": self.deltas_received,
+            "deltas_flushed": self.deltas_flushed,
+            "rows_written": self.rows_written,
+            # Deltas per row actually written to Postgres
+            "coalescing_ratio": round(self.deltas_flushed / self.rows_written, 2) if self.rows_written else None,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "pending_items": pending,
+            "flush_ms_avg": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "flush_ms_max": round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+_buffer: DeltaBuffer = None
+
+
+def get_delta_buffer() -> DeltaBuffer:
+    global _buffer
+    if _buffer is None:
+        from services.db import apply_stock_batch
+
+        async def flush_fn(tenant_id, lines, batch_id):
+            return await apply_stock_batch(tenant_id, lines, batch_id=batch_id)
+
+        _buffer = DeltaBuffer(
+            os.getenv("DELTA_JOURNAL_PATH", "mandi_deltas.sqlite3"),
+            flush_fn,
+            max_pending=int(os.getenv("DELTA_FLUSH_MAX_PENDING", "200")),
+            flush_interval=float(os.getenv("DELTA_FLUSH_INTERVAL", "1.0")),
+        )
+    return _buffer
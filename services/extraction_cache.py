@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from cachetools import LRUCache
+
+# Cache of Gemini extractions keyed by a hash of the media bytes + prompt version.
+# Twilio retries, forwarded voice notes and re-sent receipt photos hit the cache
+# and skip Gemini entirely. Two tiers: an in-memory LRU, and an optional SQLite
+# file (EXTRACTION_CACHE_PATH) that survives restarts and is pruned by total
+# size and by age.
+
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "2048"))
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "")
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EXTRACTION_CACHE_MAX_AGE = float(os.getenv("EXTRACTION_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+
+def media_cache_key(media_bytes: bytes, prompt_version: str) -> str:
+    digest = hashlib.sha256(media_bytes).hexdigest()
+    return f"{prompt_version}:{digest}"
+
+
+class ExtractionCache:
+    def __init__(self, memory_size: int = EXTRACTION_CACHE_SIZE, disk_path: str = EXTRACTION_CACHE_PATH,
+                 disk_max_bytes: int = EXTRACTION_CACHE_MAX_BYTES, disk_max_age: float = EXTRACTION_CACHE_MAX_AGE,
+                 prune_every: int = 100):
+        self._memory = LRUCache(maxsize=memory_size)
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_age = disk_max_age
+        self.prune_every = prune_every
+        self._puts = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk_path:
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS extractions (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS extractions_accessed_idx ON extractions (accessed_at)")
+            self.prune()
+
+    def get(self, key: str):
+        value = self._memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self._conn is not None:
+            now = time.time()
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value, created_at FROM extractions WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[1] <= self.disk_max_age:
+                    self._conn.execute("UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key))
+                else:
+                    row = None
+            if row:
+                self.disk_hits += 1
+                self._memory[key] = row[0]
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str):
+        self._memory[key] = value
+        if self._conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+        self._puts += 1
+        if self._puts % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Drops expired rows, then least recently used rows until under the size budget."""
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM extractions WHERE created_at < ?", (time.time() - self.disk_max_age,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+            if total <= self.disk_max_bytes:
+                return
+            excess = total - self.disk_max_bytes
+            rows = self._conn.execute("SELECT key, size FROM extractions ORDER BY accessed_at").fetchall()
+            doomed = []
+            for row_key, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((row_key,))
+                excess -= size
+            self._conn.executemany("DELETE FROM extractions WHERE key = ?", doomed)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            # Every hit is a Gemini call we didn't make
+            "gemini_calls_saved": hits,
+            "memory_size": len(self._memory),
+        }
+
+
+extraction_cache = ExtractionCache()
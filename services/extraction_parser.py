@@ -0,0 +1,147 @@
+import json
+from pydantic import ValidationError
+from models.extraction import Extraction
+
+# Parser for Gemini's extraction output.
+# With JSON mode + response_schema the answer is normally a bare object, which
+# pydantic-core validates in a single pass straight from the string. Anything
+# else goes through repair_json(), a one-pass scanner that fixes the defects we
+# see in practice (code fences, chatter around the object, single quotes,
+# Python literals, trailing commas, comments, truncated output) without asking
+# the model again. A truncated answer is only trusted when nothing it cut off
+# could change the stock: a cut-off number ("quantity": 5 of 500) or a cut-off
+# SALE/UPDATE (action, rate or buyer may be missing) is rejected instead.
+
+
+class ExtractionParseError(ValueError):
+    pass
+
+
+_LITERALS = {"True": "true", "False": "false", "None": "null", "true": "true", "false": "false", "null": "null"}
+
+
+def _read_string(text: str, i: int, out: list) -> int:
+    """Copies the string starting at text[i] as a JSON string; returns the index after it."""
+    quote = text[i]
+    n = len(text)
+    buf = ['"']
+    j = i + 1
+    while j < n and text[j] != quote:
+        ch = text[j]
+        if ch == "\\" and j + 1 < n:
+            nxt = text[j + 1]
+            # \' is not a JSON escape
+            buf.append("'" if nxt == "'" else text[j:j + 2])
+            j += 2
+            continue
+        if ch == "\n":
+            buf.append("\\n")
+        elif ch == '"':
+            buf.append('\\"')
+        else:
+            buf.append(ch)
+        j += 1
+    # An unterminated (truncated) string is closed here
+    buf.append('"')
+    out.append("".join(buf))
+    return j + 1
+
+
+def _drop_trailing_comma(out: list):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def repair_json(text: str) -> str:
+    """
+    Rewrites a messy model answer into valid JSON text for the first object in it.
+    Raises ExtractionParseError if there is no object at all.
+    """
+    return _repair(text)[0]
+
+
+def _repair(text: str) -> tuple:
+    """repair_json(), plus whether the object was truncated and whether it stopped mid-number."""
+    text = text.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    start = text.find("{")
+    if start == -1:
+        raise ExtractionParseError("No JSON object in model output")
+
+    out = []
+    stack = []
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == '"' or (ch == "'" and stack):
+            i = _read_string(text, i, out)
+            continue
+        if ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                # Ignore whatever the model wrote after the object
+                break
+        elif ch == "/" and text[i + 1:i + 2] in ("/", "*"):
+            end = text.find("\n", i) if text[i + 1] == "/" else text.find("*/", i) + 1
+            i = n if end <= 0 else end + 1
+            continue
+        elif ch.isalpha() or ch == "_":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            k = j
+            while k < n and text[k] in " \t":
+                k += 1
+            if k < n and text[k] == ":":
+                out.append(json.dumps(word))
+            else:
+                # Python literals -> JSON, anything else bare -> string (e.g. SALE)
+                out.append(_LITERALS.get(word) or json.dumps(word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # Truncated answer: finish the dangling value and close open brackets
+    truncated = bool(stack)
+    while out and out[-1].isspace():
+        out.pop()
+    mid_number = truncated and bool(out) and out[-1] in "0123456789.-+"
+    if out and out[-1] == ":":
+        out.append("null")
+    for closer in reversed(stack):
+        _drop_trailing_comma(out)
+        out.append(closer)
+    return "".join(out), truncated, mid_number
+
+
+def parse_extraction(text: str) -> Extraction:
+    """Parses Gemini output into an Extraction, repairing common defects if needed."""
+    try:
+        # Fast path: well-formed JSON, validated in one pass
+        return Extraction.model_validate_json(text)
+    except ValidationError:
+        pass
+
+    try:
+        # _repair starts at the first "{", so an answer wrapped in a list parses as its first object
+        repaired, truncated, mid_number = _repair(text)
+        extraction = Extraction.model_validate(json.loads(repaired))
+    except (ValueError, ValidationError) as e:
+        raise ExtractionParseError(f"Could not parse extraction: {e}") from e
+
+    if mid_number:
+        raise ExtractionParseError("Model output was truncated inside a number")
+    if truncated and extraction.intent in ("SALE", "UPDATE"):
+        raise ExtractionParseError(f"Model output was truncated in a {extraction.intent}")
+    return extraction
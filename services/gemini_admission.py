@@ -0,0 +1,240 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from services.metrics import inc, log, observe
+
+# Admission control in front of Gemini (generate_content).
+# A burst of voice notes used to fire one call each, all at once, run straight
+# into Gemini's rate limits and come back to users as errors. Every call now
+# takes a slot first:
+#   - at most `limit` calls in flight, and a tokens-per-minute budget (the
+#     tokens of the last 60s plus an estimate per call in flight);
+#   - waiting callers are queued per tenant and served round-robin, so one busy
+#     wholesaler's backlog can't starve everyone else;
+#   - the queue is bounded (in total and per tenant) and a wait is capped at
+#     GEMINI_MAX_QUEUE_WAIT: past that the caller gets GeminiBusy at once and the
+#     user a "try again" reply instead of a timeout;
+#   - a 429 halves the concurrency limit, cuts the token budget and pauses
+#     admissions for GEMINI_BACKOFF seconds; each success wins a little back (AIMD).
+
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "8"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "100"))
+GEMINI_MAX_QUEUE_PER_TENANT = int(os.getenv("GEMINI_MAX_QUEUE_PER_TENANT", "10"))
+GEMINI_MAX_QUEUE_WAIT = float(os.getenv("GEMINI_MAX_QUEUE_WAIT", "8"))
+GEMINI_BACKOFF = float(os.getenv("GEMINI_BACKOFF", "2"))
+# Tokens assumed per call until real usage has been seen (the Munshi prompt alone is ~1.5k)
+GEMINI_TOKENS_ESTIMATE = int(os.getenv("GEMINI_TOKENS_ESTIMATE", "2000"))
+
+WINDOW = 60.0
+
+
+class GeminiBusy(Exception):
+    """No Gemini capacity within the allowed wait (or the queue is full)."""
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """google.api_core ResourceExhausted (HTTP 429). Not the message text: "429" shows up in ids and sizes too."""
+    return getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted"
+
+
+class GeminiAdmission:
+    def __init__(self, max_concurrent: int = GEMINI_MAX_CONCURRENT, tpm: int = GEMINI_TPM,
+                 max_queue: int = GEMINI_MAX_QUEUE, max_queue_per_tenant: int = GEMINI_MAX_QUEUE_PER_TENANT,
+                 max_wait: float = GEMINI_MAX_QUEUE_WAIT, backoff: float = GEMINI_BACKOFF,
+                 tokens_estimate: int = GEMINI_TOKENS_ESTIMATE):
+        self.max_concurrent = max_concurrent
+        self.max_tpm = tpm
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.max_wait = max_wait
+        self.backoff = backoff
+
+        # Adaptive limits (lowered on 429s, recovered on successes)
+        self.limit = float(max_concurrent)
+        self.tpm = float(tpm)
+        self.tokens_estimate = float(tokens_estimate)
+
+        self.in_flight = 0
+        self._queues = OrderedDict()   # tenant -> deque of futures; order = round-robin turn
+        self._waiting = 0
+        self._usage = deque()          # (monotonic time, tokens) of the last WINDOW seconds
+        self._used = 0
+        self._usage_lock = threading.Lock()   # usage is recorded from the SDK's worker thread
+        self._paused_until = 0.0
+        self._last_cut = float("-inf")
+        self._timer = None
+        self._timer_loop = None
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+
+    # --- token budget ---
+    def record_usage(self, tokens: int):
+        """Real token usage of a finished call (also refines the per-call estimate)."""
+        with self._usage_lock:
+            self._usage.append((time.monotonic(), tokens))
+            self._used += tokens
+            self.tokens_estimate += (tokens - self.tokens_estimate) * 0.1
+
+    def _expire(self, now: float):
+        with self._usage_lock:
+            while self._usage and self._usage[0][0] <= now - WINDOW:
+                self._used -= self._usage.popleft()[1]
+
+    def _can_admit(self, now: float) -> bool:
+        if now < self._paused_until or self.in_flight >= max(1, int(self.limit)):
+            return False
+        self._expire(now)
+        if self.in_flight == 0 and self._used == 0:
+            return True  # an estimate above the whole budget must not wedge the queue
+        return self._used + (self.in_flight + 1) * self.tokens_estimate <= self.tpm
+
+    # --- queue ---
+    def _next_waiter(self):
+        """Head of the next tenant's queue, round-robin."""
+        while self._queues:
+            tenant, queue = self._queues.popitem(last=False)
+            waiter = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues[tenant] = queue  # back of the line
+            if not waiter.done():
+                return waiter
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._waiting and self._can_admit(now):
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.in_flight += 1
+            waiter.set_result(None)
+        loop = asyncio.get_running_loop()
+        if self._waiting and self.in_flight == 0 and (self._timer is None or self._timer_loop is not loop):
+            # Blocked by a 429 pause or the token budget, with no release coming to
+            # wake us up: check again when the pause ends / the oldest usage leaves the window
+            if now < self._paused_until:
+                delay = self._paused_until - now
+            else:
+                with self._usage_lock:
+                    oldest = self._usage[0][0] if self._usage else now
+                delay = oldest + WINDOW - now
+            delay = max(delay, 0.01)
+            self._timer, self._timer_loop = loop.call_later(delay, self._on_timer), loop
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _remove(self, tenant: str, waiter):
+        queue = self._queues.get(tenant)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[tenant]
+
+    async def acquire(self, tenant_id: str = None):
+        """Waits for a slot (fair across tenants). Raises GeminiBusy if the queue is full or the wait too long."""
+        tenant = tenant_id or "-"
+        start = time.monotonic()
+        if not self._waiting and self._can_admit(start):
+            self.in_flight += 1
+            self.admitted += 1
+            observe("gemini.queue_wait", 0.0)
+            return
+
+        queue = self._queues.get(tenant)
+        if self._waiting >= self.max_queue or (queue is not None and len(queue) >= self.max_queue_per_tenant):
+            self.rejected += 1
+            inc("gemini_admission_total", help="Gemini calls by admission outcome.", outcome="rejected")
+            raise GeminiBusy("Gemini queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append(waiter)
+        self._waiting += 1
+        self.queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            self._remove(tenant, waiter)
+            self.timeouts += 1
+            inc("gemini_admission_total", help="Gemini calls by admission outcome.", outcome="timeout")
+            observe("gemini.queue_wait", time.monotonic() - start, error=True)
+            raise GeminiBusy(f"No Gemini capacity within {self.max_wait:g}s")
+        except BaseException:
+            # Cancelled while waiting - or just after being given a slot
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._remove(tenant, waiter)
+            raise
+        self.admitted += 1
+        observe("gemini.queue_wait", time.monotonic() - start)
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    # --- adaptation ---
+    def on_success(self):
+        # Additive increase: about +1 concurrent call per `limit` successes
+        self.limit = min(self.max_concurrent, self.limit + 1 / self.limit)
+        self.tpm = min(self.max_tpm, self.tpm + self.max_tpm * 0.01)
+
+    def on_rate_limited(self):
+        self.rate_limited += 1
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + self.backoff)
+        # Calls already in flight hit the same limit: cut once per backoff period
+        if now - self._last_cut >= self.backoff:
+            self._last_cut = now
+            self.limit = max(1.0, self.limit / 2)
+            self.tpm = max(self.max_tpm * 0.1, self.tpm * 0.7)
+            log(f"Gemini rate limited: concurrency limit {self.limit:.1f}, budget {self.tpm:.0f} tokens/min")
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: str = None):
+        """`async with gemini_admission.slot(tenant_id):` around one Gemini call."""
+        await self.acquire(tenant_id)
+        inc("gemini_admission_total", help="Gemini calls by admission outcome.", outcome="admitted")
+        try:
+            yield
+        except Exception as e:
+            if not is_rate_limited(e):
+                raise
+            self.on_rate_limited()
+            raise GeminiBusy("Gemini rate limit") from e
+        else:
+            self.on_success()
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "waiting_tenants": len(self._queues),
+            "concurrency_limit": round(self.limit, 2),
+            "tpm_budget": round(self.tpm),
+            "tokens_last_minute": self._used,
+            "tokens_per_call": round(self.tokens_estimate),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+        }
+
+
+gemini_admission = GeminiAdmission()
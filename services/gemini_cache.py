@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from services.metrics import inc, log
+
+# Gemini context caching for the static Munshi prompt.
+# The prompt is the model's system instruction. Sent inline, its ~1.5k tokens
+# are uploaded, billed and prefilled on every voice note; registered once as
+# cached content, each call only names the cache:
+#   - the cache's display name carries the prompt version, so a new prompt
+#     never picks up an old cache, and a process reuses a live cache another
+#     worker already created instead of registering its own;
+#   - it's created with GEMINI_CACHE_TTL and extended on use once less than
+#     GEMINI_CACHE_REFRESH is left, so it doesn't expire under traffic (and
+#     quietly lapses when idle);
+#   - if the API refuses (no caching for the model or key, prompt under the
+#     minimum size) calls fall back to the inline system instruction and the
+#     cache is tried again after GEMINI_CACHE_RETRY seconds.
+# All of it runs on the worker thread making the Gemini call, never on the loop.
+
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+GEMINI_CACHE_TTL = float(os.getenv("GEMINI_CACHE_TTL", "3600"))
+GEMINI_CACHE_REFRESH = float(os.getenv("GEMINI_CACHE_REFRESH", "300"))
+GEMINI_CACHE_RETRY = float(os.getenv("GEMINI_CACHE_RETRY", "600"))
+
+
+def _bare_model(name: str) -> str:
+    """The API lists caches under "models/gemini-..."; the configured model may be given either way."""
+    return name[len("models/"):] if name and name.startswith("models/") else name
+
+
+class ContextCache:
+    def __init__(self, model_name: str, system_instruction: str, version: str, model_factory,
+                 caching=None, ttl: float = GEMINI_CACHE_TTL, refresh: float = GEMINI_CACHE_REFRESH,
+                 retry: float = GEMINI_CACHE_RETRY, enabled: bool = GEMINI_CONTEXT_CACHE):
+        """
+        `model_factory(cached_content)` builds the model bound to a cache;
+        `caching` is google.generativeai.caching (or a stand-in, see fakes.FakeCaching).
+        """
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.display_name = f"munshi:{version}"[:128]
+        self.model_factory = model_factory
+        self.caching = caching
+        self.ttl = ttl
+        self.refresh = refresh
+        self.retry = retry
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._cached = None
+        self._model = None
+        self._expires = 0.0            # monotonic
+        self._disabled_until = 0.0
+
+        self.created = 0
+        self.reused = 0
+        self.extended = 0
+        self.failures = 0
+
+    def _api(self):
+        if self.caching is None:
+            from google.generativeai import caching
+            self.caching = caching
+        return self.caching
+
+    def _find_live(self):
+        """A cache for this prompt version that another process registered, if it has time left."""
+        now = datetime.now(timezone.utc)
+        for cached in self._api().CachedContent.list():
+            if cached.display_name == self.display_name and _bare_model(cached.model) == _bare_model(self.model_name) \
+                    and cached.expire_time - now > timedelta(seconds=self.refresh):
+                return cached, (cached.expire_time - now).total_seconds()
+        return None, 0.0
+
+    def _create(self):
+        cached, left = self._find_live()
+        if cached is not None:
+            self.reused += 1
+        else:
+            cached, left = self._api().CachedContent.create(
+                model=self.model_name, display_name=self.display_name,
+                system_instruction=self.system_instruction, ttl=timedelta(seconds=self.ttl),
+            ), self.ttl
+            self.created += 1
+            log(f"Gemini context cache {cached.name} created for {self.display_name}")
+        self._cached, self._model = cached, self.model_factory(cached)
+        self._expires = time.monotonic() + left
+
+    def model(self):
+        """
+        The model bound to the live cache (created / extended as needed), or
+        None when caching is off or unavailable: use the plain model then.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            if now < self._disabled_until:
+                return None
+            try:
+                if self._cached is None or now >= self._expires:
+                    self._create()
+                elif self._expires - now < self.refresh:
+                    self._cached.update(ttl=timedelta(seconds=self.ttl))
+                    self._expires = now + self.ttl
+                    self.extended += 1
+            except Exception as e:
+                self.failures += 1
+                self._cached = self._model = None
+                self._disabled_until = now + self.retry
+                inc("gemini_context_cache_errors_total", help="Failed Gemini context cache create/extend calls.")
+                log(f"Gemini context cache unavailable, sending the prompt inline for {self.retry:g}s: {e}")
+                return None
+            return self._model
+
+    def owns(self, model) -> bool:
+        """True if `model` is the one bound to this cache."""
+        return model is not None and model is self._model
+
+    def invalidate(self, model=None):
+        """Drops the cache (e.g. deleted server-side); the next call registers a new one."""
+        with self._lock:
+            if model is None or model is self._model:
+                self._cached = self._model = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": int(self.enabled and time.monotonic() >= self._disabled_until),
+            "live": int(self._cached is not None and time.monotonic() < self._expires),
+            "ttl_left": round(max(0.0, self._expires - time.monotonic())) if self._cached is not None else 0,
+            "created": self.created,
+            "reused": self.reused,
+            "extended": self.extended,
+            "failures": self.failures,
+        }
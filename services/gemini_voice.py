@@ -1,119 +1,278 @@
+import asyncio
+import io
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
-# Configure Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+from models.extraction import Extraction, RESPONSE_SCHEMA
+from services.extraction_parser import parse_extraction
+from services import clients
+from services.metrics import span, timed, inc, log
+from services.gemini_admission import gemini_admission
+from services import resilience, media_preprocess
+from services.gemini_cache import ContextCache
+from services.media_fetch import get_media_fetcher
+from services.extraction_cache import extraction_cache, media_cache_key
 
-# Use the 'gemini-2.5-flash' model
-model = genai.GenerativeModel('models/gemini-2.5-flash')
+# Use the 'gemini-2.5-flash' model, in JSON mode constrained to the extraction schema
+GEMINI_MODEL = "models/gemini-2.5-flash"
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
 
-import requests
-import tempfile
+# google.generativeai takes over half a second to import, so it is only loaded
+# when the model is first needed (or by the startup warm-up), never at import.
+def _build_model():
+    import google.generativeai as genai
 
-async def process_media_url(media_url: str, media_type: str):
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    # The Munshi prompt goes in as the system instruction, not as a part of every call's contents
+    return genai.GenerativeModel(GEMINI_MODEL, system_instruction=MUNSHI_PROMPT, generation_config=GENERATION_CONFIG)
+
+def _build_cached_model(cached_content):
+    import google.generativeai as genai
+
+    # The system instruction lives in the cache; only the generation config is sent per call
+    return genai.GenerativeModel.from_cached_content(cached_content, generation_config=GENERATION_CONFIG)
+
+clients.register("gemini", _build_model)
+
+# Set to override the registry model (tests patch a mock in here)
+model = None
+
+def get_model():
+    """The override if set, else the model bound to the cached prompt, else the plain one (prompt inline)."""
+    if model is not None:
+        return model
+    plain = clients.get("gemini")  # also configures the API key for the caching calls
+    return context_cache.model() or plain
+
+# Voice notes (tens of KB) and most photos are sent to Gemini inline with the
+# prompt; only files above GEMINI_INLINE_MAX_BYTES go through the File API.
+# Downloads are held in memory, never written to disk.
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_BYTES", str(4 * 1024 * 1024)))
+# Caps concurrent downloads (MEDIA_MAX_BYTES each at worst). Downloaded media
+# then waits for a Gemini slot in memory; GEMINI_MAX_QUEUE bounds how many do.
+MEDIA_MAX_CONCURRENT = int(os.getenv("MEDIA_MAX_CONCURRENT", "8"))
+_media_slots = None
+
+# Bump whenever MUNSHI_PROMPT or the model changes: cached extractions and the
+# Gemini context cache are keyed on it
+PROMPT_VERSION = "munshi-v5:gemini-2.5-flash:json-schema:system"
+
+# Enhanced Prompt for Mandi (Wholesaler) Context
+MUNSHI_PROMPT = """
+    You are an intelligent "Digital Munshi" (Clerk) for a Pakistani Mandi wholesaler.
+    Your users are illiterate or semi-literate and speak Urdu, Punjabi, or "Mandi Lingo".
+    
+    **Your Inputs:**
+    1. **Voice Notes**: "50 bori aalu aaye hain", "Rashid bhai ko 10 gaddi pyaz bhej di".
+    2. **Images**: Handwritten receipts or pictures of stock.
+
+    **Your Task:**
+    Extract the inventory intent into structured JSON.
+    
+    **TRANSLATION RULE (CRITICAL):**
+    - You are a TRANSLATOR.
+    - `item_name` MUST be in standard English.
+    - "Aalu" -> "Potato"
+    - "Tamatar" -> "Tomato"
+    - "Pyaaz" -> "Onion"
+    - "Adrak" -> "Ginger"
+    - "Thoom/Lehsan" -> "Garlic"
+    - "Mirchi" -> "Chili"
+    
+    **Intents:**
+    1. **SALE**: Selling items to a buyer (Stock OUT).
+       - Keywords: "bheje", "sold", "diye", "Rashid ko diye", "rate lagaya".
+       - Extract: 
+         - `item_name`, `quantity`, `unit`.
+         - `buyer_name`: Who bought it? (e.g. "Rashid Bhai").
+         - `rate`: Price per unit.
+         - `is_credit`: true if "udhaar" or "khaate mein", false if "cash".
+    2. **UPDATE**: General Stock Update (IN/OUT) without sale details.
+       - Keywords: "aaye", "receive", "gaya" (without buyer/rate).
+       - Extract: `item_name`, `quantity`, `unit`, `action` (IN/OUT).
+    3. **QUERY**: Asking a question. Set `query_type`:
+       - "STOCK": how much of an item is in stock ("aalu kitna hai", "check karo"). Extract `item_name`.
+       - "DAILY_SALES": what was sold today ("aaj kitna becha", "aaj ki sale"). `item_name` only if one is named.
+       - "BUYER_BALANCE": how much credit a buyer owes ("Rashid bhai ka udhaar kitna hai", "Imam ka khata"). Extract `buyer_name`.
+    
+    **Several Items (CRITICAL):**
+    - One message can mention many items ("50 bori aalu aur 20 gaddi pyaz aaye"), and a receipt usually has many lines.
+    - For SALE and UPDATE, put EVERY item in `items`, one entry per item/line, in the order given.
+    - Values shared by all items (buyer, action, credit) can stay at the top level; per-line values go in the entry.
+    - Never drop items and never make separate answers: one JSON object for the whole message.
+
+    **CRITICAL - The Trust Loop:**
+    You MUST generate a `summary_for_user` field. This is a text message sent back to the user on WhatsApp.
+    - It must be in **Roman Urdu** (Urdu written in English).
+    - It must sound like a respectful Munshi.
+    - **For Sales**: "Ji Boss, [Buyer] ko [Qty] [Unit] [Item] [Rate] ke rate par de diya. Total: [Amount]."
+    - Example: "Ji Boss, Rashid Bhai ko 10 Bori Potato 5000 ke rate par de diye. Total 50,000 ban gaya."
+    - **For several items**: one combined reply, e.g. "Ji Boss, 50 Bori Potato aur 20 Gaddi Onion aa gaye."
+
+    **Output Format (JSON Only):**
+    {
+        "intent": "SALE" | "UPDATE" | "QUERY" | "UNKNOWN",
+        "item_name": "string" (or null),
+        "quantity": number (or null),
+        "unit": "string" (or null),
+        "action": "IN" | "OUT" (or null),
+        "buyer_name": "string" (or null),
+        "rate": number (or null),
+        "is_credit": boolean (default false),
+        "query_type": "STOCK" | "DAILY_SALES" | "BUYER_BALANCE" (QUERY only, else null),
+        "items": [
+            {"item_name": "string", "quantity": number, "unit": "string", "action": "IN" | "OUT" (or null),
+             "buyer_name": "string" (or null), "rate": number (or null), "is_credit": boolean (or null)}
+        ],
+        "summary_for_user": "string (Roman Urdu response)",
+        "original_text": "Transcribed text"
+    }
+    """
+
+# The static prompt, registered once as Gemini cached content (see gemini_cache)
+context_cache = ContextCache(GEMINI_MODEL, MUNSHI_PROMPT, PROMPT_VERSION, _build_cached_model)
+
+def _count_usage(response) -> int:
+    """Gemini token counters from the response's usage metadata (if it has any); returns the total."""
+    usage = getattr(response, "usage_metadata", None)
+    total = 0
+    for kind, field in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                        ("cached", "cached_content_token_count")):
+        tokens = getattr(usage, field, None)
+        if isinstance(tokens, int):
+            inc("gemini_tokens_total", tokens, help="Gemini tokens used.", kind=kind)
+            if kind != "cached":  # already part of the prompt count
+                total += tokens
+    return total
+
+def generate(parts) -> str:
+    """
+    One generate_content call, timed and counted; returns the raw text.
+    Blocking: call it from a worker thread, inside a gemini_admission slot.
+    """
+    # The SDK's own timeout ends the worker thread when resilience.call gives up on it
+    request_options = {"timeout": resilience.dependencies["gemini"].timeout}
+    current = get_model()
+    with span("gemini.generate"):
+        try:
+            response = current.generate_content(parts, request_options=request_options)
+        except Exception as e:
+            # The context cache expired or was deleted under us: once more with the prompt inline
+            if not context_cache.owns(current) or getattr(e, "code", None) not in (403, 404):
+                raise
+            log(f"Gemini context cache rejected ({e}), registering a new one")
+            context_cache.invalidate(current)
+            response = clients.get("gemini").generate_content(parts, request_options=request_options)
+    tokens = _count_usage(response)
+    if tokens:
+        gemini_admission.record_usage(tokens)
+    return response.text
+
+def extract_from_bytes(media_bytes: bytes, mime_type: str) -> str:
+    """
+    Sends the media to Gemini (the Munshi prompt is the system instruction) and returns the raw text output.
     """
-    Downloads media (audio/image) from URL, uploads to Gemini, and requests JSON extraction.
+    if len(media_bytes) <= GEMINI_INLINE_MAX_BYTES:
+        # Inline data: no upload round trip, nothing left behind in Gemini storage
+        inc("gemini_bytes_total", len(media_bytes), help="Media bytes sent to Gemini.", mode="inline")
+        return generate([{"mime_type": mime_type, "data": media_bytes}])
+
+    # Large file: upload from memory, and delete it once we have the answer
+    import google.generativeai as genai
+
+    get_model()  # also configures the API key
+    inc("gemini_bytes_total", len(media_bytes), help="Media bytes sent to Gemini.", mode="upload")
+    with span("gemini.upload"):
+        gemini_file = genai.upload_file(io.BytesIO(media_bytes), mime_type=mime_type)
+    try:
+        return generate([gemini_file])
+    finally:
+        try:
+            genai.delete_file(gemini_file.name)
+        except Exception as e:
+            log(f"Warning: could not delete Gemini file {gemini_file.name}: {e}")
+
+def media_mime_type(media_type: str) -> str:
+    """
+    The MIME type to give Gemini: Twilio's MediaContentType0 without parameters
+    ("audio/ogg; codecs=opus" -> "audio/ogg"); a WhatsApp voice note if it's missing.
     """
+    mime_type = (media_type or "").split(";", 1)[0].strip().lower()
+    if "/" in mime_type:
+        return mime_type
+    return "image/jpeg" if "image" in mime_type else "audio/ogg"
+
+@timed()
+async def process_media_url(media_url: str, media_type: str, tenant_id: str = None) -> Extraction:
+    """
+    Downloads media (audio/image) from URL into memory and requests JSON extraction from Gemini.
+    Raises GeminiBusy when no Gemini slot frees up in time (see gemini_admission),
+    CircuitOpen while Gemini or the media host is down (see resilience).
+    """
+    global _media_slots
+    if _media_slots is None:
+        _media_slots = asyncio.Semaphore(MEDIA_MAX_CONCURRENT)
+
     # Download the file
     # Check if credentials exist for Twilio
     account_sid = os.getenv("TWILIO_ACCOUNT_SID")
     auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    
-    # Debug logging
-    print(f"DEBUG: Downloading media. SID present: {bool(account_sid)}, Token present: {bool(auth_token)}")
-    
     auth = None
     if account_sid and auth_token and "twilio.com" in media_url:
         auth = (account_sid, auth_token)
 
-    print(f"DEBUG: Requesting {media_url} with auth: {bool(auth)}")
-    headers = {"User-Agent": "Mandi-AI-Bot/1.0"}
-    response = requests.get(media_url, auth=auth, headers=headers, allow_redirects=True)
-    if response.status_code != 200:
-        print(f"Failed to download media: {response.status_code}, URL: {media_url}")
-        raise Exception("Failed to download media")
-
-    # Determine extension
-    ext = ".ogg" # default for WhatsApp voice
-    mime_type = "audio/ogg"
-    if "image" in media_type:
-        ext = ".jpg"
-        mime_type = "image/jpeg"
-    
-    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp_file:
-        temp_file.write(response.content)
-        temp_path = temp_file.name
-    
-    try:
-        # Upload the file to Gemini
-        # Note: Gemini 1.5 Flash supports audio and images directly
-        gemini_file = genai.upload_file(path=temp_path, mime_type=mime_type)
-        
-        # Enhanced Prompt for Mandi (Wholesaler) Context
-        prompt = """
-        You are an intelligent "Digital Munshi" (Clerk) for a Pakistani Mandi wholesaler.
-        Your users are illiterate or semi-literate and speak Urdu, Punjabi, or "Mandi Lingo".
-        
-        **Your Inputs:**
-        1. **Voice Notes**: "50 bori aalu aaye hain", "Rashid bhai ko 10 gaddi pyaz bhej di".
-        2. **Images**: Handwritten receipts or pictures of stock.
-
-        **Your Task:**
-        Extract the inventory intent into structured JSON.
-        
-        **TRANSLATION RULE (CRITICAL):**
-        - You are a TRANSLATOR.
-        - `item_name` MUST be in standard English.
-        - "Aalu" -> "Potato"
-        - "Tamatar" -> "Tomato"
-        - "Pyaaz" -> "Onion"
-        - "Adrak" -> "Ginger"
-        - "Thoom/Lehsan" -> "Garlic"
-        - "Mirchi" -> "Chili"
-        
-        **Intents:**
-        1. **SALE**: Selling items to a buyer (Stock OUT).
-           - Keywords: "bheje", "sold", "diye", "Rashid ko diye", "rate lagaya".
-           - Extract: 
-             - `item_name`, `quantity`, `unit`.
-             - `buyer_name`: Who bought it? (e.g. "Rashid Bhai").
-             - `rate`: Price per unit.
-             - `is_credit`: true if "udhaar" or "khaate mein", false if "cash".
-        2. **UPDATE**: General Stock Update (IN/OUT) without sale details.
-           - Keywords: "aaye", "receive", "gaya" (without buyer/rate).
-           - Extract: `item_name`, `quantity`, `unit`, `action` (IN/OUT).
-        3. **QUERY**: Asking for stock.
-           - Keywords: "kitna hai", "check karo".
-        
-        **CRITICAL - The Trust Loop:**
-        You MUST generate a `summary_for_user` field. This is a text message sent back to the user on WhatsApp.
-        - It must be in **Roman Urdu** (Urdu written in English).
-        - It must sound like a respectful Munshi.
-        - **For Sales**: "Ji Boss, [Buyer] ko [Qty] [Unit] [Item] [Rate] ke rate par de diya. Total: [Amount]."
-        - Example: "Ji Boss, Rashid Bhai ko 10 Bori Potato 5000 ke rate par de diye. Total 50,000 ban gaya."
-
-        **Output Format (JSON Only):**
-        {
-            "intent": "SALE" | "UPDATE" | "QUERY" | "UNKNOWN",
-            "item_name": "string" (or null),
-            "quantity": number (or null),
-            "unit": "string" (or null),
-            "action": "IN" | "OUT" (or null),
-            "buyer_name": "string" (or null),
-            "rate": number (or null),
-            "is_credit": boolean (default false),
-            "summary_for_user": "string (Roman Urdu response)",
-            "original_text": "Transcribed text"
-        }
-        """
-        
-        response = model.generate_content([prompt, gemini_file])
-        return response.text
-    finally:
-        # Cleanup
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+    mime_type = media_mime_type(media_type)
+
+    async with _media_slots:
+        with span("media.download"):
+            media_bytes = await resilience.call(
+                "media", lambda: get_media_fetcher().fetch(media_url, auth=auth), idempotent=True
+            )
+        inc("media_bytes_total", len(media_bytes), help="Media bytes downloaded from Twilio.")
+
+    # Same bytes + same prompt (+ same image preprocessing) = same answer: skip Gemini on a cache hit
+    version = PROMPT_VERSION
+    if mime_type.startswith("image/"):
+        version += f":{media_preprocess.VERSION}"
+    cache_key = media_cache_key(media_bytes, version)
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        return Extraction.model_validate_json(cached)
+
+    # Camera photos: downscaled, upright, grayscale JPEG (off the event loop)
+    if media_preprocess.applies(mime_type):
+        media_bytes, mime_type = await media_preprocess.preprocess(media_bytes, mime_type)
+
+    # The SDK blocks: run it on a worker thread so the loop keeps serving others
+    async with gemini_admission.slot(tenant_id):
+        raw = await resilience.call(
+            "gemini", lambda: asyncio.to_thread(extract_from_bytes, media_bytes, mime_type), idempotent=True
+        )
+    # Only parseable extractions are cached, so a bad answer can be retried
+    with span("extraction.parse"):
+        extraction = parse_extraction(raw)
+    extraction_cache.put(cache_key, extraction.model_dump_json())
+    return extraction
+
+@timed()
+async def process_text_message(text: str, tenant_id: str = None) -> Extraction:
+    """
+    Gemini fallback for text commands the local parser wasn't sure about.
+    """
+    cache_key = media_cache_key(text.strip().lower().encode("utf-8"), PROMPT_VERSION)
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        return Extraction.model_validate_json(cached)
 
+    parts = [f"**Text message from the user:** {text}"]
+    async with gemini_admission.slot(tenant_id):
+        raw = await resilience.call("gemini", lambda: asyncio.to_thread(generate, parts), idempotent=True)
+    with span("extraction.parse"):
+        extraction = parse_extraction(raw)
+    extraction_cache.put(cache_key, extraction.model_dump_json())
+    return extraction
@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from cachetools import TTLCache
+from services.metrics import log
+
+# Idempotent webhook processing keyed on Twilio's MessageSid.
+# Twilio retries a webhook when our answer is slow; without this, the retry
+# runs agent_router again and double-counts stock. Completed SIDs keep their
+# reply (in memory with a TTL, optionally in SQLite via IDEMPOTENCY_PATH), and
+# a duplicate that arrives while the first run is still going waits for it.
+
+IDEMPOTENCY_SIZE = int(os.getenv("IDEMPOTENCY_SIZE", "50000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", "")
+
+
+class IdempotencyStore:
+    def __init__(self, maxsize: int = IDEMPOTENCY_SIZE, ttl: float = IDEMPOTENCY_TTL, path: str = IDEMPOTENCY_PATH):
+        self.ttl = ttl
+        self._completed = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight = {}
+        self.duplicates = 0
+
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completed (message_sid TEXT PRIMARY KEY, reply TEXT, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM completed WHERE created_at < ?", (time.time() - ttl,))
+
+    def get_completed(self, key: str):
+        """Returns (True, reply) if this key already finished, else (False, None)."""
+        if key in self._completed:
+            return True, self._completed[key]
+        if self._conn is not None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT reply FROM completed WHERE message_sid = ? AND created_at >= ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+            if row:
+                self._completed[key] = row[0]
+                return True, row[0]
+        return False, None
+
+    def _mark_completed(self, key: str, reply):
+        self._completed[key] = reply
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO completed (message_sid, reply, created_at) VALUES (?, ?, ?)",
+                    (key, reply, time.time()),
+                )
+
+    async def run(self, key: str, fn):
+        """
+        Runs `fn()` (an async callable) once per key and returns its result.
+        Duplicates get the stored result; concurrent duplicates await the first run.
+        Failures are not recorded, so a later retry runs again.
+        """
+        if not key:
+            return await fn()
+
+        done, reply = self.get_completed(key)
+        if done:
+            self.duplicates += 1
+            log(f"Duplicate MessageSid {key}: returning stored reply")
+            return reply
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.duplicates += 1
+            log(f"Duplicate MessageSid {key}: waiting for the first run")
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            self._mark_completed(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "completed": len(self._completed),
+            "in_flight": len(self._in_flight),
+            "duplicates": self.duplicates,
+        }
+
+
+idempotency_store = IdempotencyStore()
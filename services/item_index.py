@@ -0,0 +1,259 @@
+import re
+import asyncio
+from services.metrics import log
+
+# Item-name normalization index.
+# Gemini says "Potato", "potatoes" or "Aloo" unpredictably; without this one
+# commodity ends up split across several inventory rows and QUERY misses.
+# Every extraction is resolved to the tenant's canonical item name before any
+# DB call: exact key -> known synonym -> trigram fuzzy match -> new item.
+# The index is filled per tenant from their inventory (at startup in the
+# background, or lazily on first use) and then kept up to date incrementally.
+
+# Urdu/Punjabi synonyms -> the standard English name the Munshi prompt asks for
+ITEM_SYNONYMS = {
+    "Potato": ["aalu", "aloo", "alu", "aaloo", "potato", "potatoes"],
+    "Tomato": ["tamatar", "tamaatar", "timatar", "tomato", "tomatoes"],
+    "Onion": ["pyaz", "pyaaz", "piyaz", "piaz", "onion", "onions"],
+    "Ginger": ["adrak", "adrek", "ginger"],
+    "Garlic": ["thoom", "lehsan", "lehsun", "lahsan", "garlic"],
+    "Chili": ["mirchi", "mirch", "chili", "chilli", "chilies", "chillies"],
+}
+
+# Trigram prefilter threshold and how many candidates get an edit-distance check
+FUZZY_MIN_SCORE = 0.3
+FUZZY_CANDIDATES = 5
+# Shorter names are never fuzzy-matched: one edit turns "pear" into "peas"
+FUZZY_MIN_LENGTH = 5
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_key(name: str) -> str:
+    """'  Potatoes ' -> 'potato', 'Red  Chillies' -> 'red chilly'"""
+    return " ".join(_singular(w) for w in _WORD.findall((name or "").lower()))
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(key: str) -> int:
+    """Typos tolerated for a name of this length."""
+    return 1 if len(key) <= 6 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, giving up (limit + 1) once it exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class _TrigramIndex:
+    def __init__(self):
+        self._postings = {}
+        self._grams = {}
+
+    def add(self, key: str):
+        if key in self._grams:
+            return
+        grams = trigrams(key)
+        self._grams[key] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def best(self, key: str, item_of=None):
+        """
+        Closest known key: trigram Dice similarity picks a few candidates,
+        edit distance (with transpositions) decides. None if nothing is close,
+        or if two equally close candidates are different items (`item_of(key)`).
+        """
+        if len(key) < FUZZY_MIN_LENGTH:
+            return None
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        scored = []
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self._grams[candidate]))
+            if score >= FUZZY_MIN_SCORE:
+                scored.append((score, candidate))
+        scored.sort(reverse=True)
+
+        limit = max_edits(key)
+        item_of = item_of or (lambda k: k)
+        best_key, best_distance, tied = None, limit + 1, False
+        for _, candidate in scored[:FUZZY_CANDIDATES]:
+            distance = edit_distance(key, candidate, limit)
+            if distance < best_distance:
+                best_key, best_distance, tied = candidate, distance, False
+            elif distance == best_distance and distance <= limit and item_of(candidate) != item_of(best_key):
+                tied = True
+        return None if tied else best_key
+
+
+class _TenantItems:
+    def __init__(self):
+        self.names = {}    # normalized key (or alias) -> canonical name
+        self.groups = {}   # synonym group ("Potato") -> this tenant's canonical name
+        self.fuzzy = _TrigramIndex()
+
+
+class ItemIndex:
+    def __init__(self, synonyms: dict = ITEM_SYNONYMS):
+        self._synonyms = {}
+        self._global_fuzzy = _TrigramIndex()
+        for canonical, words in synonyms.items():
+            for word in [canonical, *words]:
+                key = normalize_key(word)
+                self._synonyms[key] = canonical
+                self._global_fuzzy.add(key)
+        self._tenants = {}
+        self._loaded = set()
+
+    def is_loaded(self, tenant_id: str) -> bool:
+        return tenant_id in self._loaded
+
+    def load_tenant(self, tenant_id: str, names):
+        """(Re)builds a tenant's index from their existing inventory item names."""
+        self._tenants[tenant_id] = _TenantItems()
+        for name in names:
+            self.add(tenant_id, name)
+        self._loaded.add(tenant_id)
+
+    def forget_tenant(self, tenant_id: str):
+        """Drops a tenant's index so it is reloaded (e.g. after items were renamed or deleted)."""
+        self._tenants.pop(tenant_id, None)
+        self._loaded.discard(tenant_id)
+
+    def add(self, tenant_id: str, name: str):
+        """Registers a canonical item name for a tenant."""
+        items = self._tenants.setdefault(tenant_id, _TenantItems())
+        key = normalize_key(name)
+        if not key:
+            return
+        items.names.setdefault(key, name)
+        items.fuzzy.add(key)
+        group = self._synonyms.get(key)
+        if group:
+            items.groups.setdefault(group, items.names[key])
+
+    def resolve(self, tenant_id: str, name: str, register: bool = True):
+        """
+        Maps whatever the user/Gemini called the item to the tenant's canonical name.
+        With register=False (lookups that write nothing) a name the tenant doesn't
+        stock is returned without becoming one of their items.
+        """
+        key = normalize_key(name)
+        if not key:
+            return name
+        items = self._tenants.setdefault(tenant_id, _TenantItems())
+
+        canonical = items.names.get(key)
+        if canonical is not None:
+            return canonical
+
+        group = self._synonyms.get(key)
+        if group is None:
+            # Misspelling of something this tenant already stocks?
+            match = items.fuzzy.best(key, items.names.get)
+            if match is not None:
+                canonical = items.names[match]
+            else:
+                # ...or of a known commodity ("tamaatr")?
+                match = self._global_fuzzy.best(key, self._synonyms.get)
+                group = self._synonyms[match] if match is not None else None
+
+        if canonical is None and group is not None:
+            canonical = items.groups.get(group)
+            if canonical is None:
+                if not register:
+                    return group
+                canonical = group
+                self.add(tenant_id, canonical)
+
+        if canonical is None:
+            # A new item: it becomes canonical for this tenant
+            canonical = " ".join(w.capitalize() for w in name.split())
+            if not register:
+                return canonical
+            self.add(tenant_id, canonical)
+
+        # Remember the spelling so the next lookup is a single dict hit
+        items.names[key] = canonical
+        return canonical
+
+
+item_index = ItemIndex()
+_loading = {}
+
+
+async def _ensure_loaded(tenant_id: str):
+    if item_index.is_loaded(tenant_id):
+        return
+    task = _loading.get(tenant_id)
+    if task is None:
+        from services.db import get_item_names
+
+        async def load():
+            item_index.load_tenant(tenant_id, await get_item_names(tenant_id))
+
+        task = _loading[tenant_id] = asyncio.ensure_future(load())
+        task.add_done_callback(lambda _: _loading.pop(tenant_id, None))
+    await task
+
+
+async def resolve_item_name(tenant_id: str, name: str, register: bool = True):
+    """resolve() that loads the tenant's inventory names the first time it is seen."""
+    if not name:
+        return name
+    try:
+        await _ensure_loaded(tenant_id)
+    except Exception as e:
+        # Still resolve synonyms/typos; the tenant's names are retried next time
+        log(f"Could not load item names for {tenant_id}: {e}")
+    return item_index.resolve(tenant_id, name, register)
+
+
+async def warm_item_index():
+    """Builds the index for every tenant in one pass (run in the background at startup)."""
+    from services.db import get_all_item_names
+
+    by_tenant = {}
+    try:
+        rows = await get_all_item_names()
+    except Exception as e:
+        # Not fatal: tenants are then loaded lazily on first use
+        print(f"Item index warm-up failed: {e}")
+        return
+    for row in rows:
+        by_tenant.setdefault(row["tenant_id"], []).append(row["item_name"])
+    for tenant_id, names in by_tenant.items():
+        if not item_index.is_loaded(tenant_id):
+            item_index.load_tenant(tenant_id, names)
+    print(f"Item index warmed for {len(by_tenant)} tenant(s)")
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from contextvars import ContextVar
+
+# Durable queue for inbound WhatsApp messages.
+# The webhook only has to INSERT one row and can acknowledge Twilio immediately;
+# a pool of asyncio workers drains the table in the background. Jobs are deleted
+# once they succeed, so whatever is left in 'pending'/'running' after a crash
+# is replayed on the next startup. A job can run more than once, so the handler
+# must make repeats safe: it records progress in its payload and saves it with
+# checkpoint(payload) (a failed attempt saves it too), so a retry or a replay
+# after a crash sees how far the previous run got.
+
+PENDING = "pending"
+RUNNING = "running"
+FAILED = "failed"
+
+_current_job = ContextVar("current_job", default=None)   # (queue, job id) while a handler runs
+
+
+def checkpoint(payload: dict) -> bool:
+    """
+    Saves the payload of the job being handled right away, so progress
+    recorded in it survives a crash. False (and a no-op) outside a job.
+    """
+    job = _current_job.get()
+    if job is None:
+        return False
+    queue, job_id = job
+    queue._save(job_id, payload)
+    return True
+
+
+class JobQueue:
+    def __init__(self, path: str, handler, workers: int = 4, max_attempts: int = 3,
+                 retry_delay: float = 5.0, poll_interval: float = 1.0, on_give_up=None):
+        """
+        `handler` is an async callable that receives the job payload (dict).
+        An exception from it counts as a failed attempt; the job is retried after
+        `retry_delay * attempts` seconds until `max_attempts` is reached, then
+        parked as failed and `on_give_up(payload)` (async, optional) is called.
+        """
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.on_give_up = on_give_up
+
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._tasks = []
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL + synchronous=NORMAL: a committed row survives a process crash/restart,
+        # and an enqueue costs well under a millisecond.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_sid TEXT UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending_idx ON jobs (status, available_at, id)")
+        self.recover()
+
+    def recover(self) -> int:
+        """Puts jobs that were mid-flight when the process died back in the queue."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?", (PENDING, RUNNING)
+            )
+        if cur.rowcount:
+            print(f"JobQueue: replaying {cur.rowcount} unfinished job(s) from {self.path}")
+        return cur.rowcount
+
+    def enqueue(self, payload: dict, message_sid: str = None) -> bool:
+        """
+        Persists a job. Returns False if a job with the same MessageSid is already
+        queued (Twilio retried the webhook), True otherwise.
+        """
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (message_sid, payload, available_at, created_at) VALUES (?, ?, ?, ?)",
+                (message_sid, json.dumps(payload), now, now),
+            )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return cur.rowcount == 1
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE status = ? AND available_at <= ? ORDER BY id LIMIT 1",
+                (PENDING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (RUNNING, row[0]))
+        return row[0], json.loads(row[1]), row[2]
+
+    def _save(self, job_id: int, payload: dict):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(payload), job_id))
+
+    def _complete(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _fail(self, job_id: int, payload: dict, attempts: int, error: str) -> bool:
+        """Records a failed attempt (and the payload as the handler left it). True if the job was parked."""
+        give_up = attempts >= self.max_attempts
+        with self._lock:
+            if give_up:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, payload = ?, attempts = ?, last_error = ? WHERE id = ?",
+                    (FAILED, json.dumps(payload), attempts, error, job_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, payload = ?, attempts = ?, last_error = ?, available_at = ? WHERE id = ?",
+                    (PENDING, json.dumps(payload), attempts, error, time.time() + self.retry_delay * attempts, job_id),
+                )
+        return give_up
+
+    def counts(self) -> dict:
+        """Number of jobs per status (completed jobs are deleted)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    async def run_once(self) -> bool:
+        """Claims and runs a single job. Returns False if nothing was ready."""
+        job = self._claim()
+        if job is None:
+            return False
+        job_id, payload, attempts = job
+        token = _current_job.set((self, job_id))
+        try:
+            await self.handler(payload)
+        except Exception as e:
+            print(f"JobQueue: job {job_id} failed (attempt {attempts + 1}): {e}")
+            if self._fail(job_id, payload, attempts + 1, str(e)) and self.on_give_up is not None:
+                try:
+                    await self.on_give_up(payload)
+                except Exception as e:
+                    print(f"JobQueue: giving up on job {job_id} failed too: {e}")
+        else:
+            self._complete(job_id)
+        finally:
+            _current_job.reset(token)
+        return True
+
+    async def _worker(self):
+        while True:
+            if await self.run_once():
+                continue
+            self._wakeup.clear()
+            try:
+                # Poll as well, so delayed retries become runnable without a new enqueue
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Starts the worker pool on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancels the workers. Jobs they were running stay 'running' and are replayed on restart."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def close(self):
+        self._conn.close()
+
+
+# Webhook mode: "sync" (default) answers with TwiML inside the request,
+# "queue" acknowledges immediately and replies through the Twilio REST API.
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync").lower()
+
+_queue: JobQueue = None
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        from services.whatsapp_pipeline import process_queued_message, reply_failed_message
+
+        _queue = JobQueue(
+            os.getenv("JOB_QUEUE_PATH", "mandi_jobs.sqlite3"),
+            process_queued_message,
+            workers=int(os.getenv("JOB_QUEUE_WORKERS", "4")),
+            max_attempts=int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "3")),
+            on_give_up=reply_failed_message,
+        )
+    return _queue
@@ -0,0 +1,82 @@
+import os
+import httpx
+from services.metrics import log
+
+# Shared downloader for Twilio MediaUrl fetches.
+# One long-lived httpx.AsyncClient keeps TLS connections to api.twilio.com and
+# its media CDN alive between messages, follows the CDN redirect on the same
+# pool (httpx drops the Twilio credentials when the redirect changes host),
+# and streams the body so the size cap is enforced without buffering it twice.
+
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+MEDIA_POOL_SIZE = int(os.getenv("MEDIA_POOL_SIZE", "20"))
+MEDIA_CONNECT_TIMEOUT = float(os.getenv("MEDIA_CONNECT_TIMEOUT", "5"))
+MEDIA_READ_TIMEOUT = float(os.getenv("MEDIA_READ_TIMEOUT", "20"))
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaDownloadError(Exception):
+    """Non-200 answer for the MediaUrl; `status_code` tells retryable (5xx) from not."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Failed to download media (HTTP {status_code})")
+        self.status_code = status_code
+
+
+class MediaFetcher:
+    def __init__(self, pool_size: int = MEDIA_POOL_SIZE, connect_timeout: float = MEDIA_CONNECT_TIMEOUT,
+                 read_timeout: float = MEDIA_READ_TIMEOUT, max_bytes: int = MEDIA_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.client = httpx.AsyncClient(
+            follow_redirects=True,
+            headers={"User-Agent": "Mandi-AI-Bot/1.0"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def fetch(self, media_url: str, auth=None, max_bytes: int = None) -> bytes:
+        """
+        Downloads the media into memory, chunk by chunk, without blocking the event loop.
+        Raises MediaTooLarge as soon as the size cap is crossed.
+        """
+        max_bytes = max_bytes or self.max_bytes
+        async with self.client.stream("GET", media_url, auth=auth) as response:
+            if response.status_code != 200:
+                log(f"Failed to download media: {response.status_code}, URL: {media_url}")
+                raise MediaDownloadError(response.status_code)
+
+            declared = int(response.headers.get("Content-Length") or 0)
+            if declared > max_bytes:
+                raise MediaTooLarge(f"Media is {declared} bytes (limit {max_bytes})")
+
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes(MEDIA_CHUNK_SIZE):
+                buffer += chunk
+                if len(buffer) > max_bytes:
+                    raise MediaTooLarge(f"Media exceeds {max_bytes} bytes")
+            return bytes(buffer)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_fetcher: MediaFetcher = None
+
+
+def get_media_fetcher() -> MediaFetcher:
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = MediaFetcher()
+    return _fetcher
+
+
+async def close_media_fetcher():
+    """Closes the shared connection pool (called on app shutdown)."""
+    global _fetcher
+    if _fetcher is not None:
+        await _fetcher.aclose()
+        _fetcher = None
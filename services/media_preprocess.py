@@ -0,0 +1,99 @@
+import os
+import io
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from services.metrics import span, inc, log
+
+# Receipt photos from phone cameras arrive as 3-5 MB, 12 MP JPEGs. Gemini reads
+# a handwritten receipt just as well at ~1600 px on the long side in grayscale,
+# so before an image goes to Gemini it is:
+#   decoded (JPEGs straight at a reduced DCT scale, and in grayscale: draft()),
+#   rotated upright from its EXIF orientation (phones store it sideways),
+#   scaled down to IMAGE_MAX_SIDE, converted to grayscale (IMAGE_GRAYSCALE) and
+#   re-encoded as a JPEG at IMAGE_JPEG_QUALITY.
+# That cuts the upload to a few hundred KB and the image tokens with it.
+# Images that are already small, or that Pillow can't read, are sent as is.
+# Runs on its own small thread pool (Pillow releases the GIL while decoding,
+# resampling and encoding), so it never blocks the event loop and a burst of
+# photos can't take the worker threads the Gemini and Twilio calls run on.
+# Pillow is imported on first use; without it images are sent unprocessed.
+
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1600"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") == "1"
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Part of the extraction cache key: a settings change must not serve answers
+# Gemini gave for differently processed images
+VERSION = f"img-v1:{IMAGE_MAX_SIDE}:{'L' if IMAGE_GRAYSCALE else 'RGB'}:q{IMAGE_JPEG_QUALITY}" \
+    if IMAGE_PREPROCESS else "img-raw"
+
+_pool = None
+_pillow_missing = False
+
+
+def applies(mime_type: str) -> bool:
+    return IMAGE_PREPROCESS and not _pillow_missing and mime_type.startswith("image/")
+
+
+def preprocess_image(data: bytes, mime_type: str, max_side: int = IMAGE_MAX_SIDE,
+                     grayscale: bool = IMAGE_GRAYSCALE, quality: int = IMAGE_JPEG_QUALITY):
+    """
+    Returns (bytes, mime_type) for Gemini: the downscaled, upright, recompressed
+    image, or the original when that wouldn't be smaller or it can't be decoded.
+    Blocking and CPU bound: run it through preprocess().
+    """
+    global _pillow_missing
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        _pillow_missing = True
+        log("Warning: Pillow is not installed, images go to Gemini unprocessed")
+        return data, mime_type
+
+    mode = "L" if grayscale else "RGB"
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            orientation = image.getexif().get(0x0112, 1)  # EXIF Orientation
+            if max(image.size) <= max_side and orientation == 1 and image.format == "JPEG" \
+                    and (image.mode == "L" or not grayscale):
+                inc("image_preprocess_total", help="Images by preprocessing outcome.", outcome="kept")
+                return data, mime_type
+            # JPEG: decode at 1/2, 1/4 or 1/8 scale (still >= max_side) and straight to grayscale
+            image.draft(mode, (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert(mode)
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=quality)
+    except Exception as e:
+        log(f"Warning: could not preprocess {mime_type} image ({len(data)} bytes): {e}")
+        inc("image_preprocess_total", help="Images by preprocessing outcome.", outcome="failed")
+        return data, mime_type
+
+    processed = out.getvalue()
+    if len(processed) >= len(data) and orientation == 1:
+        inc("image_preprocess_total", help="Images by preprocessing outcome.", outcome="kept")
+        return data, mime_type
+    inc("image_preprocess_total", help="Images by preprocessing outcome.", outcome="processed")
+    inc("image_preprocess_bytes_saved_total", max(0, len(data) - len(processed)),
+        help="Image bytes not sent to Gemini thanks to preprocessing.")
+    return processed, "image/jpeg"
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-preprocess")
+    return _pool
+
+
+async def preprocess(data: bytes, mime_type: str):
+    """preprocess_image() on the image pool; returns (bytes, mime_type)."""
+    # Carry the trace id into the pool thread (run_in_executor doesn't, unlike to_thread)
+    run = functools.partial(contextvars.copy_context().run, preprocess_image, data, mime_type)
+    with span("media.preprocess"):
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), run)
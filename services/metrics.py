@@ -0,0 +1,189 @@
+import os
+import time
+import uuid
+import bisect
+import functools
+import threading
+from contextvars import ContextVar
+
+# In-process metrics for the WhatsApp pipeline, exposed in the Prometheus text
+# format on GET /metrics (no client library needed).
+#   span("stage")        times a block: latency histogram, in-flight gauge, error count
+#   @timed()             the same around an async function (stage = module.function)
+#   inc("name", ...)     plain counters (messages by intent/outcome, Gemini tokens, bytes)
+# A span costs ~1-2 microseconds: two perf_counter() calls, a bisect and a few dict updates.
+# Each message also gets a trace id (its MessageSid, or a random one) that log() prefixes
+# to every line printed while handling it, including in tasks and worker threads it starts.
+
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "mandi")
+
+# Seconds; covers a ~1 ms cache hit up to a slow Gemini call
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}   # stage -> [bucket counts..., +Inf count], sum
+_in_flight = {}
+_errors = {}
+_counters = {}     # (name, label items) -> value
+_help = {}
+
+_trace_id = ContextVar("trace_id", default=None)
+
+# Component stats (render's `gauges`) that only ever grow - hits, calls, errors -
+# are exported as counters, `<prefix>_<component>_<stat>_total`; every other
+# numeric stat is a level (sizes, in-flight, circuit state, ratios): a gauge.
+COUNTER_STATS = {
+    "hits", "misses", "negative_hits", "memory_hits", "disk_hits", "not_modified", "gemini_calls_saved",
+    "duplicates", "admitted", "queued", "rejected", "timeouts", "rate_limited", "opened", "retried",
+    "created", "reused", "extended", "failures", "key_fetches", "key_fetch_errors",
+    "deltas_received", "deltas_flushed", "rows_written", "flushes", "flush_errors",
+}
+
+
+class span:
+    """`with span("gemini.generate"):` records how long the block took."""
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        with _lock:
+            _in_flight[self.stage] = _in_flight.get(self.stage, 0) + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start, error=exc_type is not None, finished=True)
+        return False
+
+
+def observe(stage: str, seconds: float, error: bool = False, finished: bool = False):
+    """Records one duration for `stage` (span() calls this; use it for externally timed work)."""
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [[0] * (len(BUCKETS) + 1), 0.0]
+        histogram[0][index] += 1
+        histogram[1] += seconds
+        if finished:
+            _in_flight[stage] -= 1
+        if error:
+            _errors[stage] = _errors.get(stage, 0) + 1
+
+
+def timed(stage: str = None):
+    """Decorator: times every call of an async function as a span."""
+    def decorate(fn):
+        name = stage or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def inc(name: str, value: float = 1, help: str = None, **labels):
+    """Adds `value` to the counter `name` with the given labels."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    if help and name not in _help:
+        _help[name] = help
+
+
+def new_trace(trace_id: str = None) -> str:
+    """Starts a trace for the current message; tasks and threads started from here inherit it."""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace() -> str:
+    return _trace_id.get()
+
+
+def log(message: str):
+    """print() with the current trace id, so one message's lines can be grepped together."""
+    trace_id = _trace_id.get()
+    print(f"[{trace_id}] {message}" if trace_id else message)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(items) -> str:
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def render(gauges: dict = None) -> str:
+    """
+    Prometheus text exposition of everything recorded so far. `gauges` maps a
+    component name to a stats() dict; its numeric values are exported as
+    `<prefix>_<component>_<stat>` gauges, or `..._total` counters for the
+    cumulative ones (COUNTER_STATS).
+    """
+    p = METRICS_PREFIX
+    with _lock:
+        histograms = {stage: (list(h[0]), h[1]) for stage, h in _histograms.items()}
+        in_flight = dict(_in_flight)
+        errors = dict(_errors)
+        counters = dict(_counters)
+
+    lines = [
+        f"# HELP {p}_stage_duration_seconds Latency of each pipeline stage.",
+        f"# TYPE {p}_stage_duration_seconds histogram",
+    ]
+    for stage in sorted(histograms):
+        counts, total = histograms[stage]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{p}_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'{p}_stage_duration_seconds_count{{stage="{stage}"}} {cumulative}')
+
+    lines += [f"# HELP {p}_stage_in_flight Calls of each stage currently running.", f"# TYPE {p}_stage_in_flight gauge"]
+    lines += [f'{p}_stage_in_flight{{stage="{stage}"}} {n}' for stage, n in sorted(in_flight.items())]
+    lines += [f"# HELP {p}_stage_errors_total Stage calls that raised.", f"# TYPE {p}_stage_errors_total counter"]
+    lines += [f'{p}_stage_errors_total{{stage="{stage}"}} {n}' for stage, n in sorted(errors.items())]
+
+    by_name = {}
+    for (name, items), value in counters.items():
+        by_name.setdefault(name, []).append((items, value))
+    for name in sorted(by_name):
+        if name in _help:
+            lines.append(f"# HELP {p}_{name} {_help[name]}")
+        lines.append(f"# TYPE {p}_{name} counter")
+        lines += [f"{p}_{name}{_labels(items)} {_number(value)}" for items, value in sorted(by_name[name])]
+
+    for component, stats in sorted((gauges or {}).items()):
+        for stat, value in sorted(stats.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if stat in COUNTER_STATS:
+                    lines.append(f"# TYPE {p}_{component}_{stat}_total counter")
+                    lines.append(f"{p}_{component}_{stat}_total {_number(value)}")
+                else:
+                    lines.append(f"# TYPE {p}_{component}_{stat} gauge")
+                    lines.append(f"{p}_{component}_{stat} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clears everything recorded so far (tests). Spans still open keep counting as in flight."""
+    with _lock:
+        _histograms.clear()
+        for stage in [stage for stage, n in _in_flight.items() if not n]:
+            del _in_flight[stage]
+        _errors.clear()
+        _counters.clear()
@@ -0,0 +1,197 @@
+import os
+import time
+import random
+import asyncio
+import httpx
+from services.metrics import inc, log
+
+# Deadlines, retries and circuit breakers around the external dependencies:
+#   db       every PostgREST/SQLite query builder .execute() (services/db.py)
+#   gemini   generate_content / upload_file (services/gemini_voice.py)
+#   media    Twilio MediaUrl downloads (services/media_fetch.py)
+#   twilio   REST replies (services/whatsapp_pipeline.py)
+# `await call("db", query.execute, idempotent=True)` runs one operation:
+#   - each attempt gets <DEP>_TIMEOUT seconds, the whole call (attempts plus
+#     backoff) <DEP>_DEADLINE seconds, so a hung dependency can't hold a worker;
+#   - transient failures (timeouts, connection errors, 5xx) of idempotent
+#     operations are retried up to <DEP>_RETRIES times with full-jitter
+#     exponential backoff; non-idempotent ones (a stock delta, a sent message)
+#     never are, as the first attempt may have landed, unless the error says
+#     the operation did not run (`retry_safe`, e.g. sqlite_store.StorageBusy);
+#   - CIRCUIT_FAILURES transient failures in a row open the dependency's circuit:
+#     calls fail at once with CircuitOpen for CIRCUIT_RESET seconds, then a
+#     single probe call is let through and closes it again if it succeeds.
+# Errors that mean the dependency answered (4xx, constraint violations, a 429,
+# which services/gemini_admission.py handles) pass straight through.
+
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET = float(os.getenv("CIRCUIT_RESET", "30"))
+
+# name: (timeout per attempt, deadline for the whole call, retries)
+POLICIES = {
+    "db": (float(os.getenv("DB_ATTEMPT_TIMEOUT", "10")), float(os.getenv("DB_DEADLINE", "20")),
+           int(os.getenv("DB_RETRIES", "2"))),
+    "gemini": (float(os.getenv("GEMINI_TIMEOUT", "30")), float(os.getenv("GEMINI_DEADLINE", "45")),
+               int(os.getenv("GEMINI_RETRIES", "1"))),
+    "media": (float(os.getenv("MEDIA_TIMEOUT", "30")), float(os.getenv("MEDIA_DEADLINE", "45")),
+              int(os.getenv("MEDIA_RETRIES", "2"))),
+    # A sent message can't be unsent: Twilio calls are never retried
+    "twilio": (float(os.getenv("TWILIO_TIMEOUT", "10")), float(os.getenv("TWILIO_DEADLINE", "10")), 0),
+}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+if hasattr(asyncio, "timeout"):
+    async def _attempt(fn, timeout: float):
+        # Python 3.11+: cancels in place, no extra task per call (wait_for costs ~20us)
+        async with asyncio.timeout(timeout):
+            return await fn()
+else:
+    async def _attempt(fn, timeout: float):
+        return await asyncio.wait_for(fn(), timeout)
+
+
+class CircuitOpen(Exception):
+    """The dependency's circuit is open: failing fast instead of calling it."""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Timeouts, connection errors and 5xx/408 answers: worth retrying, and a sign the dependency is unwell."""
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    # HTTP status on httpx (status_code), twilio (status), google.api_core / postgrest (code)
+    for attr in ("status_code", "status", "code"):
+        try:
+            status = int(getattr(error, attr, None))
+        except (TypeError, ValueError):
+            continue
+        return status == 408 or 500 <= status < 600
+    return False
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = CIRCUIT_FAILURES, reset: float = CIRCUIT_RESET):
+        self.name = name
+        self.threshold = failures
+        self.reset = reset
+        self.state = CLOSED
+        self.failures = 0          # consecutive transient failures
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Raises CircuitOpen unless a call may go through now."""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset:
+            self.state = HALF_OPEN
+            log(f"Circuit {self.name}: half-open, probing")
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return
+        self.rejected += 1
+        inc("dependency_calls_total", help="External calls by dependency and outcome.",
+            dependency=self.name, outcome="rejected")
+        raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+
+    def on_success(self):
+        if self.state != CLOSED:
+            log(f"Circuit {self.name}: closed")
+        self.state, self.failures, self.probing = CLOSED, 0, False
+
+    def on_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            self.state, self.opened_at = OPEN, time.monotonic()
+            self.opened += 1
+            log(f"Circuit {self.name}: open after {self.failures} failures, retrying in {self.reset:g}s")
+
+    def stats(self) -> dict:
+        return {
+            "state": STATE_VALUES[self.state],
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class Dependency:
+    def __init__(self, name: str, timeout: float, deadline: float, retries: int,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY,
+                 breaker: CircuitBreaker = None):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(name)
+        self.retried = 0
+        self.timeouts = 0
+
+    def _count(self, outcome: str):
+        inc("dependency_calls_total", help="External calls by dependency and outcome.",
+            dependency=self.name, outcome=outcome)
+
+    async def call(self, fn, idempotent: bool = False):
+        """
+        Awaits fn() (a coroutine function, called again for each attempt) under
+        this dependency's deadline, retry policy and circuit breaker.
+        """
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            remaining = end - time.monotonic()
+            try:
+                result = await _attempt(fn, max(0.0, min(self.timeout, remaining)))
+            except asyncio.CancelledError:
+                self.breaker.probing = False  # a cancelled probe must not wedge the breaker half-open
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.on_success()  # it answered; the error is the caller's business
+                    raise
+                retry_safe = getattr(e, "retry_safe", False)
+                if retry_safe:
+                    self.breaker.probing = False  # contention (a lock held elsewhere), not an outage
+                else:
+                    self.breaker.on_failure()
+                if isinstance(e, TimeoutError):
+                    self.timeouts += 1
+                attempt += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if not (idempotent or retry_safe) or attempt > self.retries or time.monotonic() + delay >= end:
+                    self._count("timeout" if isinstance(e, TimeoutError) else "error")
+                    raise
+                self.retried += 1
+                self._count("retried")
+                log(f"{self.name} call failed ({type(e).__name__}: {e}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.on_success()
+                self._count("success")
+                return result
+
+    def stats(self) -> dict:
+        return {**self.breaker.stats(), "retried": self.retried, "timeouts": self.timeouts}
+
+
+dependencies = {name: Dependency(name, *policy) for name, policy in POLICIES.items()}
+
+
+async def call(dependency: str, fn, idempotent: bool = False):
+    """`await call("gemini", fn, idempotent=True)`: see Dependency.call."""
+    return await dependencies[dependency].call(fn, idempotent)
+
+
+def stats() -> dict:
+    """Per-dependency breaker state (0 closed, 1 half-open, 2 open) and retry counts."""
+    return {name: dependency.stats() for name, dependency in dependencies.items()}
@@ -0,0 +1,438 @@
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+# Embedded storage engine (DB_BACKEND=sqlite).
+# Implements the slice of the PostgREST client surface services/db.py uses -
+# table().select/insert/update/delete, the eq/neq/gt/gte/lt/lte/like/ilike/or_
+# filters, order/limit/range, and rpc() for the schema.sql functions - on a
+# local SQLite file (models/sqlite_schema.sql). Every function in db.py (tenant
+# cache, write-behind, keyset paging, ledger reads) runs unchanged on either
+# backend. Statements run synchronously on the event loop: on local disk in WAL
+# mode a lookup or an upsert takes tens of microseconds, less than handing it
+# to a thread would cost, and it makes every call atomic like an RPC.
+# That only holds if nothing waits for a lock on the loop: when another process
+# (a second worker, rebuild_ledger.py) holds the write lock, SQLite gives up
+# after SQLITE_BUSY_TIMEOUT_MS and the call fails with StorageBusy, which
+# services/resilience.py retries with an async backoff instead.
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5"))
+SQLITE_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "models", "sqlite_schema.sql")
+
+BOOLEAN_COLUMNS = {"is_credit"}
+IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")
+OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+class StorageBusy(ConnectionError):
+    """The database file is locked by another connection; the statement did not run."""
+    # Safe to run again even for a write, and not a sign the store is unwell
+    retry_safe = True
+
+
+@contextmanager
+def _busy_as_transient():
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if e.sqlite_errorcode in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+            raise StorageBusy(str(e)) from e
+        raise
+
+
+def _identifier(name: str) -> str:
+    if not IDENTIFIER.match(name):
+        raise ValueError(f"Invalid column or table name: {name!r}")
+    return name
+
+
+def _value(column: str, value):
+    """PostgREST passes booleans as 'true'/'false'; SQLite stores them as 0/1."""
+    if column in BOOLEAN_COLUMNS and isinstance(value, str):
+        return 1 if value.lower() == "true" else 0
+    return value
+
+
+def _condition(op: str, column: str, value):
+    column = _identifier(column)
+    if op == "like":
+        return f"{column} LIKE ? ESCAPE '\\'", value
+    if op == "ilike":
+        return f"lower({column}) LIKE lower(?) ESCAPE '\\'", value
+    return f"{column} {OPERATORS[op]} ?", _value(column, value)
+
+
+def _buyer_key(buyer_name):
+    """buyer_key() from schema.sql (used by the ledger triggers)."""
+    if buyer_name is None:
+        return None
+    return re.sub(r"\s+", " ", buyer_name.strip()).lower()
+
+
+def _clock():
+    """
+    now_utc() for schema defaults: UTC ISO-8601 with microseconds, like Postgres'
+    now() as PostgREST returns it, and strictly increasing per connection, so rows
+    written in the same microsecond still page in insertion order.
+    """
+    last = datetime.min.replace(tzinfo=timezone.utc)
+
+    def now_utc():
+        nonlocal last
+        last = max(datetime.now(timezone.utc), last + timedelta(microseconds=1))
+        return last.isoformat(timespec="microseconds")
+    return now_utc
+
+
+def logic_tree_sql(text: str):
+    """
+    PostgREST `or` filter -> (sql, params), e.g.
+    created_at.lt."X",and(created_at.eq."X",id.lt."Y") -> (created_at < ? OR (created_at = ? AND id < ?))
+    """
+    pos = 0
+
+    def parse_list(joiner):
+        nonlocal pos
+        parts, params = [], []
+        while True:
+            sql, values = parse_item()
+            parts.append(sql)
+            params += values
+            if pos < len(text) and text[pos] == ",":
+                pos += 1
+                continue
+            return "(" + f" {joiner} ".join(parts) + ")", params
+
+    def parse_value():
+        nonlocal pos
+        if text[pos] == '"':
+            pos += 1
+            out = []
+            while text[pos] != '"':
+                if text[pos] == "\\":
+                    pos += 1
+                out.append(text[pos])
+                pos += 1
+            pos += 1
+            return "".join(out)
+        start = pos
+        while pos < len(text) and text[pos] not in ",)":
+            pos += 1
+        return text[start:pos]
+
+    def parse_item():
+        nonlocal pos
+        for group, joiner in (("and(", "AND"), ("or(", "OR")):
+            if text.startswith(group, pos):
+                pos += len(group)
+                result = parse_list(joiner)
+                if text[pos] != ")":
+                    raise ValueError(f"Unbalanced logic tree: {text!r}")
+                pos += 1
+                return result
+        match = re.match(r"([a-z_]+)\.([a-z]+)\.", text[pos:])
+        if not match:
+            raise ValueError(f"Invalid logic tree: {text!r}")
+        column, op = match.groups()
+        pos += match.end()
+        sql, value = _condition(op, column, parse_value())
+        return sql, [value]
+
+    if text.startswith("(") and text.endswith(")"):
+        text = text[1:-1]
+    return parse_list("OR")
+
+
+class Result:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class SQLiteQuery:
+    """One table()... chain, compiled to a single SQL statement by execute()."""
+
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = _identifier(table)
+        self.action = "select"
+        self.columns = "*"
+        self.payload = None
+        self.where = []
+        self.params = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = None
+
+    def select(self, columns: str = "*", **kwargs):
+        if columns != "*":
+            columns = ", ".join(_identifier(c.strip()) for c in columns.split(","))
+        self.columns = columns
+        return self
+
+    def insert(self, data, **kwargs):
+        self.action, self.payload = "insert", data
+        return self
+
+    def update(self, data, **kwargs):
+        self.action, self.payload = "update", data
+        return self
+
+    def delete(self, **kwargs):
+        self.action = "delete"
+        return self
+
+    def _filter(self, op, column, value):
+        sql, value = _condition(op, column, value)
+        self.where.append(sql)
+        self.params.append(value)
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def like(self, column, pattern):
+        return self._filter("like", column, pattern)
+
+    def ilike(self, column, pattern):
+        return self._filter("ilike", column, pattern)
+
+    def or_(self, filters: str, **kwargs):
+        sql, params = logic_tree_sql(filters)
+        self.where.append(sql)
+        self.params += params
+        return self
+
+    def order(self, column, desc: bool = False, **kwargs):
+        # Postgres defaults: NULLs last ascending, first descending
+        self.orders.append(f"{_identifier(column)} {'DESC NULLS FIRST' if desc else 'ASC NULLS LAST'}")
+        return self
+
+    def limit(self, n: int, **kwargs):
+        self.limit_n = int(n)
+        return self
+
+    def offset(self, n: int, **kwargs):
+        self.offset_n = int(n)
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self.offset_n, self.limit_n = int(start), int(end) - int(start) + 1
+        return self
+
+    def _where(self) -> str:
+        return " WHERE " + " AND ".join(self.where) if self.where else ""
+
+    def compile(self):
+        """(sql, params) for a select/update/delete; inserts are built per row."""
+        if self.action == "update":
+            columns = [_identifier(c) for c in self.payload]
+            sets = ", ".join(f"{c} = ?" for c in columns)
+            values = [_value(c, self.payload[c]) for c in columns]
+            return f"UPDATE {self.table} SET {sets}{self._where()} RETURNING *", values + self.params
+        if self.action == "delete":
+            return f"DELETE FROM {self.table}{self._where()} RETURNING *", list(self.params)
+        sql = f"SELECT {self.columns} FROM {self.table}{self._where()}"
+        if self.orders:
+            sql += " ORDER BY " + ", ".join(self.orders)
+        if self.limit_n is not None or self.offset_n is not None:
+            sql += f" LIMIT {self.limit_n if self.limit_n is not None else -1} OFFSET {self.offset_n or 0}"
+        return sql, list(self.params)
+
+    def run(self) -> list:
+        if self.action == "insert":
+            rows = self.payload if isinstance(self.payload, list) else [self.payload]
+            with self.client.transaction():
+                return [self.client.insert(self.table, row) for row in rows]
+        sql, params = self.compile()
+        if self.action == "select":
+            return self.client.query(sql, params)
+        with self.client.transaction():
+            return self.client.query(sql, params)
+
+    async def execute(self):
+        return Result(self.run())
+
+
+class SQLiteRPC:
+    def __init__(self, client, name: str, params: dict):
+        self.client, self.name, self.params = client, name, params
+
+    def run(self):
+        fn = getattr(self.client, f"rpc_{self.name}", None)
+        if fn is None:
+            raise Exception(f"Could not find the function public.{self.name}")
+        with self.client.transaction():
+            return fn(**self.params)
+
+    async def execute(self):
+        return Result(self.run())
+
+
+class SQLiteClient:
+    """Drop-in for the AsyncPostgrestClient from db.create_db_client, on a local SQLite file."""
+
+    def __init__(self, path: str, schema_path: str = SQLITE_SCHEMA_PATH, busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA case_sensitive_like=ON")
+        self._conn.create_function("buyer_key", 1, _buyer_key, deterministic=True)
+        self._conn.create_function("now_utc", 0, _clock())
+        # Startup may wait for another process's write; requests never do
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        with open(schema_path) as f:
+            self._conn.executescript(f.read())
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        self._depth = 0
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def rpc(self, name: str, params: dict = None) -> SQLiteRPC:
+        return SQLiteRPC(self, name, params or {})
+
+    async def aclose(self):
+        self._conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT (or ROLLBACK on error); nested calls join the outer one."""
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        with _busy_as_transient():
+            self._conn.execute("BEGIN IMMEDIATE")
+        self._depth = 1
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            try:
+                with _busy_as_transient():
+                    self._conn.execute("COMMIT")
+            except StorageBusy:
+                self._conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._depth = 0
+
+    def query(self, sql: str, params=()) -> list:
+        with _busy_as_transient():
+            rows = [dict(row) for row in self._conn.execute(sql, params)]
+        if rows and BOOLEAN_COLUMNS & rows[0].keys():
+            for row in rows:
+                for column in BOOLEAN_COLUMNS & row.keys():
+                    row[column] = bool(row[column])
+        return rows
+
+    def insert(self, table: str, row: dict) -> dict:
+        columns = [_identifier(c) for c in row]
+        values = [_value(c, row[c]) for c in columns]
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) RETURNING *"
+        return self.query(sql, values)[0]
+
+    # --- RPCs (same contracts as the functions in schema.sql) ---
+    def rpc_apply_stock_delta(self, p_tenant_id, p_item_name, p_delta, p_unit=None):
+        row = self._conn.execute("""
+            INSERT INTO inventory (tenant_id, item_name, quantity, unit) VALUES (?, ?, ?, COALESCE(?, 'kg'))
+            ON CONFLICT (tenant_id, item_name) DO UPDATE
+                SET quantity = quantity + excluded.quantity,
+                    unit = COALESCE(?, unit),
+                    last_updated = now_utc()
+            RETURNING quantity
+        """, (p_tenant_id, p_item_name, p_delta, p_unit, p_unit)).fetchone()
+        return row[0]
+
+    def rpc_record_stock_transaction(self, p_tenant_id, p_transaction_type, p_item_name, p_quantity, p_unit,
+                                     p_rate, p_total_amount, p_buyer_name, p_is_credit):
+        delta = p_quantity if p_transaction_type == "PURCHASE" else -p_quantity
+        new_qty = self.rpc_apply_stock_delta(p_tenant_id, p_item_name, delta, p_unit)
+        self._conn.execute("""
+            INSERT INTO transactions (tenant_id, transaction_type, item_name, quantity, unit, rate, total_amount,
+                                      buyer_name, is_credit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (p_tenant_id, p_transaction_type, p_item_name, p_quantity, p_unit, p_rate, p_total_amount,
+              p_buyer_name, int(bool(p_is_credit))))
+        return new_qty
+
+    def rpc_apply_stock_batch(self, p_tenant_id, p_lines):
+        self._conn.executemany("""
+            INSERT INTO transactions (tenant_id, transaction_type, item_name, quantity, unit, rate, total_amount,
+                                      buyer_name, is_credit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (p_tenant_id, line["transaction_type"], line["item_name"], line["quantity"], line.get("unit"),
+             line.get("rate"), line.get("total_amount"), line.get("buyer_name"), int(bool(line.get("is_credit"))))
+            for line in p_lines if line.get("transaction_type")
+        ])
+        deltas = {}
+        for line in p_lines:
+            delta, unit = deltas.get(line["item_name"], (0, None))
+            units = [u for u in (unit, line.get("unit")) if u]
+            deltas[line["item_name"]] = (delta + line["delta"], max(units) if units else None)
+        # Item-name order, like the Postgres version (consistent lock order)
+        return [{"item": item, "new_qty": self.rpc_apply_stock_delta(p_tenant_id, item, delta, unit)}
+                for item, (delta, unit) in sorted(deltas.items())]
+
+    def rpc_apply_stock_batch_once(self, p_batch_id, p_tenant_id, p_lines):
+        cur = self._conn.execute("INSERT INTO applied_stock_batches (batch_id) VALUES (?) ON CONFLICT DO NOTHING",
+                                 (p_batch_id,))
+        if cur.rowcount == 0:
+            # Already applied: just report the current stock
+            names = sorted({line["item_name"] for line in p_lines})
+            rows = self._conn.execute(
+                f"SELECT item_name, quantity FROM inventory WHERE tenant_id = ? AND item_name IN "
+                f"({', '.join('?' * len(names))})", [p_tenant_id] + names
+            )
+            return [{"item": r[0], "new_qty": r[1]} for r in rows]
+        return self.rpc_apply_stock_batch(p_tenant_id, p_lines)
+
+    def rpc_rebuild_ledger_aggregates(self, p_tenant_id=None):
+        scope, params = ("", []) if p_tenant_id is None else (" WHERE tenant_id = ?", [p_tenant_id])
+        self._conn.execute(f"DELETE FROM daily_item_totals{scope}", params)
+        self._conn.execute(f"DELETE FROM buyer_balances{scope}", params)
+        self._conn.execute(f"""
+            INSERT INTO daily_item_totals (tenant_id, day, item_name, transaction_type, quantity, total_amount, tx_count)
+            SELECT tenant_id, date(created_at, '+5 hours'), item_name, transaction_type,
+                   SUM(quantity), SUM(COALESCE(total_amount, 0)), COUNT(*)
+            FROM transactions{scope}
+            GROUP BY tenant_id, date(created_at, '+5 hours'), item_name, transaction_type
+        """, params)
+        self._conn.execute(f"""
+            INSERT INTO buyer_balances (tenant_id, buyer_key, buyer_name, balance, tx_count, last_credit_at)
+            SELECT tenant_id, buyer_key(buyer_name), MAX(trim(buyer_name)),
+                   SUM(COALESCE(total_amount, 0)), COUNT(*), MAX(created_at)
+            FROM transactions
+            WHERE is_credit AND transaction_type = 'SALE' AND trim(COALESCE(buyer_name, '')) <> ''
+                  {'AND tenant_id = ?' if p_tenant_id is not None else ''}
+            GROUP BY tenant_id, buyer_key(buyer_name)
+        """, params)
+        return self._conn.execute(f"SELECT COUNT(*) FROM transactions{scope}", params).fetchone()[0]
@@ -0,0 +1,70 @@
+import os
+from cachetools import TTLCache
+
+# In-process cache in front of get_tenant_by_phone.
+# Tenant rows almost never change, but they are looked up on every WhatsApp
+# message and every /api call. Unregistered numbers are cached too (with a
+# shorter TTL), so spam senders don't cost a database round trip each time.
+
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "10000"))
+TENANT_CACHE_TTL = float(os.getenv("TENANT_CACHE_TTL", "300"))
+TENANT_CACHE_NEGATIVE_TTL = float(os.getenv("TENANT_CACHE_NEGATIVE_TTL", "60"))
+
+MISSING = object()
+
+
+def normalize_phone(phone_number: str) -> str:
+    """'whatsapp:+92 300-1234567' -> '+923001234567'"""
+    phone = (phone_number or "").strip().replace("whatsapp:", "")
+    return phone.replace(" ", "").replace("-", "")
+
+
+class TenantCache:
+    def __init__(self, maxsize: int = TENANT_CACHE_SIZE, ttl: float = TENANT_CACHE_TTL,
+                 negative_ttl: float = TENANT_CACHE_NEGATIVE_TTL):
+        self._found = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._not_found = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, phone: str):
+        """Returns the cached tenant, None for a cached 'not registered', or MISSING."""
+        tenant = self._found.get(phone, MISSING)
+        if tenant is not MISSING:
+            self.hits += 1
+            return tenant
+        if phone in self._not_found:
+            self.negative_hits += 1
+            return None
+        self.misses += 1
+        return MISSING
+
+    def put(self, phone: str, tenant):
+        if tenant:
+            self._found[phone] = tenant
+            self._not_found.pop(phone, None)
+        else:
+            self._not_found[phone] = True
+
+    def invalidate(self, phone: str = None):
+        """Drops one phone number (or everything when called without one)."""
+        if phone is None:
+            self._found.clear()
+            self._not_found.clear()
+        else:
+            self._found.pop(phone, None)
+            self._not_found.pop(phone, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            "size": len(self._found) + len(self._not_found),
+        }
+
+
+tenant_cache = TenantCache()
@@ -0,0 +1,250 @@
+import os
+import re
+from models.extraction import Extraction
+from services.item_index import ITEM_SYNONYMS
+
+# Deterministic parser for short Roman Urdu / Punjabi text commands
+# ("50 bori aalu aaye", "Rashid bhai ko 10 gaddi pyaz 500 ke rate par udhaar",
+# "tamatar kitna hai"). It produces the same Extraction the Gemini path does,
+# in microseconds. Anything it isn't sure about returns None and goes to Gemini.
+
+TEXT_FASTPATH_MIN_CONFIDENCE = float(os.getenv("TEXT_FASTPATH_MIN_CONFIDENCE", "0.75"))
+
+ITEMS = {word: item for item, words in ITEM_SYNONYMS.items() for word in words}
+
+UNITS = {
+    "bori": "Bori", "boriyan": "Bori", "bag": "Bori", "bags": "Bori",
+    "gaddi": "Gaddi", "gaddiyan": "Gaddi",
+    "kg": "kg", "kilo": "kg", "kilos": "kg",
+    "mann": "Mann", "maund": "Mann", "mun": "Mann",
+    "peti": "Peti", "crate": "Peti", "crates": "Peti",
+    "dabba": "Dabba", "dabbay": "Dabba",
+    "ton": "Ton",
+}
+
+NUMBER_WORDS = {
+    "ek": 1, "aik": 1, "do": 2, "teen": 3, "char": 4, "chaar": 4, "panch": 5, "paanch": 5,
+    "chay": 6, "chhe": 6, "saat": 7, "aath": 8, "nau": 9, "das": 10, "gyarah": 11, "barah": 12,
+    "pandrah": 15, "bees": 20, "pachees": 25, "tees": 30, "chalees": 40, "pachas": 50,
+    "pachaas": 50, "sattar": 70, "assi": 80, "nabbe": 90,
+    "aadha": 0.5, "derh": 1.5, "dhai": 2.5,
+}
+MULTIPLIERS = {"sau": 100, "so": 100, "hazar": 1000, "hazaar": 1000, "lakh": 100000}
+
+IN_WORDS = {"aaye", "aye", "aaya", "aya", "aayi", "aai", "aa", "receive", "received", "mila", "mile", "utre", "utra"}
+OUT_WORDS = {"gaya", "gaye", "gayi", "nikla", "nikle", "nikal", "kharab", "out"}
+COMPOUND_OUT_WORDS = {"gaya", "gaye", "gayi"}
+SALE_WORDS = {"bheje", "bheja", "bheji", "bhej", "diye", "diya", "di", "de", "becha", "beche", "bechi", "bech", "sold",
+              "sale", "bikri", "bika", "bike"}
+QUERY_WORDS = {"kitna", "kitne", "kitni", "check", "stock", "baqi", "bacha", "bache"}
+CREDIT_WORDS = {"udhaar", "udhar", "khaate", "khata", "khaata", "credit"}
+CASH_WORDS = {"cash", "nakad", "naqad"}
+RATE_WORDS = {"rate", "rupay", "rupaye", "rs", "rupees"}
+PRICE_WORDS = RATE_WORDS | {"bhao", "bhaav", "bhav", "qeemat", "keemat", "price", "daam"}
+# "50 bori aalu nahi aaye", "kya 50 bori aalu aaye": not a stock movement, Gemini decides
+NEGATION_WORDS = {"nahi", "nahin", "nai", "na", "mat"}
+QUESTION_WORDS = {"kya", "kyun", "kyon"}
+FILLER = {"hain", "hai", "ho", "hein", "ke", "ka", "ki", "mein", "main", "par", "pe", "se", "ne", "ji", "boss",
+          "the", "tha", "thi", "kar", "karo", "do", "hua", "hue", "abhi", "aj", "aaj", "wala", "wali"}
+HONORIFICS = {"bhai", "sahab", "sahib", "ji", "chacha", "bhaijan"}
+POSSESSIVES = {"ka", "ki", "ke"}
+
+_TOKEN = re.compile(r"\d+(?:[.,]\d+)*|[a-z]+")
+# Words that can't be part of a buyer's name
+_VOCABULARY = (set(UNITS) | set(NUMBER_WORDS) | set(MULTIPLIERS) | IN_WORDS | OUT_WORDS | SALE_WORDS | QUERY_WORDS
+               | CREDIT_WORDS | CASH_WORDS | PRICE_WORDS | NEGATION_WORDS | QUESTION_WORDS | FILLER | POSSESSIVES
+               | {"ko"})
+
+
+def tokenize(text: str) -> list:
+    """Lowercase word / number tokens ('50kg' -> ['50', 'kg'])."""
+    return _TOKEN.findall(text.lower())
+
+
+def _number(token: str):
+    if token[0].isdigit():
+        return float(token.replace(",", ""))
+    return NUMBER_WORDS.get(token)
+
+
+def _read_number(tokens: list, i: int):
+    """Reads a number phrase ('2', 'do sau', 'teen hazaar paanch sau'); returns (value, next index)."""
+    total = 0
+    current = None
+    j = i
+    while j < len(tokens):
+        token = tokens[j]
+        if token in MULTIPLIERS and current is not None:
+            current *= MULTIPLIERS[token]
+            if MULTIPLIERS[token] >= 1000:
+                total += current
+                current = None
+        else:
+            value = _number(token)
+            if value is None or (current is not None and token[0].isdigit()):
+                break
+            current = (current or 0) + value
+        j += 1
+    if j == i:
+        return None, i
+    return total + (current or 0), j
+
+
+def _buyer_before(tokens: list, i: int):
+    """Name ending just before tokens[i] ('rashid bhai' in 'rashid bhai ko'); None if it isn't a name."""
+    start = i - 1
+    while start > 0 and tokens[start] in HONORIFICS:
+        start -= 1
+    if tokens[start] in ITEMS or tokens[start][0].isdigit() or tokens[start] in _VOCABULARY:
+        return None, start
+    return " ".join(t.capitalize() for t in tokens[start:i]), start
+
+
+def parse_text_command(text: str):
+    """
+    Returns (Extraction, confidence) for a text command, or (None, 0.0) if the
+    text doesn't look like a single stock command.
+    """
+    tokens = tokenize(text)
+    if not tokens or any(t in NEGATION_WORDS or t in QUESTION_WORDS for t in tokens):
+        return None, 0.0
+
+    item = unit = action = intent = buyer = owner = None
+    quantity = rate = None
+    is_credit = sold = moved_in = moved_out = False
+    known = 0
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+
+        # "ko" marks the buyer: "rashid bhai ko"
+        if token == "ko" and i > 0:
+            known += 1
+            name, start = _buyer_before(tokens, i)
+            if name:
+                buyer = name
+                # Honorifics were already counted as known words
+                known += sum(1 for t in tokens[start:i] if t not in HONORIFICS)
+            i += 1
+            continue
+
+        # "rashid bhai ka udhaar": the khata owner, for balance questions
+        if token in POSSESSIVES and i > 0 and buyer is None and owner is None:
+            name, start = _buyer_before(tokens, i)
+            if name:
+                owner = name
+                known += sum(1 for t in tokens[start:i] if t not in HONORIFICS)
+
+        value, j = (None, i) if token == "do" and quantity is not None else _read_number(tokens, i)
+        if value is not None:
+            known += j - i
+            after = tokens[j] if j < len(tokens) else ""
+            before = tokens[i - 1] if i > 0 else ""
+            if after in RATE_WORDS or before in RATE_WORDS or (after == "ke" and tokens[j + 1:j + 2] == ["rate"]):
+                if rate is not None:
+                    return None, 0.0
+                rate = value
+            elif quantity is None:
+                quantity = value
+            else:
+                # A second quantity ("50 aaye 10 gaye"): more than one movement, leave it to Gemini
+                return None, 0.0
+            i = j
+            continue
+
+        if token in ITEMS:
+            if item is not None and ITEMS[token] != item:
+                # Several items in one message: leave it to Gemini
+                return None, 0.0
+            item = ITEMS[token]
+        elif token in UNITS:
+            if unit is not None:
+                return None, 0.0
+            unit = UNITS[token]
+        elif token in QUERY_WORDS:
+            intent = "QUERY"
+        elif token in SALE_WORDS:
+            sold = moved_out = True
+            if intent != "QUERY":
+                intent = "SALE"
+        elif token in IN_WORDS:
+            moved_in = True
+            if intent is None:
+                intent, action = "UPDATE", "IN"
+        elif token in OUT_WORDS:
+            # "aa gaye" is one verb (IN), not IN then OUT
+            if not (token in COMPOUND_OUT_WORDS and i > 0 and tokens[i - 1] in IN_WORDS):
+                moved_out = True
+            if intent is None:
+                intent, action = "UPDATE", "OUT"
+        elif token in CREDIT_WORDS:
+            is_credit = True
+        elif token in CASH_WORDS:
+            is_credit = False
+        elif token not in RATE_WORDS and token not in FILLER and token not in HONORIFICS:
+            i += 1
+            continue
+        known += 1
+        i += 1
+
+    # Stock both came in and went out ("10 diye 2 wapis aaye"): not one command
+    if moved_in and moved_out:
+        return None, 0.0
+
+    # Ledger questions: "aaj kitna becha", "rashid bhai ka udhaar kitna hai"
+    query_type = None
+    if quantity is None and is_credit and owner and intent in (None, "QUERY", "SALE"):
+        intent, query_type, buyer, is_credit = "QUERY", "BUYER_BALANCE", owner, False
+    elif intent == "QUERY":
+        # Only "how much is left / was sold": not "did 50 come?" or "what's the rate?"
+        if quantity is not None or any(t in PRICE_WORDS for t in tokens):
+            return None, 0.0
+        query_type = "DAILY_SALES" if sold else "STOCK"
+
+    # A buyer or a rate turns a plain "gaya/diye" into a sale
+    if intent == "UPDATE" and action == "OUT" and (buyer or rate):
+        intent = "SALE"
+    if intent == "SALE":
+        action = "OUT"
+
+    if intent is None or (intent != "QUERY" and quantity is None):
+        return None, 0.0
+    if item is None and query_type not in ("DAILY_SALES", "BUYER_BALANCE"):
+        return None, 0.0
+
+    confidence = known / len(tokens)
+    extraction = Extraction(
+        intent=intent, item_name=item, quantity=quantity, unit=unit or "kg", action=action,
+        buyer_name=buyer, rate=rate, is_credit=is_credit, query_type=query_type, original_text=text,
+    )
+    extraction.summary_for_user = summary_for(extraction)
+    return extraction, confidence
+
+
+def _fmt(value) -> str:
+    return f"{value:,.0f}" if value == int(value) else f"{value:,.2f}"
+
+
+def summary_for(extraction: Extraction):
+    """Roman Urdu confirmation in the Munshi's voice (same shape the prompt asks Gemini for)."""
+    qty = f"{_fmt(extraction.quantity)} {extraction.unit} {extraction.item_name}" if extraction.quantity is not None else ""
+    if extraction.intent == "SALE":
+        buyer = extraction.buyer_name or "customer"
+        if extraction.rate:
+            total = _fmt(extraction.quantity * extraction.rate)
+            summary = f"Ji Boss, {buyer} ko {qty} {_fmt(extraction.rate)} ke rate par de diya. Total: {total}."
+        else:
+            summary = f"Ji Boss, {buyer} ko {qty} de diya."
+        return summary + (" (Udhaar)" if extraction.is_credit else "")
+    if extraction.intent == "UPDATE":
+        return f"Ji Boss, {qty} {'aa gaye' if extraction.action == 'IN' else 'nikal gaye'}."
+    # QUERY: the stock figure comes from the database reply
+    return None
+
+
+def try_parse_text_command(text: str, min_confidence: float = TEXT_FASTPATH_MIN_CONFIDENCE):
+    """The fast path: an Extraction if the local parser is confident enough, else None."""
+    extraction, confidence = parse_text_command(text)
+    if extraction is None or confidence < min_confidence:
+        return None
+    return extraction
@@ -0,0 +1,183 @@
+import os
+import asyncio
+
+from services.gemini_voice import process_media_url, process_text_message
+from services.gemini_admission import GeminiBusy
+from services.resilience import CircuitOpen
+from services.text_commands import try_parse_text_command
+from services.job_queue import checkpoint
+from services.db import get_tenant_by_phone
+from services.agent_manager import agent_router
+from services import clients, resilience
+from services.metrics import span, inc, log, new_trace
+
+
+def clean_sender(sender: str) -> str:
+    """Strips the 'whatsapp:' prefix Twilio puts on From/To numbers."""
+    return (sender or "").replace("whatsapp:", "")
+
+
+def build_summary(data: dict, db_result) -> str:
+    """Picks the Roman Urdu reply for the user (The Trust Loop)."""
+    # For stock questions the database answer is the reply
+    if data.get("intent") == "QUERY" and isinstance(db_result, dict) and db_result.get("status") == "success":
+        return db_result.get("message")
+
+    # Use the Roman Urdu summary from Gemini if available
+    summary = data.get("summary_for_user")
+
+    if not summary:
+        # Fallback if Gemini failed to generate summary
+        intent = data.get("intent", "UNKNOWN")
+        if data.get("items") and isinstance(db_result, dict) and db_result.get("status") == "success":
+            summary = db_result.get("message")
+        elif intent == "UPDATE":
+            summary = f"Done: {data.get('item_name')} {data.get('quantity')} {data.get('unit')} {data.get('action')}"
+        else:
+            summary = "Maaf kijiye, samajh nahi aaya. Dobara boliye."
+
+    # If DB error, append warning
+    if isinstance(db_result, dict) and db_result.get("status") == "error":
+        summary += f" (Note: System Error - {db_result.get('message')})"
+
+    return summary
+
+
+# Sent when Gemini is saturated (GeminiBusy) or it / the media host is down
+# (CircuitOpen): quick, and honest that nothing was recorded
+BUSY_REPLY = "Maaf kijiye, abhi bohat rush hai. Aapka message record nahi hua, thori der baad dobara bhejiye."
+# Sent when a queued message still fails on its last attempt
+FAILED_REPLY = "Maaf kijiye, aapka message record nahi ho saka. Dobara bhejiye."
+
+
+async def extract_text(body: str, tenant_id: str = None):
+    """Text commands: local rule-based parser first, Gemini only if it isn't confident."""
+    with span("text.parse"):
+        extraction = try_parse_text_command(body)
+    if extraction is not None:
+        return extraction
+    return await process_text_message(body, tenant_id)
+
+
+def _count_message(intent: str, outcome: str):
+    inc("messages_total", help="WhatsApp messages handled, by intent and outcome.", intent=intent, outcome=outcome)
+
+
+async def build_reply(sender: str, media_url: str, media_type: str, body: str = None) -> str:
+    """
+    Runs one inbound WhatsApp message (voice note/image, or a text command)
+    through the whole pipeline (tenant lookup -> extraction -> agent_router)
+    and returns the reply text.
+    Raises on download/Gemini/parse failures so callers can decide how to surface them.
+    """
+    # 1. Identify Tenant
+    clean_phone = clean_sender(sender)
+    tenant = await get_tenant_by_phone(clean_phone)
+
+    if not tenant:
+        log(f"Refused: User {clean_phone} not registered in tenants table.")
+        _count_message("NONE", "unregistered")
+        return f"Salaam! Aap registered nahi hain. Please admin se contact karein. ID: {clean_phone}"
+
+    # 2. Extract the intent (Gemini for media, fast path for text)
+    try:
+        if media_url:
+            extraction = await process_media_url(media_url, media_type or "", tenant['id'])
+        else:
+            extraction = await extract_text(body or "", tenant['id'])
+    except (GeminiBusy, CircuitOpen) as e:
+        log(f"Extraction unavailable, asked {clean_phone} to retry: {e}")
+        _count_message("UNKNOWN", "busy")
+        return BUSY_REPLY
+    except Exception:
+        _count_message("UNKNOWN", "extraction_failed")
+        raise
+    data = extraction.model_dump()
+
+    # 3. Agentic Routing (Database Update)
+    try:
+        db_result = await agent_router(tenant['id'], data)
+    except Exception:
+        _count_message(data.get("intent") or "UNKNOWN", "failed")
+        raise
+    failed = isinstance(db_result, dict) and db_result.get("status") == "error"
+    _count_message(data.get("intent") or "UNKNOWN", "error" if failed else "success")
+
+    # 4. Construct Response (The Trust Loop)
+    return build_summary(data, db_result)
+
+
+def _build_twilio_client():
+    from twilio.rest import Client
+    from twilio.http.http_client import TwilioHttpClient
+
+    account_sid, auth_token = os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN")
+    if not account_sid or not auth_token:
+        raise RuntimeError("TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN must be set")
+    # Socket timeout, so a thread abandoned by resilience.call doesn't hang on
+    return Client(account_sid, auth_token,
+                  http_client=TwilioHttpClient(timeout=resilience.dependencies["twilio"].timeout))
+
+# Only the queued webhook mode sends through REST, so it doesn't gate readiness
+clients.register("twilio", _build_twilio_client, required=False)
+
+
+def _send_whatsapp_message_sync(to: str, from_: str, body: str):
+    with span("twilio.send"):
+        return clients.get("twilio").messages.create(to=to, from_=from_, body=body)
+
+
+async def send_whatsapp_message(to: str, from_: str, body: str):
+    """
+    Sends a reply through the Twilio REST API (used when the webhook has already
+    been acknowledged and TwiML can no longer carry the answer).
+    """
+    # The Twilio SDK is blocking, keep it off the event loop. Not retried: a
+    # timed-out send may have gone out
+    return await resilience.call(
+        "twilio", lambda: asyncio.to_thread(_send_whatsapp_message_sync, to, from_, body), idempotent=False
+    )
+
+
+async def _send_reply(payload: dict, summary: str):
+    """Sends `summary` for a queued message, at most once per MessageSid."""
+    from services.idempotency import idempotency_store
+
+    message_sid = payload.get("MessageSid")
+
+    async def send() -> str:
+        # Reply from the number the user wrote to (our Twilio WhatsApp sender)
+        await send_whatsapp_message(to=payload.get("From"), from_=payload.get("To"), body=summary)
+        return summary
+
+    return await idempotency_store.run(f"{message_sid}:sent" if message_sid else None, send)
+
+
+async def process_queued_message(payload: dict):
+    """Job queue handler: processes a saved webhook form and replies via REST."""
+    from services.idempotency import idempotency_store
+
+    new_trace(payload.get("MessageSid"))
+
+    with span("queue.job"):
+        # Once agent_router has written the stock change the reply is kept, in
+        # the job's row (checkpointed before sending, so it outlives a crash)
+        # and under the MessageSid: a job retried or replayed after the write,
+        # or a Twilio retry of the webhook, only re-sends it
+        if "reply" not in payload:
+            payload["reply"] = await idempotency_store.run(payload.get("MessageSid"), lambda: build_reply(
+                payload.get("From"), payload.get("MediaUrl0"), payload.get("MediaContentType0"), payload.get("Body")
+            ))
+            checkpoint(payload)
+        await _send_reply(payload, payload["reply"])
+
+
+async def reply_failed_message(payload: dict):
+    """
+    Job queue give-up hook: the user still gets an answer. The stored reply if
+    the stock change went through (only its send kept failing), else ask them
+    to send the message again.
+    """
+    new_trace(payload.get("MessageSid"))
+    log(f"Queued message from {clean_sender(payload.get('From'))} failed on every attempt")
+    await _send_reply(payload, payload.get("reply") or FAILED_REPLY)
@@ -1,5 +1,5 @@
 import asyncio
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 import os
 import sys
 
@@ -10,7 +10,7 @@ os.environ["GEMINI_API_KEY"] = "dummy-key"
 
 # 2. Mock Supabase Client creation to avoid actual connection attempt
 with (
-    patch('services.db.create_client') as mock_create_client,
+    patch('services.db.create_db_client') as mock_create_client,
     patch('services.db.supabase') as mock_supabase_instance
 ):
     # Now we can import safely
@@ -39,7 +39,7 @@ if 'services.db' in sys.modules:
 import services.db
 
 # 3. Apply Mocks to the functions used by Agent
-services.db.add_inventory_log = MagicMock(return_value=150)
+services.db.add_inventory_log = AsyncMock(return_value=150)
 
 # Mock the select query for "Query" intent
 # We need to mock the `supabase` object RESIDING in services.db
@@ -50,7 +50,7 @@ services.db.supabase = mock_db_client
 # chain: table -> select -> eq -> eq -> execute -> response.data
 mock_query_response = MagicMock()
 mock_query_response.data = [{"item_name": "Tomato", "quantity": 20, "unit": "kg"}]
-mock_db_client.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value = mock_query_response
+mock_db_client.table.return_value.select.return_value.eq.return_value.eq.return_value.execute = AsyncMock(return_value=mock_query_response)
 
 from services.agent_manager import agent_router
 
@@ -71,7 +71,7 @@ async def run_simulation():
     print(f"Result: {result_update}")
     
     # Verify DB call
-    services.db.add_inventory_log.assert_called()
+    services.db.add_inventory_log.assert_awaited()
 
     # Scenario 2: Query Inventory
     print("\n[Scenario 2] User asks: 'How many tomatoes?'")
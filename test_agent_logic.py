@@ -1,6 +1,6 @@
 import asyncio
 from services.agent_manager import agent_router
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock
 
 async def test_sale_routing():
     print("--- Testing Agent Router for SALE Intent ---")
@@ -19,7 +19,7 @@ async def test_sale_routing():
     tenant_id = "test-tenant-id"
     
     # Mock DB function
-    with patch("services.agent_manager.record_transaction") as mock_record:
+    with patch("services.agent_manager.record_transaction", new_callable=AsyncMock) as mock_record:
         mock_record.return_value = {"status": "success", "new_qty": 40, "total_amount": 50000}
         
         result = await agent_router(tenant_id, extraction_data)
@@ -27,7 +27,7 @@ async def test_sale_routing():
         print(f"Result: {result}")
         
         # Verify call
-        mock_record.assert_called_once_with(
+        mock_record.assert_awaited_once_with(
             tenant_id, "Potato", 10, "Bori", "SALE", 5000, "Rashid Bhai", True
         )
         print("SUCCESS: Router correctly called record_transaction with Sale details.")
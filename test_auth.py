@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import fakes
+from endpoints import api, auth as auth_endpoints
+from services import auth
+from services.auth import AuthError, FirebaseKeys, FirebaseVerifier
+
+TENANT = {"id": "tenant-1", "phone_number": "+923001234567", "business_name": "Test Mandi",
+          "created_at": "2024-05-01T00:00:00+00:00"}
+
+
+def make_verifier(firebase, min_refresh: float = 60):
+    return FirebaseVerifier(firebase.project_id, FirebaseKeys(firebase.keys_url, min_refresh=min_refresh))
+
+
+def rejects(coro) -> str:
+    try:
+        asyncio.run(coro)
+    except AuthError as e:
+        return str(e)
+    raise AssertionError("token was accepted")
+
+
+def test_firebase_tokens_verified_with_cached_keys():
+    print("--- Testing Firebase ID token verification ---")
+    firebase = fakes.start_fake_firebase()
+    try:
+        verifier = make_verifier(firebase, min_refresh=0.2)
+        token = firebase.token(TENANT["phone_number"])
+        claims = asyncio.run(verifier.verify(token))
+        assert claims["phone_number"] == TENANT["phone_number"]
+        assert asyncio.run(verifier.verify(token)) is claims  # memoized until exp
+        assert asyncio.run(verifier.verify(firebase.token("+923000000001")))["sub"] == "uid-+923000000001"
+        assert firebase.fetches == 1 and verifier.stats()["hits"] == 1
+
+        assert "issuer" in rejects(verifier.verify(firebase.token("+92300", project_id="someone-else")))
+        assert "Audience" in rejects(verifier.verify(firebase.token("+92300", aud="someone-else")))
+        assert "expired" in rejects(verifier.verify(firebase.token("+92300", exp=int(time.time()) - 3600)))
+        assert "Malformed" in rejects(verifier.verify("not-a-jwt"))
+        tampered = token[:-4] + ("AAAA" if not token.endswith("AAAA") else "BBBB")
+        assert "Invalid token" in rejects(verifier.verify(tampered))
+
+        # Google rotated keys: an unknown kid refetches once, then is throttled
+        time.sleep(0.25)
+        firebase.add_key("key-2")
+        assert asyncio.run(verifier.verify(firebase.token("+92300", kid="key-2")))["aud"] == firebase.project_id
+        assert firebase.fetches == 2
+        firebase.private_keys["key-3"] = firebase.private_keys["key-1"]  # signed, but never published
+        assert "Unknown" in rejects(verifier.verify(firebase.token("+92300", kid="key-3")))
+        assert firebase.fetches == 2
+    finally:
+        firebase.shutdown()
+    print("SUCCESS: one key fetch, memoized claims, bad tokens rejected")
+
+
+def test_session_tokens():
+    print("--- Testing session tokens ---")
+    token = auth.issue_session(TENANT)
+    assert auth.verify_session(token) == {"id": "tenant-1", "phone_number": "+923001234567",
+                                          "business_name": "Test Mandi"}
+    body, signature = token.split(".")
+    forged = auth._b64(auth._unb64(body).replace(b"tenant-1", b"tenant-2")) + "." + signature
+    for bad in (forged, body + ".", "garbage", auth.issue_session(TENANT, ttl=-1)):
+        try:
+            auth.verify_session(bad)
+            raise AssertionError(f"accepted {bad!r}")
+        except (AuthError, ValueError):
+            pass
+    print(f"SUCCESS: {len(token)}-char token, forged/expired ones rejected")
+
+
+def test_api_auth_flow():
+    print("--- Testing /api authentication ---")
+    firebase = fakes.start_fake_firebase()
+    app = FastAPI()
+    app.include_router(api.router)
+    app.include_router(auth_endpoints.router)
+    client = TestClient(app)
+    lookup = AsyncMock(return_value=TENANT)
+    try:
+        with patch.object(auth, "firebase_verifier", make_verifier(firebase)), \
+             patch.object(auth, "get_tenant_by_phone", lookup), \
+             patch.object(api, "get_buyer_balances", AsyncMock(return_value=[])):
+            bearer = {"Authorization": f"Bearer {firebase.token(TENANT['phone_number'])}"}
+            first = client.get("/api/ledger/khata", headers=bearer)
+            assert first.status_code == 200, first.text
+            session = first.headers["X-Session-Token"]
+
+            exchanged = client.post("/auth/session", headers=bearer).json()
+            assert exchanged["user"]["id"] == "tenant-1" and exchanged["session_token"]
+            assert lookup.await_count == 2
+
+            # Session requests never reach the tenant lookup (or anything else)
+            lookup.side_effect = AssertionError("no lookup expected")
+            for _ in range(3):
+                assert client.get("/api/ledger/khata", headers={"Authorization": f"Session {session}"}).status_code == 200
+            assert client.get("/api/ledger/khata", headers={"Authorization": f"Session {session}x"}).status_code == 401
+            assert client.get("/api/ledger/khata").status_code == 401
+            assert client.post("/auth/session", headers={"Authorization": f"Session {session}"}).status_code == 401
+
+            with patch.object(auth, "ALLOW_PHONE_HEADER_AUTH", False):
+                assert client.get("/api/ledger/khata", headers={"X-Phone-Number": "+923001234567"}).status_code == 401
+    finally:
+        firebase.shutdown()
+    print("SUCCESS: Firebase token -> session token -> no-I/O requests")
+
+
+if __name__ == "__main__":
+    test_firebase_tokens_verified_with_cached_keys()
+    test_session_tokens()
+    test_api_auth_flow()
@@ -0,0 +1,94 @@
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from services import clients
+
+HEAVY_MODULES = ("postgrest", "google.generativeai", "firebase_admin", "jwt", "twilio.rest", "PIL", "services.gemini_voice")
+
+
+def test_import_main_loads_no_sdk_clients():
+    print("--- Testing cold import of main ---")
+    # A fresh interpreter with no credentials at all: importing must still succeed
+    code = f"import sys, main; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    env = {"PATH": "", "PYTHONPATH": "."}
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+    print("SUCCESS: no SDK imported until first use")
+
+
+def test_registry_builds_once_and_reports_errors():
+    print("--- Testing lazy client registry ---")
+    built = []
+
+    def slow_factory():
+        time.sleep(0.05)
+        built.append(1)
+        return object()
+
+    def broken_factory():
+        raise RuntimeError("missing key")
+
+    with patch.object(clients, "_factories", {}), patch.object(clients, "_instances", {}), \
+         patch.object(clients, "_errors", {}), patch.object(clients, "_timings", {}):
+        clients.register("slow", slow_factory)
+        clients.register("broken", broken_factory, required=False)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(clients.get("slow"))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(built) == 1 and len({id(r) for r in results}) == 1
+
+        asyncio.run(clients.warm_up())
+        ready = clients.readiness()
+        assert ready["ready"] is True
+        assert ready["clients"] == {"slow": "ready", "broken": "error"}
+        assert "missing key" in ready["errors"]["broken"]
+    print("SUCCESS: concurrent first use built the client once")
+
+
+def test_ready_waits_for_warm_up():
+    print("--- Testing liveness / readiness endpoints ---")
+    import main
+
+    gate = threading.Event()
+
+    def gated_factory():
+        gate.wait(5)
+        return object()
+
+    async def noop():
+        return None
+
+    factories = {"db": (gated_factory, True), "gemini": (lambda: object(), True)}
+    with patch.object(clients, "_factories", factories), patch.object(clients, "_instances", {}), \
+         patch.object(clients, "_errors", {}), patch.object(clients, "_timings", {}), \
+         patch.object(main, "WARM_UP_MODULES", ()), patch("services.item_index.warm_item_index", noop), \
+         patch("services.db.close_db", noop), patch("services.media_fetch.close_media_fetcher", noop):
+        with TestClient(main.app) as client:
+            assert client.get("/health/live").status_code == 200
+            pending = client.get("/health/ready")
+            assert pending.status_code == 503
+            assert pending.json()["clients"]["db"] == "pending"
+            gate.set()
+            for _ in range(100):
+                ready = client.get("/health/ready")
+                if ready.status_code == 200:
+                    break
+                time.sleep(0.02)
+            assert ready.status_code == 200, ready.json()
+            assert ready.json()["clients"] == {"db": "ready", "gemini": "ready"}
+    print("SUCCESS: ready only after warm-up")
+
+
+if __name__ == "__main__":
+    test_import_main_loads_no_sdk_clients()
+    test_registry_builds_once_and_reports_errors()
+    test_ready_waits_for_warm_up()
@@ -0,0 +1,72 @@
+import asyncio
+import os
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import endpoints.api as api
+from services.dashboard_cache import dashboard_cache
+
+TENANT = {"id": "tenant-dash", "phone_number": "+923001234567"}
+HEADERS = {"X-Phone-Number": "+923001234567"}
+
+
+def make_client():
+    app = FastAPI()
+    app.include_router(api.router)
+    return TestClient(app)
+
+
+def test_dashboard_etag_and_cache():
+    print("--- Testing /api/dashboard ETag + cache ---")
+    inventory = AsyncMock(return_value=[{"id": 1, "item_name": "Potato", "quantity": 50}])
+    transactions = AsyncMock(return_value=[{"id": "t1", "item_name": "Potato"}])
+    with patch("services.auth.get_tenant_by_phone", AsyncMock(return_value=TENANT)), \
+         patch.object(api, "get_inventory", inventory), \
+         patch.object(api, "get_recent_transactions", transactions), \
+         patch.object(api, "delete_transaction", AsyncMock(return_value={"status": "success"})):
+        client = make_client()
+
+        first = client.get("/api/dashboard", headers=HEADERS)
+        assert first.status_code == 200
+        assert first.json()["inventory"][0]["item_name"] == "Potato"
+        etag = first.headers["etag"]
+
+        # Unchanged poll: 304, no DB calls
+        again = client.get("/api/dashboard", headers={**HEADERS, "If-None-Match": etag})
+        assert again.status_code == 304 and again.headers["etag"] == etag
+        # No validator: served from the per-tenant cache
+        assert client.get("/api/dashboard", headers=HEADERS).status_code == 200
+        assert inventory.await_count == 1 and transactions.await_count == 1
+
+        # A write (CRUD endpoint or webhook path) invalidates it
+        client.delete("/api/transactions/t1", headers=HEADERS)
+        changed = client.get("/api/dashboard", headers={**HEADERS, "If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["etag"] != etag
+        assert inventory.await_count == 2
+
+        dashboard_cache.bump(TENANT["id"])
+        assert client.get("/api/dashboard", headers={**HEADERS, "If-None-Match": changed.headers["etag"]}).status_code == 200
+    print("SUCCESS:", dashboard_cache.stats())
+
+
+def test_write_paths_bump_version():
+    import services.db as db
+
+    before = dashboard_cache.version("tenant-w")
+    rpc = AsyncMock()
+    rpc.return_value.data = [{"quantity": 10}]
+    with patch.object(db, "supabase") as client:
+        client.rpc.return_value.execute = rpc
+        asyncio.run(db.add_inventory_log("tenant-w", "Potato", 10, "kg", "IN"))
+        asyncio.run(db.record_transaction("tenant-w", "Potato", 5, "kg", "SALE", 100, "Ali"))
+    assert dashboard_cache.version("tenant-w") == before + 2
+
+
+if __name__ == "__main__":
+    test_dashboard_etag_and_cache()
+    test_write_paths_bump_version()
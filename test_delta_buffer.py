@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+import tempfile
+from unittest.mock import patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+import services.db as db
+import services.delta_buffer as delta_buffer
+from services.delta_buffer import DeltaBuffer
+
+
+class FakeStock:
+    """Stand-in for apply_stock_batch_once: idempotent per batch id, counts round trips."""
+
+    def __init__(self):
+        self.qty = {}
+        self.applied = set()
+        self.calls = 0
+        self.fail_after_apply = 0
+
+    async def flush(self, tenant_id, lines, batch_id):
+        self.calls += 1
+        if batch_id not in self.applied:
+            self.applied.add(batch_id)
+            for line in lines:
+                sign = 1 if line["action"] == "IN" else -1
+                key = (tenant_id, line["item_name"])
+                self.qty[key] = self.qty.get(key, 0) + sign * line["quantity"]
+        if self.fail_after_apply:
+            # Applied, but the response never arrives
+            self.fail_after_apply -= 1
+            raise ConnectionError("response lost")
+        return {line["item_name"]: self.qty[(tenant_id, line["item_name"])] for line in lines}
+
+
+def _journal():
+    return os.path.join(tempfile.mkdtemp(), "deltas.sqlite3")
+
+
+def test_coalesces_and_merges_reads():
+    print("--- Testing write-behind coalescing ---")
+    stock = FakeStock()
+    buffer = DeltaBuffer(_journal(), stock.flush)
+    rng = random.Random(3)
+    expected = {}
+    for _ in range(300):
+        key = (rng.choice(["t1", "t2"]), rng.choice(["Potato", "Onion", "Tomato"]))
+        delta = rng.choice([1, -1]) * rng.randint(1, 20)
+        buffer.add(*key, delta, "Bori")
+        expected[key] = expected.get(key, 0) + delta
+
+    async def run():
+        # Before any flush: persisted row + pending delta
+        potato = buffer.merge_rows("t1", [{"id": 1, "item_name": "Potato", "quantity": 100, "unit": "Bori"}])
+        assert potato[0]["quantity"] == 100 + expected[("t1", "Potato")]
+        assert {r["item_name"] for r in potato} == {"Potato", "Onion", "Tomato"}
+        assert await buffer.flush() == 2
+        assert await buffer.quantity("t1", "Onion", None) == expected[("t1", "Onion")]
+
+    asyncio.run(run())
+    stats = buffer.stats()
+    print(f"SUCCESS: {stats}")
+    assert stock.qty == expected
+    assert stock.calls == 2
+    assert stats["rows_written"] == 6 and stats["coalescing_ratio"] == 50.0
+    assert stats["pending_items"] == 0
+
+
+def test_journal_survives_crash_and_lost_responses():
+    print("--- Testing write-behind crash recovery ---")
+    path = _journal()
+    stock = FakeStock()
+
+    # 1. Acknowledged but never flushed, then the process dies
+    buffer = DeltaBuffer(path, stock.flush)
+    buffer.add("t1", "Potato", 50, "Bori")
+    buffer.add("t1", "Potato", -10, "Bori")
+    buffer.close()
+
+    # 2. Restart: the flush is applied but its response is lost, then we crash again
+    stock.fail_after_apply = 1
+    buffer = DeltaBuffer(path, stock.flush)
+    assert buffer.pending("t1") == {"Potato": [40, "Bori"]}
+    assert asyncio.run(buffer.flush()) == 0
+    buffer.add("t1", "Onion", 5, "Gaddi")
+    buffer.close()
+
+    # 3. Restart: the lost batch is retried under the same id and not applied twice
+    buffer = DeltaBuffer(path, stock.flush)
+    assert asyncio.run(buffer.flush()) == 2
+    assert stock.qty == {("t1", "Potato"): 40, ("t1", "Onion"): 5}
+    assert buffer.pending("t1") == {}
+    buffer.close()
+    assert DeltaBuffer(path, stock.flush).recover() == 0
+    print("SUCCESS: no delta lost or applied twice")
+
+
+def test_concurrent_flushes_apply_each_batch_once():
+    print("--- Testing overlapping flush() calls ---")
+    stock = FakeStock()
+    flush = stock.flush
+
+    async def slow_flush(tenant_id, lines, batch_id):
+        await asyncio.sleep(0.01)
+        return await flush(tenant_id, lines, batch_id)
+
+    buffer = DeltaBuffer(_journal(), slow_flush)
+
+    async def run():
+        buffer.add("t1", "Potato", 50, "Bori")
+        buffer.add("t2", "Onion", 5, "Gaddi")
+        first = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        buffer.add("t1", "Potato", -10, "Bori")
+        # e.g. the background flusher and a dashboard edit at the same time
+        return await asyncio.gather(first, buffer.flush())
+
+    applied = asyncio.run(run())
+    assert applied == [2, 1], applied
+    assert stock.calls == 3 and buffer.stats()["flush_errors"] == 0
+    assert stock.qty == {("t1", "Potato"): 40, ("t2", "Onion"): 5} and buffer.pending("t1") == {}
+    print("SUCCESS: every batch flushed once, no false errors")
+
+
+def test_direct_writes_and_edits_keep_reads_current():
+    print("--- Testing write-behind reads around direct writes ---")
+
+    async def flush_fn(tenant_id, lines, batch_id):
+        return await db.apply_stock_batch(tenant_id, lines, batch_id=batch_id)
+
+    async def run():
+        buffer = DeltaBuffer(_journal(), flush_fn)
+        with fakes.installed() as env, patch.object(db, "WRITE_BEHIND", True), \
+             patch.object(delta_buffer, "_buffer", buffer):
+            tenant = env.db.add_tenant("+923001234567")["id"]
+            env.db.set_stock(tenant, "Potato", 100, "Bori")
+            assert await db.add_inventory_log(tenant, "Potato", 10, "Bori", "IN") == 110   # baseline cached
+
+            # A sale and a multi-item batch go straight to the database
+            await db.record_transaction(tenant, "Potato", 30, "Bori", "SALE", 100, "Imam")
+            assert (await db.get_inventory_item(tenant, "Potato"))["quantity"] == 80
+            assert await db.add_inventory_log(tenant, "Potato", 5, "Bori", "IN") == 85
+            await db.apply_stock_batch(tenant, [{"item_name": "Potato", "quantity": 20, "action": "OUT"}])
+            assert await db.add_inventory_log(tenant, "Potato", 1, "Bori", "IN") == 66
+
+            # Setting the quantity from the dashboard replaces what the user saw,
+            # pending deltas included: they are not added on top afterwards
+            row = await db.get_inventory_item(tenant, "Potato")
+            assert await db.update_inventory_item(row["id"], {"quantity": 40}, tenant_id=tenant) == {"status": "success"}
+            assert buffer.pending(tenant) == {}
+            assert await db.add_inventory_log(tenant, "Potato", 2, "Bori", "IN") == 42
+            await buffer.flush()
+            return env.db.tables["inventory"][0]["quantity"]
+
+    assert asyncio.run(run()) == 42
+    print("SUCCESS: sales, batches and edits are reflected immediately")
+
+
+if __name__ == "__main__":
+    test_coalesces_and_merges_reads()
+    test_journal_survives_crash_and_lost_responses()
+    test_concurrent_flushes_apply_each_batch_once()
+    test_direct_writes_and_edits_keep_reads_current()
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import tempfile
+from unittest.mock import MagicMock, AsyncMock, patch
+
+from services.extraction_cache import ExtractionCache, media_cache_key
+
+
+def test_disk_tier_survives_restart_and_is_pruned():
+    print("--- Testing extraction cache tiers ---")
+    path = os.path.join(tempfile.mkdtemp(), "extractions.sqlite3")
+    key = media_cache_key(b"voice-note-bytes", "v1")
+    assert key != media_cache_key(b"voice-note-bytes", "v2")
+
+    cache = ExtractionCache(disk_path=path)
+    assert cache.get(key) is None
+    cache.put(key, '{"intent": "QUERY"}')
+    assert cache.get(key) == '{"intent": "QUERY"}'
+
+    # New process: memory tier is empty, the disk tier answers
+    restarted = ExtractionCache(disk_path=path)
+    assert restarted.get(key) == '{"intent": "QUERY"}'
+    assert restarted.get(key) == '{"intent": "QUERY"}'
+    assert restarted.stats()["disk_hits"] == 1 and restarted.stats()["memory_hits"] == 1
+
+    # Size budget: oldest rows go first
+    small = ExtractionCache(disk_path=path, disk_max_bytes=100, prune_every=1)
+    for i in range(10):
+        small.put(f"k{i}", "x" * 30)
+    assert small._conn.execute("SELECT SUM(size) FROM extractions").fetchone()[0] <= 100
+    assert small._conn.execute("SELECT COUNT(*) FROM extractions WHERE key = 'k9'").fetchone()[0] == 1
+    print("SUCCESS: disk tier persisted and pruned by size.")
+
+
+def test_repeated_media_skips_gemini():
+    print("--- Testing process_media_url cache hit ---")
+    import services.gemini_voice as gv
+
+    fetcher = MagicMock()
+    fetcher.fetch = AsyncMock(return_value=b"same receipt photo")
+    model = MagicMock()
+    model.generate_content.return_value.text = '```json\n{"intent": "QUERY", "item_name": "Potato"}\n```'
+
+    with patch.object(gv, "get_media_fetcher", return_value=fetcher), \
+         patch.object(gv, "model", model), \
+         patch.object(gv, "extraction_cache", ExtractionCache()) as cache:
+        first = asyncio.run(gv.process_media_url("https://api.twilio.com/m/1", "image/jpeg"))
+        second = asyncio.run(gv.process_media_url("https://api.twilio.com/m/2", "image/jpeg"))
+
+        assert first == second and first.item_name == "Potato"
+        assert model.generate_content.call_count == 1
+        assert cache.stats()["gemini_calls_saved"] == 1
+    print("SUCCESS: second upload of the same bytes never reached Gemini.")
+
+
+if __name__ == "__main__":
+    test_disk_tier_survives_restart_and_is_pruned()
+    test_repeated_media_skips_gemini()
@@ -0,0 +1,104 @@
+from services.extraction_parser import parse_extraction, repair_json, ExtractionParseError
+
+# Real-world shaped Gemini answers: (raw model output, expected fields).
+# Used by these tests and by bench_extraction_parser.py.
+CORPUS = [
+    # Clean JSON-mode output
+    ('{"intent": "UPDATE", "item_name": "Potato", "quantity": 50, "unit": "Bori", "action": "IN", '
+     '"buyer_name": null, "rate": null, "is_credit": false, "summary_for_user": "Ji Boss, 50 Bori Potato aa gaye.", '
+     '"original_text": "50 bori aalu aaye hain"}',
+     {"intent": "UPDATE", "item_name": "Potato", "quantity": 50, "action": "IN"}),
+    # Markdown fences
+    ('```json\n{"intent": "QUERY", "item_name": "Tomato", "summary_for_user": "Check kar raha hoon."}\n```',
+     {"intent": "QUERY", "item_name": "Tomato"}),
+    # Chatter before and after the object
+    ('Here is the extracted JSON:\n{"intent": "SALE", "item_name": "Onion", "quantity": 10, "unit": "Gaddi", '
+     '"buyer_name": "Rashid Bhai", "rate": 5000, "is_credit": true}\nLet me know if you need anything else!',
+     {"intent": "SALE", "buyer_name": "Rashid Bhai", "rate": 5000, "is_credit": True}),
+    # Trailing commas
+    ('{"intent": "UPDATE", "item_name": "Garlic", "quantity": 5, "unit": "kg", "action": "OUT",}',
+     {"intent": "UPDATE", "item_name": "Garlic", "action": "OUT"}),
+    # Python-style dict (single quotes, True/None)
+    ("{'intent': 'SALE', 'item_name': 'Potato', 'quantity': 3, 'buyer_name': None, 'rate': 200, 'is_credit': True}",
+     {"intent": "SALE", "quantity": 3, "buyer_name": None, "is_credit": True}),
+    # Truncated at max tokens, mid-string
+    ('{"intent": "QUERY", "item_name": "Chili", "summary_for_user": "Ji Boss, Chili ka stock',
+     {"intent": "QUERY", "item_name": "Chili", "summary_for_user": "Ji Boss, Chili ka stock"}),
+    # Truncated right after a key
+    ('{"intent": "QUERY", "item_name": "Ginger", "quantity":',
+     {"intent": "QUERY", "item_name": "Ginger", "quantity": None}),
+    # Numbers as strings, lowercase intent/action
+    ('{"intent": "update", "item_name": "Tomato", "quantity": "1,200", "action": "in", "rate": ""}',
+     {"intent": "UPDATE", "quantity": 1200, "action": "IN", "rate": None}),
+    # Smart quotes from a copy-pasted example
+    ('{“intent”: “QUERY”, “item_name”: “Potato”}',
+     {"intent": "QUERY", "item_name": "Potato"}),
+    # Comments and unquoted enum value
+    ('{\n  // stock in\n  "intent": UPDATE,\n  "item_name": "Onion", /* pyaaz */ "quantity": 20\n}',
+     {"intent": "UPDATE", "item_name": "Onion", "quantity": 20}),
+    # Raw newline inside a string + a brace inside the summary
+    ('{"intent": "SALE", "item_name": "Potato", "summary_for_user": "Ji Boss {done}\nTotal 50,000"} trailing',
+     {"intent": "SALE", "summary_for_user": "Ji Boss {done}\nTotal 50,000"}),
+    # List instead of an object
+    ('[{"intent": "UPDATE", "item_name": "Potato", "quantity": 1, "action": "IN"}]',
+     {"intent": "UPDATE", "quantity": 1}),
+    # Unknown intent and an invalid action
+    ('{"intent": "GREETING", "action": "SIDEWAYS", "summary_for_user": "Walaikum Salaam!"}',
+     {"intent": "UNKNOWN", "action": None}),
+]
+
+
+def test_corpus_parses():
+    print(f"--- Parsing {len(CORPUS)} malformed model outputs ---")
+    for raw, expected in CORPUS:
+        extraction = parse_extraction(raw)
+        for field, value in expected.items():
+            assert getattr(extraction, field) == value, (raw, field, getattr(extraction, field))
+    print("SUCCESS: every corpus entry parsed without another model call.")
+
+
+def test_repair_output_is_valid_json():
+    import json
+    for raw, _ in CORPUS:
+        if "{" in raw:
+            json.loads(repair_json(raw))
+
+
+# Truncated answers that would write the wrong stock if repaired
+TRUNCATED = [
+    # Cut off mid-number: 5 of 500
+    '{"intent": "UPDATE", "item_name": "Potato", "quantity": 5',
+    '{"intent": "QUERY", "item_name": "Potato", "quantity": 12.',
+    # Cut off before action / rate
+    '{"intent": "UPDATE", "item_name": "Chili", "quantity": 12, "unit": "kg", "summary_for_user": "Ji Boss, 12 kg',
+    '{"intent": "SALE", "item_name": "Onion", "quantity": 10, "buyer_name": "Rashid Bhai",',
+]
+
+
+def test_truncated_stock_changes_are_rejected():
+    print("--- Testing truncated SALE/UPDATE and mid-number answers ---")
+    for raw in TRUNCATED:
+        try:
+            parse_extraction(raw)
+            raise AssertionError(f"expected ExtractionParseError for {raw!r}")
+        except ExtractionParseError:
+            pass
+    # Still repairable as JSON; parse_extraction is what refuses it
+    assert repair_json(TRUNCATED[0]).endswith('"quantity": 5}')
+    print("SUCCESS")
+
+
+def test_garbage_is_rejected():
+    for raw in ["", "Maaf kijiye, main samajh nahi paya.", "null"]:
+        try:
+            parse_extraction(raw)
+            raise AssertionError(f"expected ExtractionParseError for {raw!r}")
+        except ExtractionParseError:
+            pass
+
+
+if __name__ == "__main__":
+    test_corpus_parses()
+    test_repair_output_is_valid_json()
+    test_truncated_stock_changes_are_rejected()
+    test_garbage_is_rejected()
@@ -0,0 +1,84 @@
+import asyncio
+import os
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from fastapi.testclient import TestClient
+
+import fakes
+import services.db as db
+from bench_pipeline import run_load, scenario_agent_router, seed
+
+
+def test_fake_supabase_follows_the_schema():
+    print("--- Testing FakeSupabase against services/db.py ---")
+
+    async def run():
+        with fakes.installed() as env:
+            tenant = env.db.add_tenant("+923001234567")["id"]
+            await db.add_inventory_log(tenant, "Potato", 100, "kg", "IN")
+            sale = await db.record_transaction(tenant, "Potato", 10, "kg", "SALE", rate=200,
+                                               buyer_name=" Rashid  Bhai", is_credit=True)
+            lines = [{"item_name": "Onion", "quantity": 5, "unit": "kg", "transaction_type": "PURCHASE"}]
+            first = await db.apply_stock_batch(tenant, lines, batch_id="b-1")
+            retried = await db.apply_stock_batch(tenant, lines, batch_id="b-1")
+            balance = await db.get_buyer_balance(tenant, "rashid")
+            page = await db.get_transactions_page(tenant, limit=1)
+            rest = await db.get_transactions_page(tenant, limit=1, cursor=page["next_cursor"])
+
+            # Deleting the sale takes it back out of the aggregates (trigger)
+            await db.delete_transaction(rest["transactions"][0]["id"])
+            after_delete = await db.get_buyer_balance(tenant, "rashid bhai")
+            rebuilt = await db.rebuild_ledger_aggregates(tenant)
+            totals = await db.get_daily_totals(tenant)
+            return sale, first, retried, balance, page, rest, after_delete, rebuilt, totals, env.db
+
+    sale, first, retried, balance, page, rest, after_delete, rebuilt, totals, fake = asyncio.run(run())
+    assert sale == {"status": "success", "new_qty": 90, "total_amount": 2000.0}
+    assert first == retried == {"Onion": 5}
+    assert balance["buyer_name"] == "Rashid  Bhai" and balance["balance"] == 2000
+    assert page["transactions"][0]["item_name"] == "Onion" and rest["next_cursor"] is None
+    assert after_delete["balance"] == 0 and after_delete["tx_count"] == 0
+    assert rebuilt == 1 and [(t["item_name"], t["transaction_type"]) for t in totals] == [("Onion", "PURCHASE")]
+    assert fake.calls[("rpc", "apply_stock_batch_once")] == 2
+    print("SUCCESS: RPCs, ledger trigger and keyset paging behave like schema.sql")
+
+
+def test_voice_note_through_fake_twilio_and_gemini():
+    print("--- Testing a voice note end to end on the fakes ---")
+    import main
+
+    with fakes.installed() as env:
+        tenant = env.db.add_tenant("+923001234567")
+        env.db.set_stock(tenant["id"], "Potato", 50, "Bori")
+        url = env.media.add("voice-1", "10 bori aloo becha Rashid Bhai ko 2000 rupay".encode())
+        response = TestClient(main.app).post("/whatsapp/webhook", data={
+            "From": "whatsapp:+923001234567", "MediaUrl0": url, "MediaContentType0": "audio/ogg",
+            "MessageSid": "SMfakevoice1",
+        })
+        stock = env.db._find("inventory", tenant_id=tenant["id"], item_name="Potato")["quantity"]
+        assert response.status_code == 200 and "<Message>" in response.text, response.text
+        assert env.gemini.calls == 1
+        assert stock == 40
+    print("SUCCESS: download -> Gemini stand-in -> stock updated")
+
+
+def test_run_load_reports_percentiles():
+    print("--- Testing the load driver ---")
+
+    async def run():
+        with fakes.installed(db_latency=0.001) as env:
+            tenants = seed(env)
+            return await run_load(scenario_agent_router(env, None, tenants, run_id=0), requests=60, concurrency=6)
+
+    stats = asyncio.run(run())
+    print(f"SUCCESS: {stats}")
+    assert stats["errors"] == 0 and stats["requests"] == 60
+    assert 0 < stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+
+
+if __name__ == "__main__":
+    test_fake_supabase_follows_the_schema()
+    test_voice_note_through_fake_twilio_and_gemini()
+    test_run_load_reports_percentiles()
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import time
+from unittest.mock import patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+import services.gemini_admission as admission_module
+from services.gemini_admission import GeminiAdmission, GeminiBusy, is_rate_limited
+from services.whatsapp_pipeline import BUSY_REPLY, build_reply
+
+
+async def call(admission, tenant, log=None, seconds=0.01, error=None):
+    async with admission.slot(tenant):
+        if log is not None:
+            log.append(tenant)
+        await asyncio.sleep(seconds)
+        if error:
+            raise error
+
+
+def test_concurrency_limit_and_fair_queuing():
+    print("--- Testing concurrency limit + per-tenant round-robin ---")
+
+    async def run():
+        admission = GeminiAdmission(max_concurrent=1, max_queue_per_tenant=50)
+        order = []
+        # The noisy tenant queues 10 calls before the quiet one sends 2
+        noisy = [asyncio.create_task(call(admission, "noisy", order)) for _ in range(10)]
+        await asyncio.sleep(0)
+        quiet = [asyncio.create_task(call(admission, "quiet", order)) for _ in range(2)]
+        await asyncio.gather(*noisy, *quiet)
+        return order, admission.stats()
+
+    order, stats = asyncio.run(run())
+    # quiet's calls alternate with noisy's instead of waiting behind all ten
+    assert order[:5] == ["noisy", "noisy", "quiet", "noisy", "quiet"], order
+    assert stats["admitted"] == 12 and stats["in_flight"] == 0 and stats["waiting"] == 0
+    print(f"SUCCESS: {order}")
+
+
+def test_bounded_queue_and_wait():
+    print("--- Testing queue bounds and max wait ---")
+
+    async def run():
+        admission = GeminiAdmission(max_concurrent=1, max_queue=2, max_queue_per_tenant=1, max_wait=0.05)
+        busy = asyncio.create_task(call(admission, "a", seconds=0.2))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(call(admission, "a"))
+        await asyncio.sleep(0)
+        other = asyncio.create_task(call(admission, "b"))
+        await asyncio.sleep(0)
+        outcomes = []
+        for tenant in ("a", "c"):  # per-tenant cap, then the global cap: rejected without waiting
+            start = time.monotonic()
+            try:
+                await call(admission, tenant)
+            except GeminiBusy as e:
+                outcomes.append((str(e), time.monotonic() - start < 0.01))
+        for task in (waiting, other):  # both outwait max_wait behind the 0.2s call
+            try:
+                await task
+            except GeminiBusy as e:
+                outcomes.append(str(e))
+        await busy
+        return outcomes, admission.stats()
+
+    outcomes, stats = asyncio.run(run())
+    assert outcomes == [("Gemini queue is full", True), ("Gemini queue is full", True),
+                        "No Gemini capacity within 0.05s", "No Gemini capacity within 0.05s"], outcomes
+    assert stats["rejected"] == 2 and stats["timeouts"] == 2 and stats["waiting"] == 0 and stats["in_flight"] == 0
+    print(f"SUCCESS: {stats}")
+
+
+def test_rate_limit_backs_off_and_recovers():
+    print("--- Testing AIMD on 429 ---")
+
+    async def run():
+        admission = GeminiAdmission(max_concurrent=8, backoff=0.1)
+        results = await asyncio.gather(
+            *(call(admission, "t", error=fakes.FakeRateLimit("429")) for _ in range(4)), return_exceptions=True
+        )
+        cut = admission.stats()
+        start = time.monotonic()
+        await call(admission, "t")  # held back until the pause ends
+        waited = time.monotonic() - start
+        for _ in range(20):
+            await call(admission, "t", seconds=0)
+        return results, cut, waited, admission.stats()
+
+    results, cut, waited, recovered = asyncio.run(run())
+    assert all(isinstance(r, GeminiBusy) for r in results)
+    # Four concurrent 429s are one signal: one cut, not four
+    assert cut["concurrency_limit"] == 4 and cut["rate_limited"] == 4
+    assert waited >= 0.08
+    assert 4 < recovered["concurrency_limit"] <= 8
+    print(f"SUCCESS: limit 8 -> {cut['concurrency_limit']} -> {recovered['concurrency_limit']}")
+
+
+def test_only_real_429s_count_as_rate_limits():
+    print("--- Testing 429 detection ---")
+
+    class ResourceExhausted(Exception):
+        pass
+
+    assert is_rate_limited(fakes.FakeRateLimit("quota")) and is_rate_limited(ResourceExhausted("quota"))
+    for error in (ValueError("upload of 4290 bytes failed"), RuntimeError("request id 8f429a: 500 internal"),
+                  ConnectionError("https://example.com/v1/429/files unreachable")):
+        assert not is_rate_limited(error), error
+
+    async def run():
+        admission = GeminiAdmission(max_concurrent=8)
+        try:
+            await call(admission, "t", error=RuntimeError("request 429ab failed"))
+        except RuntimeError:
+            pass
+        return admission.stats()
+
+    stats = asyncio.run(run())
+    assert stats["concurrency_limit"] == 8 and stats["rate_limited"] == 0
+    print("SUCCESS")
+
+
+def test_tokens_per_minute_budget():
+    print("--- Testing the tokens-per-minute budget ---")
+
+    async def run():
+        admission = GeminiAdmission(max_concurrent=8, tpm=5000, tokens_estimate=2000)
+        admission.record_usage(4000)
+        start = time.monotonic()
+        # 4000 used + 2000 estimated > 5000: waits for the usage to leave the window
+        await call(admission, "t", seconds=0)
+        return time.monotonic() - start
+
+    with patch.object(admission_module, "WINDOW", 0.2):
+        waited = asyncio.run(run())
+    assert 0.15 <= waited < 1, waited
+    print(f"SUCCESS: waited {waited * 1000:.0f} ms for budget")
+
+
+def test_burst_of_voice_notes():
+    print("--- Testing a voice-note burst against a rate-limited Gemini ---")
+
+    async def run():
+        admission = GeminiAdmission(max_concurrent=8, max_queue_per_tenant=3, max_wait=5, backoff=0.5)
+        with fakes.installed(gemini_latency=0.1, gemini_limit=4, admission=admission) as env:
+            tenant = env.db.add_tenant("+923001234567")
+            env.db.set_stock(tenant["id"], "Potato", 1000)
+            urls = [env.media.add(f"v{i}", f"10 bori aloo becha #{i}".encode()) for i in range(12)]
+            start = time.monotonic()
+            replies = await asyncio.gather(*(build_reply("whatsapp:+923001234567", url, "audio/ogg") for url in urls))
+            return replies, time.monotonic() - start, env.gemini, admission.stats()
+
+    replies, elapsed, gemini, stats = asyncio.run(run())
+    busy = replies.count(BUSY_REPLY)
+    print(f"{len(replies) - busy} answered, {busy} busy in {elapsed:.2f}s; {stats}")
+    # Calls run on worker threads (the loop is not blocked) ...
+    assert gemini.peak > 1
+    # ... the 429s cut the limit, and the per-tenant cap turns the excess away quickly
+    assert stats["rate_limited"] >= 1 and stats["concurrency_limit"] < 8
+    assert busy >= 1 and len(replies) - busy >= 4
+    # Queued notes resume when the 429 pause ends, not when a timeout fires
+    assert stats["timeouts"] == 0 and elapsed < 2, elapsed
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+if __name__ == "__main__":
+    test_concurrency_limit_and_fair_queuing()
+    test_bounded_queue_and_wait()
+    test_rate_limit_backs_off_and_recovers()
+    test_only_real_429s_count_as_rate_limits()
+    test_tokens_per_minute_budget()
+    test_burst_of_voice_notes()
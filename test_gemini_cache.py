@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+import services.gemini_voice as gv
+from services import clients
+from services.gemini_cache import ContextCache
+
+
+def make_cache(caching, version="v1", **kwargs) -> ContextCache:
+    return ContextCache(gv.GEMINI_MODEL, gv.MUNSHI_PROMPT, version,
+                        lambda cached: fakes.FakeGeminiModel(cached_content=cached), caching=caching, **kwargs)
+
+
+def test_cache_created_once_extended_and_shared():
+    print("--- Testing context cache lifecycle ---")
+    caching = fakes.FakeCaching()
+    cache = make_cache(caching, ttl=0.4, refresh=0.2)
+    model = cache.model()
+    assert model.cached_content.system_instruction == gv.MUNSHI_PROMPT
+    assert all(cache.model() is model for _ in range(100))
+    assert (caching.creates, caching.updates) == (1, 0)
+
+    # Within `refresh` of the TTL: extended in place, same cache and model
+    time.sleep(0.25)
+    assert cache.model() is model and caching.updates == 1 and not model.cached_content.expired()
+
+    # Another worker process, same prompt version: reuses the live cache
+    other = make_cache(caching, ttl=0.4, refresh=0.2)
+    assert other.model().cached_content is model.cached_content
+    assert caching.creates == 1 and other.stats()["reused"] == 1
+    # The API reports "models/<name>"; either spelling of the model matches it
+    bare = gv.GEMINI_MODEL.removeprefix("models/")
+    assert model.cached_content.model == f"models/{bare}"
+    for name in (bare, f"models/{bare}"):
+        same = ContextCache(name, gv.MUNSHI_PROMPT, "v1", lambda cached: cached, caching=caching, ttl=0.4, refresh=0.2)
+        assert same.model() is model.cached_content and caching.creates == 1, name
+    # A new prompt version never does
+    assert make_cache(caching, version="v2").model().cached_content is not model.cached_content
+    assert caching.creates == 2
+    print(f"SUCCESS: {cache.stats()}")
+
+
+def test_unavailable_cache_falls_back_then_retries():
+    print("--- Testing fallback when caching is refused ---")
+    caching = fakes.FakeCaching()
+    caching.faults.add(1, error=Exception("400 Cached content is too small"))
+    cache = make_cache(caching, retry=0.1)
+    assert cache.model() is None and cache.model() is None  # inline prompt, no hammering the API
+    assert caching.creates == 0 and cache.stats()["failures"] == 1
+    time.sleep(0.12)
+    assert cache.model() is not None and caching.creates == 1
+    assert make_cache(caching, enabled=False).model() is None
+    print("SUCCESS")
+
+
+def test_calls_use_the_cache_and_survive_its_loss():
+    print("--- Testing Gemini calls through the context cache ---")
+    caching = fakes.FakeCaching()
+    plain = fakes.FakeGeminiModel(system_instruction=gv.MUNSHI_PROMPT)
+    cache = make_cache(caching)
+
+    async def run():
+        with fakes.installed(), patch.object(gv, "model", None), patch.object(gv, "context_cache", cache), \
+             patch.dict(clients._instances, {"gemini": plain}):
+            first = await gv.process_text_message("50 bori aloo aaye")
+            cached_model = cache.model()
+            # The cache was deleted / expired server-side: answered inline, then re-registered
+            caching.caches.clear()
+            second = await gv.process_text_message("20 gaddi pyaz aaye")
+            third = await gv.process_text_message("5 bori adrak aaye")
+            return first, second, third, cached_model
+
+    first, second, third, cached_model = asyncio.run(run())
+    assert first.item_name == "Potato" and second.item_name == "Onion" and third.item_name == "Ginger"
+    assert plain.calls == 1 and caching.creates == 2
+    # Payload per call: the cache name instead of the whole prompt
+    inline, by_name = plain.payloads[0], cached_model.payloads[0]
+    assert by_name * 20 < inline, (inline, by_name)
+    print(f"SUCCESS: {inline} bytes/call inline vs {by_name} with the cache")
+
+
+def test_sdk_request_names_the_cache():
+    print("--- Testing the real SDK request shape (offline) ---")
+    cached = fakes.FakeCaching().create(gv.GEMINI_MODEL, "munshi:test", gv.MUNSHI_PROMPT,
+                                        ttl=timedelta(hours=1))
+    parts = ["**Text message from the user:** 10 bori aloo"]
+    request = gv._build_cached_model(cached)._prepare_request(contents=parts, tools=None, tool_config=None)
+    assert request.cached_content == cached.name and not request.system_instruction.parts
+    assert request.generation_config.response_mime_type == "application/json"
+    inline = gv._build_model()._prepare_request(contents=parts, tools=None, tool_config=None)
+    assert gv.MUNSHI_PROMPT in inline.system_instruction.parts[0].text
+    print(f"SUCCESS: {len(type(inline).serialize(inline))} -> {len(type(request).serialize(request))} bytes per request")
+
+
+if __name__ == "__main__":
+    test_cache_created_once_extended_and_shared()
+    test_unavailable_cache_falls_back_then_retries()
+    test_calls_use_the_cache_and_survive_its_loss()
+    test_sdk_request_names_the_cache()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+from services.idempotency import IdempotencyStore
+from services.job_queue import JobQueue
+from services.whatsapp_pipeline import process_queued_message
+
+
+def test_duplicate_sids_run_once():
+    print("--- Testing MessageSid idempotency ---")
+    store = IdempotencyStore()
+    runs = []
+
+    async def pipeline():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "Ji Boss, 50 Bori Potato aa gaye."
+
+    async def run():
+        # Twilio retry arriving while the first run is still in flight
+        first, concurrent = await asyncio.gather(store.run("SM1", pipeline), store.run("SM1", pipeline))
+        # ...and one arriving after it finished
+        later = await store.run("SM1", pipeline)
+        return first, concurrent, later
+
+    first, concurrent, later = asyncio.run(run())
+    assert first == concurrent == later == "Ji Boss, 50 Bori Potato aa gaye."
+    assert len(runs) == 1
+    assert store.stats()["duplicates"] == 2
+    print("SUCCESS: pipeline ran once for three deliveries.")
+
+
+def test_failures_are_not_remembered_and_completions_persist():
+    print("--- Testing failure retry + persistence ---")
+    path = os.path.join(tempfile.mkdtemp(), "idempotency.sqlite3")
+    store = IdempotencyStore(path=path)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("Gemini 503")
+        return "done"
+
+    async def run():
+        try:
+            await store.run("SM2", flaky)
+        except RuntimeError:
+            pass
+        return await store.run("SM2", flaky)
+
+    assert asyncio.run(run()) == "done"
+    assert len(attempts) == 2
+
+    async def never():
+        raise AssertionError("should not run after restart")
+
+    restarted = IdempotencyStore(path=path)
+    assert asyncio.run(restarted.run("SM2", never)) == "done"
+    print("SUCCESS: failed run retried; completed reply survived restart.")
+
+
+def test_failed_send_does_not_repeat_the_stock_write():
+    print("--- Testing queued message retried after a failed Twilio send ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+
+    async def run():
+        with fakes.installed() as env:
+            tenant = env.db.add_tenant("+923001234567")
+            env.twilio.faults.add(2, error=ConnectionError("refused"))
+            queue = JobQueue(path, process_queued_message, max_attempts=3, retry_delay=0)
+            form = {"From": "whatsapp:+923001234567", "To": "whatsapp:+14155238886",
+                    "Body": "50 bori aalu aaye", "MessageSid": "SMsendfail"}
+            queue.enqueue(form, message_sid="SMsendfail")
+            while await queue.run_once():
+                pass
+            # A Twilio retry of the webhook after the job finished
+            queue.enqueue(form, message_sid="SMsendfail")
+            while await queue.run_once():
+                pass
+            stock = [r["quantity"] for r in env.db.tables["inventory"] if r["tenant_id"] == tenant["id"]]
+            return stock, env.twilio.sent, queue.counts()
+
+    stock, sent, counts = asyncio.run(run())
+    assert stock == [50], stock
+    assert len(sent) == 1 and counts == {}, (sent, counts)
+    print(f"SUCCESS: stock {stock} after 3 attempts, one reply sent")
+
+
+if __name__ == "__main__":
+    test_duplicate_sids_run_once()
+    test_failures_are_not_remembered_and_completions_persist()
+    test_failed_send_does_not_repeat_the_stock_write()
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import random
+import string
+import time
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from services.item_index import ItemIndex
+
+
+def test_names_resolve_to_one_canonical_item():
+    print("--- Testing item name resolution ---")
+    index = ItemIndex()
+    index.load_tenant("t-1", ["Aalu", "Red Chilli", "Basmati Rice"])
+    cases = {
+        "Potato": "Aalu", "potatoes": "Aalu", "Aloo": "Aalu", "potatto": "Aalu",   # tenant's existing row wins
+        "Tomatoes": "Tomato", "tamaatr": "Tomato", "onoin": "Onion", "lehsn": "Garlic",
+        "red chillies": "Red Chilli", "basmti rice": "Basmati Rice",
+        "green chilli": "Green Chilli",                                            # different item, not a typo
+        "cabbages": "Cabbages",
+    }
+    for name, expected in cases.items():
+        assert index.resolve("t-1", name) == expected, (name, index.resolve("t-1", name))
+    # New item learned incrementally
+    assert index.resolve("t-1", "cabbage") == "Cabbages"
+    # Other tenants are independent
+    assert index.resolve("t-2", "Aloo") == "Potato"
+    print("SUCCESS: synonyms, plurals and typos collapse to one item.")
+
+
+def test_different_items_stay_apart():
+    print("--- Testing names that are close but not the same item ---")
+    index = ItemIndex()
+    index.load_tenant("t-1", ["Peas", "Lime", "Mango", "Mangu"])
+    # One edit away, but short names: a different commodity, not a typo
+    for name in ("Pear", "Line", "Lima"):
+        assert index.resolve("t-1", name) == name, (name, index.resolve("t-1", name))
+    # Equally close to two existing items: don't guess
+    assert index.resolve("t-1", "Mangi") == "Mangi"
+    assert index.resolve("t-1", "pears") == "Pear"
+    print("SUCCESS: pear, line and lima kept separate from peas and lime.")
+
+
+def test_lookups_do_not_register_items():
+    print("--- Testing read-only resolution ---")
+    index = ItemIndex()
+    index.load_tenant("t-1", ["Aalu"])
+    assert index.resolve("t-1", "potatoes", register=False) == "Aalu"
+    assert index.resolve("t-1", "Tomatoes", register=False) == "Tomato"
+    assert index.resolve("t-1", "dragon fruit", register=False) == "Dragon Fruit"
+    # Nothing was added: a later typo isn't pulled towards a name nobody stocks
+    assert index.resolve("t-1", "dragon fruti", register=False) == "Dragon Fruti"
+    assert index._tenants["t-1"].groups == {"Potato": "Aalu"}
+    # A write registers it
+    assert index.resolve("t-1", "dragon fruit") == "Dragon Fruit"
+    assert index.resolve("t-1", "dragon fruti") == "Dragon Fruit"
+    print("SUCCESS")
+
+
+def test_thousands_of_skus_resolve_in_microseconds():
+    rng = random.Random(7)
+    names = list({"".join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(5000)})
+    index = ItemIndex()
+    index.load_tenant("t-1", names)
+    typos = [n[:3] + n[4] + n[3] + n[5:] for n in names[:500]]
+
+    start = time.perf_counter()
+    resolved = [index.resolve("t-1", typo) for typo in typos]
+    fuzzy = (time.perf_counter() - start) / len(typos)
+    start = time.perf_counter()
+    for typo in typos:
+        index.resolve("t-1", typo)
+    cached = (time.perf_counter() - start) / len(typos)
+
+    assert resolved == names[:500]
+    print(f"{len(names)} SKUs: first (fuzzy) lookup {fuzzy * 1e6:.0f} us, repeat {cached * 1e6:.1f} us")
+    assert fuzzy < 0.005 and cached < 0.0001
+
+
+def test_agent_router_resolves_before_db():
+    import services.agent_manager as agent_manager
+    import services.item_index as item_index_module
+
+    with patch.object(item_index_module, "item_index", ItemIndex()), \
+         patch("services.db.get_item_names", AsyncMock(return_value=["Aalu"])), \
+         patch.object(agent_manager, "record_transaction", AsyncMock(return_value={"status": "success"})) as record:
+        asyncio.run(agent_manager.agent_router("t-1", {
+            "intent": "SALE", "item_name": "potatoes", "quantity": 5, "unit": "Bori", "rate": 100,
+            "buyer_name": "Imam", "is_credit": False,
+        }))
+    assert record.await_args.args[1] == "Aalu"
+
+
+if __name__ == "__main__":
+    test_names_resolve_to_one_canonical_item()
+    test_different_items_stay_apart()
+    test_lookups_do_not_register_items()
+    test_thousands_of_skus_resolve_in_microseconds()
+    test_agent_router_resolves_before_db()
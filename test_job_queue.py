@@ -0,0 +1,179 @@
+import asyncio
+import os
+import tempfile
+from unittest.mock import patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+from services.job_queue import JobQueue
+import services.whatsapp_pipeline as pipeline
+from services.idempotency import IdempotencyStore
+from services.whatsapp_pipeline import FAILED_REPLY, process_queued_message, reply_failed_message
+
+
+async def _noop(payload):
+    pass
+
+
+def test_replays_unfinished_jobs_after_crash():
+    print("--- Testing JobQueue crash recovery ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+
+    # 1. Enqueue two messages, claim one, then "crash" without finishing it
+    queue = JobQueue(path, _noop)
+    assert queue.enqueue({"From": "whatsapp:+92300", "MediaUrl0": "a"}, message_sid="SM1")
+    assert queue.enqueue({"From": "whatsapp:+92300", "MediaUrl0": "b"}, message_sid="SM2")
+    # Twilio retry of the same message is not queued twice
+    assert not queue.enqueue({"From": "whatsapp:+92300", "MediaUrl0": "a"}, message_sid="SM1")
+    assert queue._claim() is not None
+    assert queue.counts() == {"pending": 1, "running": 1}
+    queue.close()
+
+    # 2. Restart: both jobs must be processed
+    processed = []
+
+    async def handler(payload):
+        processed.append(payload["MediaUrl0"])
+
+    async def drain():
+        restarted = JobQueue(path, handler)
+        while await restarted.run_once():
+            pass
+        return restarted
+
+    restarted = asyncio.run(drain())
+    assert sorted(processed) == ["a", "b"], processed
+    assert restarted.counts() == {}
+    print("SUCCESS: unfinished jobs were replayed after restart.")
+
+
+def test_failed_jobs_are_retried_then_parked():
+    print("--- Testing JobQueue retries ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    calls = []
+
+    given_up = []
+
+    async def flaky(payload):
+        calls.append(dict(payload))
+        payload["attempt"] = len(calls)  # checkpoint, kept for the next attempt
+        raise RuntimeError("Gemini down")
+
+    async def give_up(payload):
+        given_up.append(payload)
+
+    async def run():
+        queue = JobQueue(path, flaky, max_attempts=2, retry_delay=0, on_give_up=give_up)
+        queue.enqueue({"MediaUrl0": "x"}, message_sid="SM3")
+        while await queue.run_once():
+            pass
+        return queue
+
+    queue = asyncio.run(run())
+    assert len(calls) == 2 and calls[1] == {"MediaUrl0": "x", "attempt": 1}
+    assert queue.counts() == {"failed": 1}
+    assert given_up == [{"MediaUrl0": "x", "attempt": 2}]
+    print("SUCCESS: job retried max_attempts times, parked as failed, give-up hook called.")
+
+
+def test_failed_message_still_gets_a_reply():
+    print("--- Testing the reply for a queued message that never succeeds ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+
+    async def run():
+        with fakes.installed() as env:
+            tenant = env.db.add_tenant("+923001234567")
+            queue = JobQueue(path, process_queued_message, max_attempts=2, retry_delay=0,
+                             on_give_up=reply_failed_message)
+            form = {"From": "whatsapp:+923001234567", "To": "whatsapp:+14155238886"}
+            # Gemini answers garbage every time: nothing recorded, ask to resend
+            env.gemini.faults.add(100, error=ValueError("unparseable response"))
+            queue.enqueue(dict(form, MediaUrl0=env.media.add("v", b"10 bori aloo aaye"),
+                               MessageSid="SMgarbled"), message_sid="SMgarbled")
+            while await queue.run_once():
+                pass
+            # Stock written, but Twilio refuses every send: the stored reply is retried last
+            env.twilio.faults.add(2, error=ConnectionError("refused"))
+            queue.enqueue(dict(form, Body="50 bori aalu aaye", MessageSid="SMnosend"), message_sid="SMnosend")
+            while await queue.run_once():
+                pass
+            stock = [r["quantity"] for r in env.db.tables["inventory"] if r["tenant_id"] == tenant["id"]]
+            return [m["body"] for m in env.twilio.sent], stock, queue.counts()
+
+    sent, stock, counts = asyncio.run(run())
+    assert sent[0] == FAILED_REPLY and len(sent) == 2 and "50" in sent[1], sent
+    assert stock == [50] and counts == {"failed": 2}, (stock, counts)
+    print(f"SUCCESS: {sent}")
+
+
+def test_workers_drain_queue():
+    print("--- Testing JobQueue worker pool ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    done = []
+
+    async def handler(payload):
+        await asyncio.sleep(0.01)
+        done.append(payload["n"])
+
+    async def run():
+        queue = JobQueue(path, handler, workers=4)
+        queue.start()
+        for n in range(20):
+            queue.enqueue({"n": n}, message_sid=f"SM{n}")
+        while len(done) < 20:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert sorted(done) == list(range(20))
+    assert queue.counts() == {}
+    print("SUCCESS: worker pool processed all jobs.")
+
+
+def test_crash_after_stock_write_is_not_applied_twice():
+    print("--- Testing replay of a job that crashed after its stock write ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    real_send = pipeline.send_whatsapp_message
+
+    async def crash(**kwargs):
+        # The process dies between agent_router's commit and the reply
+        raise asyncio.CancelledError()
+
+    async def run():
+        with fakes.installed() as env:
+            tenant = env.db.add_tenant("+923001234567")
+            queue = JobQueue(path, process_queued_message)
+            queue.enqueue({"From": "whatsapp:+923001234567", "To": "whatsapp:+14155238886",
+                           "Body": "50 bori aalu aaye", "MessageSid": "SMcrash"}, message_sid="SMcrash")
+            with patch("services.idempotency.idempotency_store", IdempotencyStore()), \
+                 patch.object(pipeline, "send_whatsapp_message", crash):
+                try:
+                    await queue.run_once()
+                    raise AssertionError("the crash did not happen")
+                except asyncio.CancelledError:
+                    pass
+            queue.close()
+
+            # Restart: in-memory idempotency state is gone, the job is replayed
+            with patch("services.idempotency.idempotency_store", IdempotencyStore()), \
+                 patch.object(pipeline, "send_whatsapp_message", real_send):
+                restarted = JobQueue(path, process_queued_message)
+                while await restarted.run_once():
+                    pass
+            stock = [r["quantity"] for r in env.db.tables["inventory"] if r["tenant_id"] == tenant["id"]]
+            return stock, [m["body"] for m in env.twilio.sent], restarted.counts()
+
+    stock, sent, counts = asyncio.run(run())
+    assert stock == [50] and len(sent) == 1 and "50" in sent[0] and counts == {}, (stock, sent, counts)
+    print(f"SUCCESS: stock {stock[0]} after the replay, reply sent once")
+
+
+if __name__ == "__main__":
+    test_replays_unfinished_jobs_after_crash()
+    test_failed_jobs_are_retried_then_parked()
+    test_failed_message_still_gets_a_reply()
+    test_crash_after_stock_write_is_not_applied_twice()
+    test_workers_drain_queue()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import endpoints.api as api
+import services.agent_tools as tools
+from services.agent_manager import agent_router
+from services.db import buyer_key
+
+TENANT = {"id": "tenant-ledger", "phone_number": "+923001234567"}
+HEADERS = {"X-Phone-Number": "+923001234567"}
+
+TODAY = [
+    {"item_name": "Potato", "transaction_type": "SALE", "quantity": 30, "total_amount": 15000, "tx_count": 3},
+    {"item_name": "Onion", "transaction_type": "SALE", "quantity": 10, "total_amount": 5000, "tx_count": 1},
+    {"item_name": "Potato", "transaction_type": "PURCHASE", "quantity": 100, "total_amount": 0, "tx_count": 1},
+]
+KHATA = {"buyer_name": "Rashid Bhai", "balance": 45000, "tx_count": 4, "last_credit_at": "2024-05-01T10:00:00+00:00"}
+
+
+def test_ledger_questions_read_aggregates():
+    print("--- Testing ledger QUERY sub-intents ---")
+    daily = AsyncMock(return_value=TODAY)
+    balance = AsyncMock(return_value=KHATA)
+    with patch.object(tools, "get_daily_totals", daily), patch.object(tools, "get_buyer_balance", balance), \
+         patch.object(tools, "get_inventory_item", AsyncMock()) as stock:
+        sales = asyncio.run(agent_router("t1", {"intent": "QUERY", "query_type": "DAILY_SALES"}))
+        owed = asyncio.run(agent_router("t1", {"intent": "QUERY", "query_type": "BUYER_BALANCE", "buyer_name": "rashid bhai"}))
+    assert sales["message"].startswith("Today's sales: 20,000.") and "Potato: 30" in sales["message"]
+    assert owed["message"] == "Rashid Bhai owes 45,000 (Udhaar)."
+    daily.assert_awaited_once_with("t1", item_name=None)
+    balance.assert_awaited_once_with("t1", "rashid bhai")
+    stock.assert_not_awaited()
+    assert buyer_key("  Rashid   Bhai ") == "rashid bhai"
+    print("SUCCESS:", sales["message"], "|", owed["message"])
+
+
+def test_ledger_endpoints():
+    app = FastAPI()
+    app.include_router(api.router)
+    client = TestClient(app)
+    with patch("services.auth.get_tenant_by_phone", AsyncMock(return_value=TENANT)), \
+         patch.object(api, "get_daily_totals", AsyncMock(return_value=TODAY)) as daily, \
+         patch.object(api, "get_buyer_balances", AsyncMock(return_value=[KHATA])), \
+         patch.object(api, "get_buyer_balance", AsyncMock(return_value=None)):
+        day = client.get("/api/ledger/daily?day=2024-05-01", headers=HEADERS).json()
+        khata = client.get("/api/ledger/khata", headers=HEADERS).json()
+        missing = client.get("/api/ledger/khata/Nobody", headers=HEADERS)
+    assert day["day"] == "2024-05-01" and day["sales_total"] == 20000 and day["purchases_total"] == 0
+    daily.assert_awaited_once_with(TENANT["id"], "2024-05-01")
+    assert khata["total_outstanding"] == 45000
+    assert missing.status_code == 404
+
+
+if __name__ == "__main__":
+    test_ledger_questions_read_aggregates()
+    test_ledger_endpoints()
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from services.media_fetch import MediaFetcher, MediaTooLarge
+
+# Local stand-in for Twilio media: /Media/<sid> answers with a 307 to /cdn/<sid>
+# (like api.twilio.com -> media CDN), which serves a fixed voice-note sized payload.
+
+PAYLOAD = os.urandom(48 * 1024)
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        if self.path.startswith("/Media/"):
+            self.send_response(307)
+            self.send_header("Location", self.path.replace("/Media/", "/cdn/"))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = PAYLOAD if self.path.startswith("/cdn/") else b"x" * (1024 * 1024)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/ogg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMediaServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start_fake_media_server():
+    server = FakeMediaServer(("127.0.0.1", 0), FakeMediaHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_concurrent_fetch_throughput():
+    print("--- 100 concurrent media fetches through the shared pool ---")
+    server = start_fake_media_server()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    async def run():
+        fetcher = MediaFetcher(pool_size=20)
+        try:
+            # Warm the pool, then measure
+            await fetcher.fetch(f"{base}/Media/ME0")
+            start = time.perf_counter()
+            results = await asyncio.gather(*(fetcher.fetch(f"{base}/Media/ME{i}") for i in range(100)))
+            return results, time.perf_counter() - start
+        finally:
+            await fetcher.aclose()
+
+    results, elapsed = asyncio.run(run())
+    server.shutdown()
+    total = sum(len(r) for r in results)
+    print(f"Fetched {len(results)} files ({total / 1024:.0f} KB) in {elapsed * 1000:.1f} ms "
+          f"-> {len(results) / elapsed:.0f} fetches/s, {total / elapsed / 1024 / 1024:.1f} MB/s, "
+          f"{server.connections} TCP connections")
+    assert all(r == PAYLOAD for r in results)
+    # Keep-alive: connections are bounded by the pool, not one per fetch (+redirect)
+    assert server.connections <= 20
+
+
+def test_size_cap():
+    print("--- Media size cap ---")
+    server = start_fake_media_server()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    async def run():
+        fetcher = MediaFetcher(max_bytes=64 * 1024)
+        try:
+            await fetcher.fetch(f"{base}/big")
+        finally:
+            await fetcher.aclose()
+
+    try:
+        asyncio.run(run())
+        raise AssertionError("expected MediaTooLarge")
+    except MediaTooLarge as e:
+        print(f"SUCCESS: {e}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_concurrent_fetch_throughput()
+    test_size_cap()
@@ -0,0 +1,93 @@
+import asyncio
+import io
+import os
+import time
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from PIL import Image
+
+import fakes
+from services.media_preprocess import preprocess_image
+from services.gemini_voice import media_mime_type, process_media_url
+
+
+def test_camera_photo_downscaled_upright_grayscale():
+    print("--- Testing receipt photo preprocessing ---")
+    photo = fakes.receipt_photo(orientation=6)  # 4000x3000, stored sideways
+    out, mime_type = preprocess_image(photo, "image/jpeg")
+    image = Image.open(io.BytesIO(out))
+    assert mime_type == "image/jpeg" and image.format == "JPEG" and image.mode == "L"
+    # Rotated upright (portrait) and the long side capped
+    assert image.size == (1200, 1600), image.size
+    # Orientation 6 = rotate 90 clockwise: the stored top-left corner is now top-right
+    assert image.getpixel((1190, 10)) < 40 and image.getpixel((10, 10)) > 100
+    assert len(out) * 8 < len(photo), (len(photo), len(out))
+    print(f"SUCCESS: {len(photo) // 1024} KB -> {len(out) // 1024} KB")
+
+
+def test_small_broken_and_png_images():
+    print("--- Testing images that need no / can't get preprocessing ---")
+    small = io.BytesIO()
+    Image.new("L", (800, 600), 200).save(small, "JPEG")
+    small = small.getvalue()
+    assert preprocess_image(small, "image/jpeg") == (small, "image/jpeg")
+
+    assert preprocess_image(b"not an image", "image/webp") == (b"not an image", "image/webp")
+
+    # A large screenshot: converted to a grayscale JPEG
+    png = io.BytesIO()
+    Image.effect_noise((2400, 1080), 30).convert("RGB").save(png, "PNG")
+    out, mime_type = preprocess_image(png.getvalue(), "image/png")
+    assert mime_type == "image/jpeg" and Image.open(io.BytesIO(out)).size == (1600, 720)
+    print("SUCCESS: small JPEG and unreadable bytes untouched, PNG converted")
+
+
+def test_mime_type_passed_through():
+    print("--- Testing MediaContentType0 -> Gemini MIME type ---")
+    assert media_mime_type("audio/ogg; codecs=opus") == "audio/ogg"
+    assert media_mime_type("image/png") == "image/png"
+    assert media_mime_type("audio/amr") == "audio/amr"
+    assert media_mime_type(None) == "audio/ogg" and media_mime_type("image") == "image/jpeg"
+    print("SUCCESS")
+
+
+def test_pipeline_sends_preprocessed_image_without_blocking():
+    print("--- Testing the image path end to end ---")
+
+    async def run():
+        with fakes.installed() as env:
+            photos = [env.media.add(f"p{i}", fakes.receipt_photo(seed=i), "image/jpeg") for i in range(3)]
+            voice = env.media.add("v", b"10 bori aloo aaye")
+
+            # The event loop keeps ticking while the photos are processed
+            gaps, done = [], asyncio.Event()
+
+            async def ticker():
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.005)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            tick = asyncio.create_task(ticker())
+            await asyncio.gather(*(process_media_url(url, "image/jpeg") for url in photos))
+            done.set()
+            await tick
+            await process_media_url(voice, "audio/ogg; codecs=opus")
+            return env.gemini.media, max(gaps)
+
+    media, worst_gap = asyncio.run(run())
+    assert [m for m, _ in media] == ["image/jpeg"] * 3 + ["audio/ogg"]
+    assert all(size < 600 * 1024 for _, size in media[:3]), media
+    assert worst_gap < 0.05, worst_gap
+    print(f"SUCCESS: sent {[size // 1024 for _, size in media[:3]]} KB, worst loop stall {worst_gap * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    test_camera_photo_downscaled_upright_grayscale()
+    test_small_broken_and_png_images()
+    test_mime_type_passed_through()
+    test_pipeline_sends_preprocessed_image_without_blocking()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import time
+from unittest.mock import MagicMock, AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from fastapi.testclient import TestClient
+
+import main
+import services.db as db
+from services import metrics
+from services.idempotency import IdempotencyStore
+from services.item_index import item_index
+from services.tenant_cache import TenantCache
+
+
+def _mock_supabase():
+    client = MagicMock()
+    tenants = client.table.return_value.select.return_value.eq.return_value
+    tenants.execute = AsyncMock(return_value=MagicMock(data=[{"id": "t-metrics", "phone_number": "+923001234567"}]))
+    tenants.eq.return_value.execute = AsyncMock(
+        return_value=MagicMock(data=[{"id": 1, "item_name": "Potato", "quantity": 40, "unit": "kg"}])
+    )
+    return client
+
+
+def test_webhook_stages_show_up_on_metrics(capsys):
+    print("--- Testing per-stage metrics and trace ids ---")
+    metrics.reset()
+    item_index.load_tenant("t-metrics", ["Potato"])
+    with patch.object(db, "supabase", _mock_supabase()), patch.object(db, "tenant_cache", TenantCache()), \
+         patch("services.idempotency.idempotency_store", IdempotencyStore()):
+        client = TestClient(main.app)
+        response = client.post("/whatsapp/webhook", data={
+            "From": "whatsapp:+923001234567", "Body": "aloo kitna hai", "MessageSid": "SMtrace123",
+        })
+        assert response.status_code == 200 and "40 kg of Potato" in response.text
+        text = client.get("/metrics").text
+
+    for stage in ("webhook", "text.parse", "db.get_tenant_by_phone", "agent_manager.agent_router",
+                  "db.get_inventory_item"):
+        assert f'mandi_stage_duration_seconds_count{{stage="{stage}"}} 1' in text, stage
+    assert 'mandi_stage_in_flight{stage="webhook"} 0' in text
+    assert 'mandi_messages_total{intent="QUERY",outcome="success"} 1' in text
+    assert "[SMtrace123] Received message from whatsapp:+923001234567" in capsys.readouterr().out
+    print("SUCCESS: every stage timed, log lines carry the MessageSid")
+
+
+def test_gemini_tokens_and_errors_are_counted():
+    print("--- Testing Gemini token counters ---")
+    import services.gemini_voice as gv
+    from services.extraction_cache import ExtractionCache
+
+    metrics.reset()
+    model = MagicMock()
+    model.generate_content.return_value.text = '{"intent": "QUERY", "item_name": "Onion"}'
+    model.generate_content.return_value.usage_metadata = MagicMock(prompt_token_count=1200, candidates_token_count=35)
+    with patch.object(gv, "model", model), patch.object(gv, "extraction_cache", ExtractionCache()):
+        asyncio.run(gv.process_text_message("pyaz ka kya haal hai bhai"))
+        model.generate_content.side_effect = RuntimeError("quota")
+        try:
+            asyncio.run(gv.process_text_message("kuch aur"))
+        except RuntimeError:
+            pass
+
+    text = metrics.render()
+    assert 'mandi_gemini_tokens_total{kind="prompt"} 1200' in text
+    assert 'mandi_gemini_tokens_total{kind="output"} 35' in text
+    assert 'mandi_stage_duration_seconds_count{stage="gemini.generate"} 2' in text
+    assert 'mandi_stage_errors_total{stage="gemini.generate"} 1' in text
+    print("SUCCESS: tokens and failures recorded")
+
+
+def test_component_stats_types_and_reset_mid_span():
+    print("--- Testing counter/gauge types and reset() with open spans ---")
+    text = metrics.render({"tenant_cache": {"hits": 7, "hit_rate": 0.5, "size": 3},
+                           "circuit_db": {"state": 2, "opened": 1}})
+    assert "# TYPE mandi_tenant_cache_hits_total counter\nmandi_tenant_cache_hits_total 7" in text
+    assert "# TYPE mandi_tenant_cache_hit_rate gauge\nmandi_tenant_cache_hit_rate 0.5" in text
+    assert "# TYPE mandi_circuit_db_state gauge" in text and "mandi_circuit_db_opened_total 1" in text
+    assert "mandi_tenant_cache_hits " not in text
+
+    metrics.reset()
+    with metrics.span("test.open"):
+        metrics.reset()
+        assert 'mandi_stage_in_flight{stage="test.open"} 1' in metrics.render()
+    assert 'mandi_stage_in_flight{stage="test.open"} 0' in metrics.render()
+    print("SUCCESS")
+
+
+def test_span_overhead_is_microseconds():
+    print("--- Measuring span overhead ---")
+    n = 100_000
+    start = time.perf_counter()
+    for _ in range(n):
+        with metrics.span("bench.noop"):
+            pass
+    per_span = (time.perf_counter() - start) / n * 1e6
+    print(f"SUCCESS: {per_span:.2f} us per span")
+    assert per_span < 5
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main(["-q", __file__]))
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import httpx
+
+import fakes
+from services import resilience, metrics
+from services.resilience import CircuitBreaker, CircuitOpen, Dependency
+from services.db import get_tenant_by_phone, add_inventory_log
+from services.whatsapp_pipeline import BUSY_REPLY, build_reply, send_whatsapp_message
+
+PHONE = "+923001234567"
+
+
+class ServiceUnavailable(Exception):
+    """google.api_core's HTTP 503."""
+    code = 503
+
+
+class Flaky:
+    """Coroutine function failing with `errors` in turn before succeeding."""
+
+    def __init__(self, *errors, hang: float = 0.0):
+        self.errors = list(errors)
+        self.hang = hang
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.hang and self.calls == 1:
+            await asyncio.sleep(self.hang)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def fast(name="dep", timeout=1.0, deadline=2.0, retries=2, failures=5, reset=0.2) -> Dependency:
+    return Dependency(name, timeout, deadline, retries, base_delay=0.01, max_delay=0.02,
+                      breaker=CircuitBreaker(name, failures=failures, reset=reset))
+
+
+def outcome(coro):
+    try:
+        return asyncio.run(coro)
+    except Exception as e:
+        return type(e).__name__
+
+
+def test_retry_policy():
+    print("--- Testing retries: transient, idempotent only ---")
+    dep = fast()
+    flaky = Flaky(httpx.ConnectError("reset"), ServiceUnavailable("503"))
+    assert outcome(dep.call(flaky, idempotent=True)) == "ok" and flaky.calls == 3 and dep.retried == 2
+
+    # Out of retries: the last error comes through
+    flaky = Flaky(*[ConnectionError("down")] * 3)
+    assert outcome(dep.call(flaky, idempotent=True)) == "ConnectionError" and flaky.calls == 3
+
+    # A write whose response was lost may have landed: never repeated
+    flaky = Flaky(httpx.ReadTimeout("lost"))
+    assert outcome(dep.call(flaky)) == "ReadTimeout" and flaky.calls == 1
+
+    # The dependency answered (4xx, 429, bad input): not retried, not a breaker failure
+    for error in (ValueError("bad"), fakes.FakeRateLimit("429"), httpx.HTTPStatusError("404", request=None, response=None)):
+        flaky = Flaky(error)
+        assert outcome(dep.call(flaky, idempotent=True)) == type(error).__name__ and flaky.calls == 1
+    assert dep.breaker.failures == 0
+    print(f"SUCCESS: {dep.stats()}")
+
+
+def test_deadlines():
+    print("--- Testing per-attempt timeout and call deadline ---")
+    dep = fast(timeout=0.05, deadline=1.0)
+    hung = Flaky(hang=5)
+    start = time.monotonic()
+    assert outcome(dep.call(hung, idempotent=True)) == "ok"  # first attempt cut off, retry answers
+    assert hung.calls == 2 and dep.timeouts == 1 and time.monotonic() - start < 0.5
+
+    # However many retries are allowed, the whole call stops at the deadline
+    dep = fast(timeout=0.05, deadline=0.2, retries=100)
+    attempts = []
+
+    async def always_hangs():
+        attempts.append(1)
+        await asyncio.sleep(5)
+
+    start = time.monotonic()
+    assert outcome(dep.call(always_hangs, idempotent=True)) == "TimeoutError"
+    elapsed = time.monotonic() - start
+    assert elapsed < 0.35 and 2 <= len(attempts) <= 4, (elapsed, attempts)
+    print(f"SUCCESS: gave up after {len(attempts)} attempts in {elapsed * 1000:.0f} ms")
+
+
+def test_circuit_breaker():
+    print("--- Testing circuit breaker open / half-open / close ---")
+    dep = fast(retries=0, failures=3, reset=0.1)
+    down = Flaky(*[ServiceUnavailable("503")] * 4)
+
+    async def run():
+        for _ in range(3):
+            try:
+                await dep.call(down)
+            except ServiceUnavailable:
+                pass
+        assert dep.breaker.state == resilience.OPEN
+        # Open: fails fast without calling the dependency
+        start = time.monotonic()
+        for _ in range(100):
+            try:
+                await dep.call(down)
+            except CircuitOpen:
+                pass
+        assert down.calls == 3 and time.monotonic() - start < 0.05
+
+        # After the reset timeout one probe goes through; it fails: open again
+        await asyncio.sleep(0.12)
+        results = await asyncio.gather(dep.call(down), dep.call(down), return_exceptions=True)
+        assert [type(r).__name__ for r in results] == ["ServiceUnavailable", "CircuitOpen"]
+        assert dep.breaker.state == resilience.OPEN and down.calls == 4
+
+        # Next probe succeeds: closed
+        await asyncio.sleep(0.12)
+        assert await dep.call(down) == "ok"
+        assert dep.breaker.state == resilience.CLOSED
+
+    asyncio.run(run())
+    stats = dep.stats()
+    assert stats["opened"] == 2 and stats["rejected"] == 101 and stats["state"] == 0
+    print(f"SUCCESS: {stats}")
+
+
+def test_faults_through_the_pipeline():
+    print("--- Testing injected outages end to end ---")
+
+    async def run():
+        with fakes.installed() as env:
+            deps = resilience.dependencies
+            for name in ("db", "gemini", "media"):
+                deps[name] = fast(name, failures=3, reset=30)
+            deps["twilio"] = fast("twilio", retries=0)
+            tenant = env.db.add_tenant(PHONE)
+            env.db.set_stock(tenant["id"], "Potato", 100)
+
+            # A dropped connection on a read is retried
+            env.db.faults.add(1, error=httpx.ConnectError("connection reset"))
+            assert (await get_tenant_by_phone(PHONE))["id"] == tenant["id"]
+            # ... a stock delta is not (it may have been applied)
+            env.db.faults.add(1, error=httpx.ReadTimeout("timed out"))
+            try:
+                await add_inventory_log(tenant["id"], "Potato", 5, "kg", "IN")
+                raise AssertionError("write was retried")
+            except httpx.ReadTimeout:
+                pass
+
+            # A 503 from the media host and a Gemini 503 are both ridden out
+            env.media.faults.add(1, error=503)
+            env.gemini.faults.add(1, error=ServiceUnavailable("503 unavailable"))
+            url = env.media.add("v1", b"10 bori aloo aaye")
+            assert "10" in await build_reply(f"whatsapp:{PHONE}", url, "audio/ogg")
+            assert env.media.faults.injected == 1 and env.gemini.faults.injected == 1
+
+            # Gemini down hard: the circuit opens and later messages fail fast
+            env.gemini.faults.add(100, error=ServiceUnavailable("503 unavailable"))
+            calls = env.gemini.calls
+            try:
+                await build_reply(f"whatsapp:{PHONE}", env.media.add("x", b"1 bori aloo"), "audio/ogg")
+                raise AssertionError("Gemini outage not reported")
+            except ServiceUnavailable:
+                pass
+            assert env.gemini.calls == calls + 3 and deps["gemini"].breaker.state == resilience.OPEN
+            calls = env.gemini.calls
+            start = time.monotonic()
+            assert await build_reply(f"whatsapp:{PHONE}", env.media.add("y", b"2 bori aloo"), "audio/ogg") == BUSY_REPLY
+            assert env.gemini.calls == calls and time.monotonic() - start < 0.5
+            gauges = metrics.render({"circuit_gemini": deps["gemini"].stats()})
+            assert "mandi_circuit_gemini_state 2" in gauges
+
+            # Twilio: one attempt only
+            env.twilio.faults.add(1, error=ConnectionError("refused"))
+            try:
+                await send_whatsapp_message(f"whatsapp:{PHONE}", "whatsapp:+14155238886", "hi")
+                raise AssertionError("send was retried")
+            except ConnectionError:
+                pass
+            assert env.twilio.sent == []
+
+    asyncio.run(run())
+    print("SUCCESS: blips retried, writes and sends not, a dead Gemini fails fast")
+
+
+if __name__ == "__main__":
+    test_retry_policy()
+    test_deadlines()
+    test_circuit_breaker()
+    test_faults_through_the_pipeline()
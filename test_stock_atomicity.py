@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import services.db as db
+
+# Local stand-in for the PostgREST RPC endpoints from models/schema.sql.
+# Each request runs on its own server thread with its own SQLite connection and
+# executes the same single-statement upsert as apply_stock_delta, so the test
+# exercises real concurrency between the async client and the database.
+
+UPSERT_SQL = """
+    INSERT INTO inventory (tenant_id, item_name, quantity, unit) VALUES (?, ?, ?, COALESCE(?, 'kg'))
+    ON CONFLICT (tenant_id, item_name) DO UPDATE
+        SET quantity = inventory.quantity + excluded.quantity, unit = COALESCE(excluded.unit, inventory.unit)
+    RETURNING quantity
+"""
+
+
+class FakeRpcHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        fn = self.path.rsplit("/", 1)[-1]
+        conn = sqlite3.connect(self.server.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if fn == "apply_stock_batch":
+                result = self._apply_batch(conn, params)
+                conn.execute("COMMIT")
+                return self._reply(result)
+            if fn == "apply_stock_delta":
+                delta = params["p_delta"]
+            else:
+                delta = params["p_quantity"] if params["p_transaction_type"] == "PURCHASE" else -params["p_quantity"]
+            new_qty = conn.execute(
+                UPSERT_SQL, (params["p_tenant_id"], params["p_item_name"], delta, params["p_unit"])
+            ).fetchone()[0]
+            if fn == "record_stock_transaction":
+                conn.execute(
+                    "INSERT INTO transactions (tenant_id, item_name, quantity) VALUES (?, ?, ?)",
+                    (params["p_tenant_id"], params["p_item_name"], params["p_quantity"]),
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        self._reply(new_qty)
+
+    def _apply_batch(self, conn, params):
+        # Same shape as apply_stock_batch: ledger rows in bulk, then per-item deltas in name order
+        lines = params["p_lines"]
+        conn.executemany(
+            "INSERT INTO transactions (tenant_id, item_name, quantity) VALUES (?, ?, ?)",
+            [(params["p_tenant_id"], l["item_name"], l["quantity"]) for l in lines if l["transaction_type"]],
+        )
+        deltas = {}
+        for line in lines:
+            deltas[line["item_name"]] = deltas.get(line["item_name"], 0) + line["delta"]
+        return [
+            {"item": name, "new_qty": conn.execute(UPSERT_SQL, (params["p_tenant_id"], name, delta, None)).fetchone()[0]}
+            for name, delta in sorted(deltas.items())
+        ]
+
+    def _reply(self, result):
+        self.server.calls += 1
+        body = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeRpcServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_fake_postgrest():
+    db_path = os.path.join(tempfile.mkdtemp(), "stock.sqlite3")
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE inventory (tenant_id TEXT, item_name TEXT, quantity REAL, unit TEXT, UNIQUE (tenant_id, item_name))")
+    conn.execute("CREATE TABLE transactions (tenant_id TEXT, item_name TEXT, quantity REAL)")
+    conn.commit()
+    conn.close()
+
+    server = FakeRpcServer(("127.0.0.1", 0), FakeRpcHandler)
+    server.db_path = db_path
+    server.calls = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _stock(server, tenant_id, item_name):
+    conn = sqlite3.connect(server.db_path)
+    row = conn.execute(
+        "SELECT quantity FROM inventory WHERE tenant_id = ? AND item_name = ?", (tenant_id, item_name)
+    ).fetchone()
+    tx_count = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    conn.close()
+    return row[0], tx_count
+
+
+def test_parallel_deltas_are_exact():
+    print("--- Hammering one (tenant, item) with parallel IN/OUT deltas ---")
+    server = start_fake_postgrest()
+    rng = random.Random(42)
+    moves = [(rng.choice(["IN", "OUT"]), rng.randint(1, 50)) for _ in range(200)]
+    sales = [rng.randint(1, 10) for _ in range(50)]
+
+    async def hammer():
+        db.supabase = db.create_db_client(f"http://127.0.0.1:{server.server_address[1]}", "test-key")
+        try:
+            updates = [db.add_inventory_log("tenant-1", "Potato", qty, "Bori", action) for action, qty in moves]
+            txs = [db.record_transaction("tenant-1", "Potato", qty, "Bori", "SALE", 100, "Rashid Bhai") for qty in sales]
+            return await asyncio.gather(*updates, *txs)
+        finally:
+            await db.close_db()
+
+    results = asyncio.run(hammer())
+    expected = sum(qty if action == "IN" else -qty for action, qty in moves) - sum(sales)
+    final_qty, tx_count = _stock(server, "tenant-1", "Potato")
+    server.shutdown()
+
+    print(f"Final stock: {final_qty} (Expected: {expected}), transactions: {tx_count}")
+    assert final_qty == expected
+    assert tx_count == len(sales)
+    assert all(r["status"] == "success" for r in results[len(moves):])
+    print("SUCCESS: no update was lost.")
+
+
+def test_multi_item_message_is_one_round_trip():
+    print("--- Applying multi-item messages as batches ---")
+    from services.agent_manager import agent_router
+    from services.item_index import item_index
+
+    server = start_fake_postgrest()
+    item_index.load_tenant("tenant-batch", [])
+    receipt = {
+        "intent": "SALE", "buyer_name": "Rashid Bhai", "is_credit": True, "unit": "Bori",
+        "items": [
+            {"item_name": "Potato", "quantity": 10, "rate": 500},
+            {"item_name": "Onion", "quantity": 5, "unit": "Gaddi", "rate": 300},
+            {"item_name": "Tomato", "quantity": 2, "rate": 800},
+        ],
+    }
+    arrival = {
+        "intent": "UPDATE", "action": "IN",
+        "items": [{"item_name": "aalu", "quantity": 50, "unit": "Bori"}, {"item_name": "pyaz", "quantity": 20}],
+    }
+
+    async def run():
+        db.supabase = db.create_db_client(f"http://127.0.0.1:{server.server_address[1]}", "test-key")
+        try:
+            first = await agent_router("tenant-batch", arrival)
+            # Parallel receipts must not lose updates either
+            sales = await asyncio.gather(*(agent_router("tenant-batch", receipt) for _ in range(5)))
+            return first, sales
+        finally:
+            await db.close_db()
+
+    first, sales = asyncio.run(run())
+    potato, tx_count = _stock(server, "tenant-batch", "Potato")
+    onion, _ = _stock(server, "tenant-batch", "Onion")
+    tomato, _ = _stock(server, "tenant-batch", "Tomato")
+    server.shutdown()
+
+    assert first["new_qty"] == {"Onion": 20, "Potato": 50}
+    assert all(s["status"] == "success" and "Total: 8,100" in s["message"] for s in sales)
+    assert (potato, onion, tomato) == (0, -5, -10)
+    assert tx_count == 15
+    assert server.calls == 6
+    print(f"SUCCESS: {first['message']} | 6 messages, {server.calls} round trips")
+
+
+if __name__ == "__main__":
+    test_parallel_deltas_are_exact()
+    test_multi_item_message_is_one_round_trip()
@@ -0,0 +1,251 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import fakes
+import services.db as db
+from services import resilience
+from services.sqlite_store import SQLiteClient, StorageBusy, logic_tree_sql
+
+# One storage contract, run against every backend services/db.py can sit on:
+#   memory    FakeSupabase, the in-memory PostgREST stand-in (always)
+#   sqlite    the embedded engine, DB_BACKEND=sqlite (always)
+#   supabase  a live project with schema.sql applied, only when
+#             STORAGE_TEST_SUPABASE_URL / STORAGE_TEST_SUPABASE_KEY are set
+#             (rows are written under fresh random phone numbers and left behind)
+LIVE_URL = os.getenv("STORAGE_TEST_SUPABASE_URL")
+LIVE_KEY = os.getenv("STORAGE_TEST_SUPABASE_KEY")
+BACKENDS = ["memory", "sqlite"] + (["supabase"] if LIVE_URL and LIVE_KEY else [])
+
+
+def make_client(name: str):
+    if name == "sqlite":
+        return SQLiteClient(os.path.join(tempfile.mkdtemp(), "mandi.sqlite3"))
+    if name == "supabase":
+        return db.create_db_client(LIVE_URL, LIVE_KEY)
+    return fakes.FakeSupabase()
+
+
+@contextmanager
+def on_backend(name: str):
+    with fakes.installed(db_client=make_client(name)) as env:
+        yield env
+
+
+def phone() -> str:
+    return "+92300" + str(uuid.uuid4().int)[:7]
+
+
+def run_contract(contract):
+    for name in BACKENDS:
+        print(f"  [{name}]")
+
+        async def run():
+            with on_backend(name):
+                try:
+                    await contract()
+                finally:
+                    await db.get_client().aclose()
+        asyncio.run(run())
+
+
+def test_tenants_and_stock():
+    print("--- Testing tenants and stock on every backend ---")
+
+    async def contract():
+        number = phone()
+        tenant = await db.create_tenant(number, "Contract Mandi")
+        assert tenant["phone_number"] == number and tenant["id"]
+        assert (await db.get_tenant_by_phone(number))["id"] == tenant["id"]
+        assert await db.create_tenant(number) is None  # phone_number is unique
+        assert await db.get_tenant_by_phone(phone()) is None
+
+        t = tenant["id"]
+        assert await db.add_inventory_log(t, "Potato", 100, "Bori", "IN") == 100
+        assert await db.add_inventory_log(t, "Potato", 30, None, "OUT") == 70
+        await db.add_inventory_log(t, "Onion", 5, None, "IN")
+        # Concurrent increments of one item never lose an update
+        await asyncio.gather(*(db.add_inventory_log(t, "Tomato", 1, "kg", "IN") for _ in range(40)))
+
+        potato = await db.get_inventory_item(t, "Potato")
+        assert potato["quantity"] == 70 and potato["unit"] == "Bori"
+        onion = await db.get_inventory_item(t, "Onion")
+        assert onion["unit"] == "kg"  # column default
+        assert (await db.get_inventory_item(t, "Tomato"))["quantity"] == 40
+        assert await db.get_inventory_item(t, "Garlic") is None
+        assert sorted(await db.get_item_names(t)) == ["Onion", "Potato", "Tomato"]
+        inventory = await db.get_inventory(t)
+        assert sorted(r["item_name"] for r in inventory) == ["Onion", "Potato", "Tomato"]
+        assert set(inventory[0]) == set(db.INVENTORY_COLUMNS.split(","))
+
+        names = await db.get_all_item_names(page_size=2)
+        assert {(t, "Onion"), (t, "Potato"), (t, "Tomato")} <= {(r["tenant_id"], r["item_name"]) for r in names}
+
+        assert await db.update_inventory_item(onion["id"], {"quantity": 12}) == {"status": "success"}
+        assert (await db.get_inventory_item(t, "Onion"))["quantity"] == 12
+        assert await db.delete_inventory_item(onion["id"]) == {"status": "success"}
+        assert await db.get_inventory_item(t, "Onion") is None
+
+    run_contract(contract)
+    print("SUCCESS: same tenant/stock behaviour on " + ", ".join(BACKENDS))
+
+
+def test_transactions_and_ledger():
+    print("--- Testing transactions and ledger aggregates on every backend ---")
+
+    async def contract():
+        t = (await db.create_tenant(phone()))["id"]
+        await db.add_inventory_log(t, "Potato", 100, "kg", "IN")
+        sale = await db.record_transaction(t, "Potato", 10, "kg", "SALE", rate=200,
+                                           buyer_name=" Rashid  Bhai", is_credit=True)
+        assert sale == {"status": "success", "new_qty": 90, "total_amount": 2000.0}
+        await db.record_transaction(t, "Potato", 5, "kg", "SALE", rate=100, buyer_name="rashid bhai", is_credit=True)
+        await db.record_transaction(t, "Potato", 20, "kg", "PURCHASE", rate=50)
+        bad = await db.record_transaction(t, "Potato", 1, "kg", "GIFT")
+        assert bad["status"] == "error"
+
+        assert (await db.get_inventory_item(t, "Potato"))["quantity"] == 105
+        recent = await db.get_recent_transactions(t)
+        assert [r["transaction_type"] for r in recent] == ["PURCHASE", "SALE", "SALE"]
+        assert recent[1]["is_credit"] is True and recent[0]["is_credit"] is False
+
+        balance = await db.get_buyer_balance(t, "rashid")  # unique prefix match
+        assert balance["balance"] == 2500 and balance["tx_count"] == 2
+        assert [b["buyer_name"] for b in await db.get_buyer_balances(t)] == ["Rashid  Bhai"]
+        totals = {r["transaction_type"]: r for r in await db.get_daily_totals(t, item_name="Potato")}
+        assert totals["SALE"]["quantity"] == 15 and totals["SALE"]["total_amount"] == 2500
+        assert totals["PURCHASE"]["tx_count"] == 1
+
+        # Corrections flow into the aggregates (ledger trigger)
+        first_sale = recent[2]
+        assert await db.update_transaction(first_sale["id"], {"total_amount": 1800}) == {"status": "success"}
+        assert (await db.get_buyer_balance(t, "Rashid Bhai"))["balance"] == 2300
+        assert await db.delete_transaction(recent[1]["id"]) == {"status": "success"}
+        after = await db.get_buyer_balance(t, "rashid bhai")
+        assert after["balance"] == 1800 and after["tx_count"] == 1
+
+        assert await db.rebuild_ledger_aggregates(t) == 2
+        assert (await db.get_buyer_balance(t, "rashid bhai"))["balance"] == 1800
+        rebuilt = {r["transaction_type"]: r for r in await db.get_daily_totals(t)}
+        assert rebuilt["SALE"]["quantity"] == 10 and rebuilt["PURCHASE"]["quantity"] == 20
+
+    run_contract(contract)
+    print("SUCCESS: same RPC and ledger behaviour on " + ", ".join(BACKENDS))
+
+
+def test_batches_and_history_paging():
+    print("--- Testing stock batches and keyset paging on every backend ---")
+
+    async def contract():
+        t = (await db.create_tenant(phone()))["id"]
+        lines = [
+            {"item_name": "Onion", "quantity": 50, "unit": "kg", "transaction_type": "PURCHASE"},
+            {"item_name": "Onion", "quantity": 4, "transaction_type": "SALE", "rate": 10,
+             "buyer_name": "Imam_Din", "is_credit": True},
+            {"item_name": "Garlic", "quantity": 3, "action": "IN"},
+        ]
+        first = await db.apply_stock_batch(t, lines, batch_id=f"batch-{uuid.uuid4()}")
+        assert first == {"Garlic": 3, "Onion": 46}
+        batch_id = f"batch-{uuid.uuid4()}"
+        again = [{"item_name": "Garlic", "quantity": 1, "action": "OUT"}]
+        assert await db.apply_stock_batch(t, again, batch_id=batch_id) == {"Garlic": 2}
+        assert await db.apply_stock_batch(t, again, batch_id=batch_id) == {"Garlic": 2}  # retry is a no-op
+        assert await db.apply_stock_batch(t, again) == {"Garlic": 1}
+
+        for i in range(7):
+            await db.record_transaction(t, "Tomato", i + 1, "kg", "PURCHASE")
+        seen, cursor = [], None
+        while True:
+            page = await db.get_transactions_page(t, limit=3, cursor=cursor)
+            seen += page["transactions"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert len(seen) == 9 and len({r["id"] for r in seen}) == 9
+        keys = [(r["created_at"], str(r["id"])) for r in seen]
+        assert keys == sorted(keys, reverse=True)
+
+        credit = await db.get_transactions_page(t, credit_only=True)
+        assert [r["buyer_name"] for r in credit["transactions"]] == ["Imam_Din"]
+        # '_' in the search is literal, and the match ignores case
+        assert len((await db.get_transactions_page(t, buyer_name="imam_d"))["transactions"]) == 1
+        assert (await db.get_transactions_page(t, buyer_name="imamXd"))["transactions"] == []
+        tomatoes = await db.get_transactions_page(t, item_name="Tomato", limit=100)
+        assert [r["quantity"] for r in tomatoes["transactions"]] == [7, 6, 5, 4, 3, 2, 1]
+        assert (await db.get_transactions_page(t, since="2999-01-01"))["transactions"] == []
+
+    run_contract(contract)
+    print("SUCCESS: same batch and paging behaviour on " + ", ".join(BACKENDS))
+
+
+def test_sqlite_logic_tree_compiles_to_parameters():
+    print("--- Testing the PostgREST logic tree -> SQL translation ---")
+    sql, params = logic_tree_sql('created_at.lt."2024-01-01T00:00:00+00:00",and(created_at.eq."a,b",id.lt."x\\"y")')
+    assert sql == "(created_at < ? OR (created_at = ? AND id < ?))", sql
+    assert params == ["2024-01-01T00:00:00+00:00", "a,b", 'x"y']
+    assert logic_tree_sql("created_at.lt.1;drop table tenants") == ("(created_at < ?)", ["1;drop table tenants"])
+    try:
+        SQLiteClient(":memory:").table("tenants").select("id; drop table tenants")
+        raise AssertionError("identifier was not validated")
+    except ValueError:
+        pass
+    print("SUCCESS: values are bound, identifiers validated")
+
+
+def test_sqlite_lock_held_elsewhere_never_stalls_the_loop():
+    print("--- Testing SQLite write lock held by another process ---")
+    client = make_client("sqlite")
+
+    async def run():
+        with fakes.installed(db_client=client):
+            t = (await db.create_tenant(phone()))["id"]
+            other = sqlite3.connect(client.path, isolation_level=None)
+            gaps, done = [], asyncio.Event()
+
+            async def ticker():
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.002)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            tick = asyncio.create_task(ticker())
+            # Released while the write is backing off: it goes through on a retry
+            other.execute("BEGIN IMMEDIATE")
+            asyncio.get_running_loop().call_later(0.05, other.execute, "COMMIT")
+            assert await db.add_inventory_log(t, "Potato", 10, "Bori", "IN") == 10
+            # Held for good: the write fails, reads (WAL) are unaffected, the circuit stays closed
+            other.execute("BEGIN IMMEDIATE")
+            try:
+                await db.add_inventory_log(t, "Potato", 5, "Bori", "IN")
+                raise AssertionError("write went through a held lock")
+            except StorageBusy:
+                pass
+            assert (await db.get_inventory_item(t, "Potato"))["quantity"] == 10
+            other.execute("COMMIT")
+            done.set()
+            await tick
+            other.close()
+            await client.aclose()
+            return max(gaps), resilience.dependencies["db"].stats()
+
+    worst_gap, stats = asyncio.run(run())
+    assert worst_gap < 0.05, worst_gap
+    assert stats["state"] == 0 and stats["consecutive_failures"] == 0 and stats["retried"] >= 1, stats
+    print(f"SUCCESS: worst loop stall {worst_gap * 1000:.1f} ms, {stats}")
+
+
+if __name__ == "__main__":
+    test_tenants_and_stock()
+    test_transactions_and_ledger()
+    test_batches_and_history_paging()
+    test_sqlite_logic_tree_compiles_to_parameters()
+    test_sqlite_lock_held_elsewhere_never_stalls_the_loop()
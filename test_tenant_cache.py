@@ -0,0 +1,57 @@
+import asyncio
+import os
+from unittest.mock import MagicMock, AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import services.db as db
+from services.tenant_cache import TenantCache
+
+
+def _mock_supabase(rows):
+    client = MagicMock()
+    execute = AsyncMock(return_value=MagicMock(data=rows))
+    client.table.return_value.select.return_value.eq.return_value.execute = execute
+    client.table.return_value.insert.return_value.execute = AsyncMock(
+        return_value=MagicMock(data=[{"id": "t-2", "phone_number": "+923009999999"}])
+    )
+    return client, execute
+
+
+def test_cached_lookups_skip_the_database():
+    print("--- Testing tenant cache hits ---")
+    client, execute = _mock_supabase([{"id": "t-1", "phone_number": "+923001234567"}])
+    with patch.object(db, "supabase", client), patch.object(db, "tenant_cache", TenantCache()) as cache:
+        async def run():
+            first = await db.get_tenant_by_phone("whatsapp:+923001234567")
+            second = await db.get_tenant_by_phone("+92 300 1234567")
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first == second == {"id": "t-1", "phone_number": "+923001234567"}
+        assert execute.await_count == 1
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    print("SUCCESS: second lookup served from cache.")
+
+
+def test_unregistered_numbers_are_negatively_cached_until_register():
+    print("--- Testing negative caching + invalidation ---")
+    client, execute = _mock_supabase([])
+    with patch.object(db, "supabase", client), patch.object(db, "tenant_cache", TenantCache()) as cache:
+        async def run():
+            assert await db.get_tenant_by_phone("+923009999999") is None
+            assert await db.get_tenant_by_phone("+923009999999") is None
+            await db.create_tenant("+923009999999", "Spam Shop")
+            return await db.get_tenant_by_phone("+923009999999")
+
+        tenant = asyncio.run(run())
+        assert execute.await_count == 1
+        assert tenant["id"] == "t-2"
+        assert cache.stats()["negative_hits"] == 1
+    print("SUCCESS: 'not registered' cached, and create_tenant invalidated it.")
+
+
+if __name__ == "__main__":
+    test_cached_lookups_skip_the_database()
+    test_unregistered_numbers_are_negatively_cached_until_register()
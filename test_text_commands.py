@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+from models.extraction import Extraction
+from services.text_commands import parse_text_command, try_parse_text_command
+
+COMMANDS = [
+    ("50 bori aalu aaye", {"intent": "UPDATE", "item_name": "Potato", "quantity": 50, "unit": "Bori", "action": "IN"}),
+    ("tamatar kitna hai", {"intent": "QUERY", "item_name": "Tomato"}),
+    ("do sau kg adrak aa gaye", {"intent": "UPDATE", "item_name": "Ginger", "quantity": 200, "action": "IN"}),
+    ("20 peti tamatar kharab ho gaye", {"intent": "UPDATE", "quantity": 20, "unit": "Peti", "action": "OUT"}),
+    ("Rashid bhai ko 10 gaddi pyaz 500 ke rate par udhaar de diye",
+     {"intent": "SALE", "item_name": "Onion", "quantity": 10, "buyer_name": "Rashid Bhai", "rate": 500, "is_credit": True}),
+    ("Imam ko 35 kg tamatar bheje 200 rupay cash",
+     {"intent": "SALE", "buyer_name": "Imam", "quantity": 35, "rate": 200, "is_credit": False}),
+    ("teen hazaar paanch sau kilo lehsan aaya", {"intent": "UPDATE", "item_name": "Garlic", "quantity": 3500}),
+    ("aaj kitna becha", {"intent": "QUERY", "query_type": "DAILY_SALES", "item_name": None}),
+    ("Rashid bhai ka udhaar kitna hai", {"intent": "QUERY", "query_type": "BUYER_BALANCE", "buyer_name": "Rashid Bhai"}),
+]
+
+# Not confident -> Gemini
+UNSURE = ["kal ki meeting ka kya hua", "aalu", "50 bori aalu aur 20 gaddi pyaz aaye", "Salaam",
+          # Negations and questions about a movement, prices
+          "50 bori aalu nahi aaye", "50 bori aalu nahin aaye", "kya 50 bori aalu aaye", "50 bori aalu aaye ya nahi",
+          "Rashid bhai ko 10 gaddi pyaz mat bhejo", "50 bori aalu kitne aaye", "aalu ka rate kitna hai",
+          "pyaz ka bhao kya hai",
+          # Two numbers, two units or opposite movements in one message
+          "50 bori aalu aaye 10 gaye", "50 bori aalu aur 20 bori aalu aaye", "10 bori aalu diye 2 bori wapis aaye",
+          "50 bori aalu aaye 10 bori nikle", "50 bori 20 kg aalu aaye", "10 bori aalu aaye aur bech diye"]
+
+
+def test_commands_parse_locally():
+    print("--- Testing text command fast path ---")
+    for text, expected in COMMANDS:
+        extraction = try_parse_text_command(text)
+        assert extraction is not None, text
+        for field, value in expected.items():
+            assert getattr(extraction, field) == value, (text, field, getattr(extraction, field))
+        if extraction.intent != "QUERY":
+            assert extraction.summary_for_user.startswith("Ji Boss")
+    for text in UNSURE:
+        assert try_parse_text_command(text) is None, text
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        parse_text_command(COMMANDS[4][0])
+    per_call = (time.perf_counter() - start) / 1000
+    print(f"SUCCESS: {per_call * 1e6:.1f} us per command")
+    assert per_call < 0.001
+
+
+def test_low_confidence_falls_back_to_gemini():
+    import services.whatsapp_pipeline as pipeline
+
+    gemini = AsyncMock(return_value=Extraction(intent="UNKNOWN"))
+    with patch.object(pipeline, "process_text_message", gemini):
+        fast = asyncio.run(pipeline.extract_text("50 bori aalu aaye"))
+        slow = asyncio.run(pipeline.extract_text("kal ki meeting ka kya hua"))
+    assert fast.item_name == "Potato" and slow.intent == "UNKNOWN"
+    gemini.assert_awaited_once_with("kal ki meeting ka kya hua", None)
+
+
+if __name__ == "__main__":
+    test_commands_parse_locally()
+    test_low_confidence_falls_back_to_gemini()
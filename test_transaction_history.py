@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+from urllib.parse import urlsplit, parse_qsl
+
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "dummy-key")
+
+import services.db as db
+
+# Local stand-in for PostgREST's read API over a SQLite copy of the
+# transactions table. It translates the filters get_transactions_page sends
+# (eq/gte/lte/lt/ilike, the keyset `or`, order, limit, offset) into SQL, so the
+# real query builder and cursor handling are exercised end to end.
+
+SCHEMA = """
+    CREATE TABLE transactions (
+        id TEXT PRIMARY KEY, tenant_id TEXT, transaction_type TEXT, item_name TEXT, quantity REAL,
+        unit TEXT, rate REAL, total_amount REAL, buyer_name TEXT, is_credit INTEGER, created_at TEXT
+    );
+    CREATE INDEX transactions_tenant_created_idx ON transactions (tenant_id, created_at DESC, id DESC);
+    CREATE INDEX transactions_tenant_item_created_idx ON transactions (tenant_id, item_name, created_at DESC, id DESC);
+"""
+OPS = {"eq": "=", "gte": ">=", "lte": "<=", "lt": "<", "gt": ">"}
+KEYSET = re.compile(r'^\(created_at\.lt\."(.+?)",and\(created_at\.eq\."(.+?)",id\.lt\."(.+?)"\)\)$')
+COLUMN = re.compile(r"^[a-z_]+$")
+
+
+def _value(raw: str):
+    return {"true": 1, "false": 0}.get(raw.lower(), raw)
+
+
+def to_sql(query: str):
+    """PostgREST query string -> (sql, params) for the transactions table."""
+    where, params = [], []
+    columns, order, limit, offset = "*", "", "", ""
+    for key, raw in parse_qsl(query):
+        if key == "select":
+            assert all(COLUMN.match(c) for c in raw.split(","))
+            columns = raw
+        elif key == "order":
+            order = " ORDER BY " + ", ".join(
+                f"{c.split('.')[0]} {'DESC' if c.endswith('.desc') else 'ASC'}" for c in raw.split(",")
+            )
+        elif key == "limit":
+            limit = f" LIMIT {int(raw)}"
+        elif key == "offset":
+            offset = f" OFFSET {int(raw)}"
+        elif key == "or":
+            lt, eq, row_id = KEYSET.match(raw).groups()
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params += [lt, eq, row_id]
+        else:
+            assert COLUMN.match(key)
+            op, value = raw.split(".", 1)
+            if op == "ilike":
+                where.append(f"{key} LIKE ? ESCAPE '\\'")
+            else:
+                where.append(f"{key} {OPS[op]} ?")
+            params.append(_value(value))
+    sql = f"SELECT {columns} FROM transactions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if offset and not limit:
+        limit = " LIMIT -1"
+    return sql + order + limit + offset, params
+
+
+class FakeReadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        sql, params = to_sql(urlsplit(self.path).query)
+        conn = sqlite3.connect(self.server.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = [dict(r) for r in conn.execute(sql, params)]
+        finally:
+            conn.close()
+        for row in rows:
+            if "is_credit" in row:
+                row["is_credit"] = bool(row["is_credit"])
+        body = json.dumps(rows).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeReadServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def generate_rows(count: int, tenant_id: str = "tenant-1", seed: int = 7):
+    """Synthetic ledger: several rows share each timestamp, so the id tiebreak matters."""
+    rng = random.Random(seed)
+    items = ["Potato", "Tomato", "Onion", "Ginger", "Garlic", "Chili"]
+    buyers = ["Rashid Bhai", "Imam", "Chacha Aslam", "Bilal Traders", None]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        sale = rng.random() < 0.7
+        qty = rng.randint(1, 100)
+        rate = rng.randint(50, 500) if sale else None
+        yield (
+            str(uuid.UUID(int=rng.getrandbits(128), version=4)), tenant_id,
+            "SALE" if sale else "PURCHASE", rng.choice(items), qty, "kg", rate,
+            qty * rate if rate else None, rng.choice(buyers) if sale else None,
+            int(sale and rng.random() < 0.3),
+            (start + timedelta(seconds=i // 3)).isoformat(timespec="microseconds"),
+        )
+
+
+def start_fake_postgrest(rows):
+    db_path = os.path.join(tempfile.mkdtemp(), "transactions.sqlite3")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    server = FakeReadServer(("127.0.0.1", 0), FakeReadHandler)
+    server.db_path = db_path
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def walk(**filters):
+    """All pages for a filter set; returns (rows, page count)."""
+    rows, pages, cursor = [], 0, None
+    while True:
+        page = await db.get_transactions_page("tenant-1", limit=7, cursor=cursor, **filters)
+        rows += page["transactions"]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return rows, pages
+
+
+def test_keyset_pages_cover_history_exactly_once():
+    print("--- Walking transaction history page by page ---")
+    data = list(generate_rows(200))
+    data.append(("ffffffff-0000-4000-8000-000000000000", "tenant-2", "SALE", "Potato", 1, "kg", 1, 1, None, 0,
+                 data[-1][-1]))
+    server = start_fake_postgrest(data)
+    mine = [r for r in data if r[1] == "tenant-1"]
+    newest_first = sorted(mine, key=lambda r: (r[10], r[0]), reverse=True)
+
+    async def run():
+        with patch.object(db, "supabase", db.create_db_client(f"http://127.0.0.1:{server.server_address[1]}", "k")):
+            try:
+                everything = await walk()
+                potato = await walk(item_name="Potato")
+                credit = await walk(buyer_name="rashid", credit_only=True)
+                window = await walk(since=mine[30][10], until=mine[60][10])
+                try:
+                    await db.get_transactions_page("tenant-1", cursor="not-a-cursor")
+                    bad_cursor = False
+                except ValueError:
+                    bad_cursor = True
+                return everything, potato, credit, window, bad_cursor
+            finally:
+                await db.close_db()
+
+    everything, potato, credit, window, bad_cursor = asyncio.run(run())
+    server.shutdown()
+
+    rows, pages = everything
+    assert [r["id"] for r in rows] == [r[0] for r in newest_first]
+    assert pages == -(-len(mine) // 7)
+    assert set(rows[0]) == set(db.TRANSACTION_COLUMNS.split(","))
+    assert [r["id"] for r in potato[0]] == [r[0] for r in newest_first if r[3] == "Potato"]
+    assert [r["id"] for r in credit[0]] == [r[0] for r in newest_first if r[8] == "Rashid Bhai" and r[9]]
+    assert [r["id"] for r in window[0]] == [r[0] for r in newest_first if mine[30][10] <= r[10] < mine[60][10]]
+    assert bad_cursor
+    print(f"SUCCESS: {len(rows)} rows in {pages} pages, no duplicates or gaps")
+
+
+if __name__ == "__main__":
+    test_keyset_pages_cover_history_exactly_once()